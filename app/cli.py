@@ -0,0 +1,277 @@
+"""
+Offline bulk grading.
+
+    python -m app.cli grade --concept-sheet sheet.png --input scans/ --out results.jsonl
+    python -m app.cli grade --concept-sheet sheet.png --manifest students.jsonl --out results.jsonl --workers 8
+
+--input is a directory with one subdirectory per student (files named question*/solution* are
+questions and solutions, anything else is a combined submission) or with one combined document
+per student. A --manifest has one JSON object per line:
+{"student_id": ..., "questions": [...], "solutions": [...], "submissions": [...], "class_id": ...}
+
+Every model call is checkpointed under --checkpoints; rerunning the same command after an
+interruption skips finished students and replays finished calls from disk.
+
+    python -m app.cli receive --port 8799 --out notifications.jsonl
+
+runs a local webhook receiver (a stand-in for a real one in tests): it checks each notification's
+signature against WEBHOOK_SECRET and appends the accepted ones to --out.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from app.config.settings import DOCUMENT_EXTENSIONS
+
+INPUT_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'} | DOCUMENT_EXTENSIONS
+
+def natural_key(path):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", os.path.basename(path))]
+
+def student_files(directory):
+    """Questions, solutions and combined submissions of one student directory"""
+    files = sorted((os.path.join(directory, f) for f in os.listdir(directory)
+                    if os.path.splitext(f.lower())[1] in INPUT_EXTENSIONS), key=natural_key)
+    roles = {"questions": [], "solutions": [], "submissions": []}
+    for path in files:
+        name = os.path.basename(path).lower()
+        role = "questions" if name.startswith(("question", "q_")) else "solutions" if name.startswith(("solution", "s_")) else "submissions"
+        roles[role].append(path)
+    return roles
+
+def items_from_directory(directory, class_id=None):
+    """One grading item per student subdirectory, or per combined document when there are none"""
+    items = []
+    for entry in sorted(os.listdir(directory), key=natural_key):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path):
+            items.append({"student_id": entry, "class_id": class_id, **student_files(path)})
+        elif os.path.splitext(entry.lower())[1] in INPUT_EXTENSIONS:
+            items.append({"student_id": os.path.splitext(entry)[0], "class_id": class_id,
+                          "questions": [], "solutions": [], "submissions": [path]})
+    return items
+
+def items_from_manifest(manifest_path, class_id=None):
+    """Grading items from a JSONL manifest; relative paths are relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    items = []
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "student_id" not in entry:
+                raise ValueError(f"{manifest_path}:{line_no}: missing student_id")
+            item = {"student_id": str(entry["student_id"]), "class_id": entry.get("class_id", class_id)}
+            for role in ("questions", "solutions", "submissions"):
+                item[role] = [p if os.path.isabs(p) else os.path.join(base, p) for p in entry.get(role, [])]
+            if entry.get("concept_sheet"):
+                item["concept_sheet"] = entry["concept_sheet"] if os.path.isabs(entry["concept_sheet"]) else os.path.join(base, entry["concept_sheet"])
+            items.append(item)
+    return items
+
+def validate_item(item):
+    """Reason an item can't be graded, or None"""
+    if item["submissions"]:
+        return None
+    if not item["questions"] or not item["solutions"]:
+        return "needs question and solution files or a combined submission"
+    return None
+
+def completed_items(out_path):
+    """Student ids already written to the output with status ok"""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut off by an interruption
+            if record.get("status") == "ok":
+                done.add(record["student_id"])
+    return done
+
+def grade_item(item, concept_sheet, page_roles, checkpoint, crop_pool):
+    """Run the pipeline for one student and return its output record"""
+    from app.services.orchestrator import run_pipeline
+    from app.services.runs import load_manifest
+
+    started = time.time()
+    record = {"student_id": item["student_id"], "class_id": item.get("class_id")}
+    try:
+        result = run_pipeline(
+            item.get("concept_sheet", concept_sheet), item["questions"], item["solutions"], item["submissions"],
+            page_roles=page_roles, student_id=item["student_id"], class_id=item.get("class_id"),
+            checkpoint=checkpoint, crop_pool=crop_pool,
+        )
+    except Exception as e:
+        return dict(record, status="failed", error=str(e), seconds=round(time.time() - started, 2))
+    if not result.get("analysis_table"):
+        return dict(record, status="failed", run_id=result.get("run_id"), error="no results",
+                    seconds=round(time.time() - started, 2))
+    manifest = load_manifest(result["run_id"]) or {}
+    problems = [p for page in manifest.get("pages", []) for p in page["problems"]]
+    return dict(
+        record,
+        status="ok",
+        run_id=result["run_id"],
+        problems=len(problems),
+        correct=sum(1 for p in problems if p["result"].get("is_correct")),
+        fill_data=manifest.get("fill_data", {}),
+        analysis_table=result["analysis_table"],
+        seconds=round(time.time() - started, 2),
+    )
+
+def check_concept_sheets(paths):
+    """Stop before grading anything if a concept sheet is missing or a malformed table"""
+    from app.services.concept_tables import ConceptTableError, is_concept_table, parse_concept_table
+
+    for path in sorted(paths):
+        if not os.path.isfile(path):
+            sys.exit(f"Concept sheet not found: {path}")
+        if is_concept_table(path):
+            try:
+                parse_concept_table(path)
+            except ConceptTableError as e:
+                sys.exit(f"Invalid concept sheet {path}: {e}")
+
+def grade_command(args):
+    from app.services.checkpoints import Checkpoints
+
+    if bool(args.input) == bool(args.manifest):
+        sys.exit("Give exactly one of --input or --manifest")
+    items = items_from_directory(args.input, args.class_id) if args.input else items_from_manifest(args.manifest, args.class_id)
+    check_concept_sheets({args.concept_sheet} | {item["concept_sheet"] for item in items if item.get("concept_sheet")})
+    done = completed_items(args.out)
+    pending, skipped = [], []
+    for item in items:
+        if item["student_id"] in done:
+            continue
+        reason = validate_item(item)
+        (skipped if reason else pending).append((item, reason))
+    print(f"[CLI] {len(items)} students: {len(done)} already graded, {len(skipped)} invalid, {len(pending)} to grade")
+
+    checkpoint = Checkpoints(args.checkpoints or f"{args.out}.checkpoints")
+    # Spawned processes don't inherit this process's threads and locks
+    crop_pool = (ProcessPoolExecutor(max_workers=args.processes, mp_context=multiprocessing.get_context("spawn"))
+                 if args.processes > 0 else None)
+    write_lock = threading.Lock()
+    started = time.time()
+    counts = {"ok": 0, "failed": 0}
+
+    with open(args.out, "a", encoding="utf-8") as out:
+        def write(record):
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+
+        for item, reason in skipped:
+            write({"student_id": item["student_id"], "class_id": item.get("class_id"), "status": "invalid", "error": reason})
+
+        executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk-grade")
+        try:
+            futures = {executor.submit(grade_item, item, args.concept_sheet, args.page_roles, checkpoint, crop_pool): item
+                       for item, _ in pending}
+            for n, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                counts[record["status"]] += 1
+                write(record)
+                rate = n / max(time.time() - started, 1e-6) * 60
+                print(f"[CLI] {n}/{len(pending)} {record['student_id']}: {record['status']} ({rate:.1f} students/min)")
+        except KeyboardInterrupt:
+            print("[CLI] Interrupted; finished work is checkpointed, rerun the same command to resume")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            if crop_pool is not None:
+                crop_pool.shutdown()
+
+    print(f"[CLI] Done in {time.time() - started:.1f}s: {counts['ok']} graded, {counts['failed']} failed; "
+          f"checkpoints reused {checkpoint.hits}, computed {checkpoint.misses}")
+    return 1 if counts["failed"] else 0
+
+def receive_command(args):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from app.config.settings import WEBHOOK_SECRET
+    from app.services.webhooks import SIGNATURE_HEADER, verify
+
+    secret = args.secret or WEBHOOK_SECRET
+    lock = threading.Lock()
+    seen = set()
+    state = {"failures": args.fail_first}
+
+    class Receiver(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            delivery = self.headers.get("X-Grader-Delivery")
+            with lock:
+                if state["failures"] > 0:
+                    state["failures"] -= 1
+                    return self._answer(503)
+                if secret and not verify(secret, self.headers.get(SIGNATURE_HEADER), body):
+                    print(f"[Receiver] Rejected {delivery}: bad signature")
+                    return self._answer(401)
+                if delivery in seen:
+                    return self._answer(200)
+                seen.add(delivery)
+                notification = json.loads(body)
+                print(f"[Receiver] {notification['type']} (attempt {self.headers.get('X-Grader-Attempt')}): "
+                      f"job {notification['data'].get('job_id')} batch {notification['data'].get('batch_id')}")
+                if args.out:
+                    with open(args.out, "a", encoding="utf-8") as out:
+                        out.write(json.dumps(notification, ensure_ascii=False) + "\n")
+            self._answer(200)
+
+        def _answer(self, status):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((args.host, args.port), Receiver)
+    print(f"[Receiver] Listening on http://{args.host}:{args.port}/" + ("" if secret else " (signatures not checked)"))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    grade = commands.add_parser("grade", help="grade many students offline")
+    grade.add_argument("--concept-sheet", required=True, help="image, or a CSV/JSON/Markdown/XLSX table of concepts")
+    grade.add_argument("--input", help="directory of student folders or combined documents")
+    grade.add_argument("--manifest", help="JSONL manifest of students")
+    grade.add_argument("--out", required=True, help="JSONL results file (appended to; finished students are skipped)")
+    grade.add_argument("--checkpoints", help="checkpoint directory (default: <out>.checkpoints)")
+    grade.add_argument("--workers", type=int, default=4, help="students graded concurrently (model calls are I/O bound)")
+    grade.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                       help="processes for page segmentation (0 segments in the worker threads)")
+    grade.add_argument("--page-roles", choices=["order", "marker"], default="order")
+    grade.add_argument("--class-id", help="class of every student without one in the manifest")
+    receive = commands.add_parser("receive", help="run a local webhook receiver")
+    receive.add_argument("--host", default="127.0.0.1")
+    receive.add_argument("--port", type=int, default=8799)
+    receive.add_argument("--out", help="JSONL file the accepted notifications are appended to")
+    receive.add_argument("--secret", help="signing secret (default: WEBHOOK_SECRET)")
+    receive.add_argument("--fail-first", type=int, default=0, help="answer the first N deliveries with 503, to exercise retries")
+    args = parser.parse_args(argv)
+    if args.command == "grade":
+        return grade_command(args)
+    if args.command == "receive":
+        return receive_command(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
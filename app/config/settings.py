@@ -7,6 +7,136 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_KEY_HERE")
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+PROMPTS_DIR = os.path.join(BASE_DIR, "prompts")
 PHASE1_PROMPT_PATH = os.path.join(BASE_DIR, "prompts", "phase1_prompt.txt")
 PHASE2_PROMPT_PATH = os.path.join(BASE_DIR, "prompts", "phase2_prompt.txt")
 STATIC_OUTPUT_DIR = os.path.join(BASE_DIR, "static", "output")
+RUNS_DIR = os.path.join(STATIC_OUTPUT_DIR, "runs")
+# Local state that must never be served with the results (analytics database, media handle cache)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+# Stored runs (inputs, crops, results) are deleted after RUN_RETENTION_DAYS (0 = kept forever), oldest
+# first once they take more than RUNS_MAX_MB (0 = no cap); a sweep runs at most every RUN_SWEEP_INTERVAL_SECONDS
+RUN_RETENTION_DAYS = float(os.getenv("RUN_RETENTION_DAYS", "30"))
+RUNS_MAX_MB = float(os.getenv("RUNS_MAX_MB", "0"))
+RUN_SWEEP_INTERVAL_SECONDS = float(os.getenv("RUN_SWEEP_INTERVAL_SECONDS", "600"))
+
+# Document ingestion (multi-page PDF / TIFF)
+# Multi-page formats that are rasterized page by page
+DOCUMENT_EXTENSIONS = {'.pdf', '.tif', '.tiff'}
+RASTER_DPI = int(os.getenv("RASTER_DPI", "200"))
+MAX_DOCUMENT_PAGES = int(os.getenv("MAX_DOCUMENT_PAGES", "60"))
+
+# Concept sheets given as tables are parsed locally instead of by the model
+CONCEPT_TABLE_EXTENSIONS = {'.csv', '.json', '.md', '.markdown', '.xlsx'}
+
+# Drop blank, trivial and duplicate crops before they become model calls
+CROP_FILTER_ENABLED = os.getenv("CROP_FILTER_ENABLED", "true").lower() == "true"
+
+# Background grading jobs (/api/jobs); they run under admission control, which bounds how many grade at once
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+# Report rendering: optional map of concept id -> [x, y, w, h] of its Status cell on the concept sheet image
+COORDS_TEMPLATE_PATH = os.getenv("COORDS_TEMPLATE_PATH", os.path.join(BASE_DIR, "data", "coords_template.json"))
+
+# Class analytics counters (SQLite)
+ANALYTICS_DB_PATH = os.getenv("ANALYTICS_DB_PATH", os.path.join(DATA_DIR, "analytics.sqlite3"))
+
+# Concept routing: shortlist the concepts sent with each Phase 1 call from a cheap transcription
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+ROUTING_TOP_K = int(os.getenv("ROUTING_TOP_K", "5"))
+# Smaller concept sheets are sent whole; the transcription call would cost more than it saves
+ROUTING_MIN_CONCEPTS = int(os.getenv("ROUTING_MIN_CONCEPTS", "8"))
+ROUTING_MODEL = os.getenv("ROUTING_MODEL", "gemini-2.5-flash-lite")
+
+# Model per stage
+CONCEPT_MODEL = os.getenv("CONCEPT_MODEL", "gemini-2.5-flash")
+PHASE1_MODEL = os.getenv("PHASE1_MODEL", "gemini-2.5-flash")
+PHASE2_MODEL = os.getenv("PHASE2_MODEL", "gemini-2.5-flash")
+
+# Grading cascade: a cheap screening pass answers the problem and compares final answers locally;
+# only wrong, unreadable or low-confidence answers get the full Phase 1 analysis
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+SCREEN_MODEL = os.getenv("SCREEN_MODEL", "gemini-2.5-flash-lite")
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.8"))
+
+# Local answer checking (symbolic with sympy when installed)
+ANSWER_CHECK_BUDGET_SECONDS = float(os.getenv("ANSWER_CHECK_BUDGET_SECONDS", "0.5"))
+# Worker processes for symbolic checks; one over its budget is killed and replaced
+ANSWER_CHECK_WORKERS = int(os.getenv("ANSWER_CHECK_WORKERS", "2"))
+# Regrade Phase 1 results whose verdict the local check clearly contradicts
+VERIFY_VERDICTS = os.getenv("VERIFY_VERDICTS", "true").lower() == "true"
+
+# Stage graph of one grading run: tasks run concurrently (cropping, Phase 1 calls) and
+# at most this many page pairs are decoded ahead of the cropping
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+PIPELINE_LOOKAHEAD = int(os.getenv("PIPELINE_LOOKAHEAD", "4"))
+
+# Upload-once media: images above the inline limit are uploaded once (keyed by content hash) and
+# referenced by handle in later calls; uploaded files live 48h on the server, handles are kept for less
+MEDIA_UPLOAD_ENABLED = os.getenv("MEDIA_UPLOAD_ENABLED", "true").lower() == "true"
+MEDIA_INLINE_MAX_BYTES = int(os.getenv("MEDIA_INLINE_MAX_BYTES", str(64 * 1024)))
+MEDIA_HANDLE_TTL_SECONDS = int(os.getenv("MEDIA_HANDLE_TTL_SECONDS", str(46 * 3600)))
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", os.path.join(DATA_DIR, "media_handles.json"))
+# Alternative API endpoint (a local stand-in server in tests)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")
+
+# Recorded model responses for offline evaluation: "live", "record" (store every response) or
+# "replay" (answer from RESPONSES_DIR only, no API key needed)
+RESPONSES_MODE = os.getenv("RESPONSES_MODE", "live").lower()
+RESPONSES_DIR = os.getenv("RESPONSES_DIR", os.path.join(STATIC_OUTPUT_DIR, "responses"))
+
+# Phase 1 verbosity: "minimal" (concept, final answers, verdict, short status), "standard" (+ error
+# type) or "full" (transcriptions and a written diagnosis); minimal and standard cap their output tokens
+PHASE1_VERBOSITY = os.getenv("PHASE1_VERBOSITY", "standard").lower()
+# When the full diagnosis of a problem graded at a lower tier is fetched: "incorrect" (during
+# grading, for wrong answers) or "on_demand" (only when requested through the API)
+PHASE1_DETAIL = os.getenv("PHASE1_DETAIL", "incorrect").lower()
+
+# Admission control for /api/analyze, /api/jobs and revisions: gradings running at once, gradings
+# waiting for a slot, per-client share of both, and the longest estimated wait still accepted
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_PER_CLIENT = int(os.getenv("ADMISSION_PER_CLIENT", "4"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "300"))
+# Grading time assumed for wait estimates until real gradings have been timed
+ADMISSION_INITIAL_ESTIMATE_SECONDS = float(os.getenv("ADMISSION_INITIAL_ESTIMATE_SECONDS", "30"))
+
+# End-to-end time budget of one grading request (seconds, 0 = none); a client may ask for less with the
+# X-Deadline-Seconds header. Model calls stop DEADLINE_RESERVE_SECONDS before the deadline so the results
+# can still be written; problems not graded by then are returned as pending, and Phase 2 gives way to a
+# local summary when problems are pending or less than DEADLINE_PHASE2_SECONDS are left
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "270"))
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", "5"))
+DEADLINE_PHASE2_SECONDS = float(os.getenv("DEADLINE_PHASE2_SECONDS", "20"))
+# A model call isn't started with less than this left of the budget
+DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", "3"))
+# Longest single model call per stage (e.g. PHASE1_TIMEOUT_SECONDS), so one hung call can't stall a run
+MODEL_TIMEOUT_SECONDS = {
+    stage: float(os.getenv(f"{stage.upper()}_TIMEOUT_SECONDS", default))
+    for stage, default in {"concepts": "90", "transcription": "20", "screen": "30", "phase1": "60", "phase2": "90"}.items()
+}
+
+# Result serving: text results of at least this size are sent compressed (brotli when installed,
+# else gzip); content-addressed result URLs may be cached by clients for RESULT_MAX_AGE_SECONDS
+RESULT_COMPRESS_MIN_BYTES = int(os.getenv("RESULT_COMPRESS_MIN_BYTES", "512"))
+RESULT_MAX_AGE_SECONDS = int(os.getenv("RESULT_MAX_AGE_SECONDS", str(365 * 24 * 3600)))
+
+# Completion webhooks: notifications are signed with WEBHOOK_SECRET (HMAC-SHA256; http(s) callbacks are
+# refused without one), sent by WEBHOOK_WORKERS background threads and retried with doubling backoff up to
+# WEBHOOK_MAX_ATTEMPTS times; at most WEBHOOK_MAX_PENDING wait at once, newer ones are dropped beyond that
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+WEBHOOK_RETRY_SECONDS = float(os.getenv("WEBHOOK_RETRY_SECONDS", "2"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "300"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+# Progress notifications of one job are at least this far apart; finer progress waits for the next one
+WEBHOOK_PROGRESS_INTERVAL_SECONDS = float(os.getenv("WEBHOOK_PROGRESS_INTERVAL_SECONDS", "5"))
+# Hosts http(s) callbacks may point at (comma separated). Empty allows any host whose addresses are all
+# public; loopback, private, link-local and other reserved addresses are only reachable through a listed host
+WEBHOOK_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()]
+# queue://<name> callbacks (in-process queues standing in for a receiver) are for tests and local
+# development only; at most WEBHOOK_MAX_LOCAL_QUEUES of them exist at once
+WEBHOOK_LOCAL_QUEUES = os.getenv("WEBHOOK_LOCAL_QUEUES", "false").lower() == "true"
+WEBHOOK_MAX_LOCAL_QUEUES = int(os.getenv("WEBHOOK_MAX_LOCAL_QUEUES", "16"))
@@ -1,8 +1,22 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import re
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.routes import grading
+from app.services.admission import ADMISSION, Rejected
+from app.services.startup import READINESS
 
-app = FastAPI(title="Auto Math Grader System", version="1.0.0")
+# Endpoints that start a grading and go through admission control
+GRADING_PATHS = re.compile(r"^/api/(analyze|jobs|runs/[^/]+/revise)/?$")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the grading stack and build the Gemini client in the background; /api/health answers meanwhile
+    READINESS.start()
+    yield
+
+app = FastAPI(title="Auto Math Grader System", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -11,6 +25,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.reason, "retry_after": exc.retry_after},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.middleware("http")
+async def admission_precheck(request: Request, call_next):
+    # Refuse a grading while saturated before its uploads are read into the server
+    if request.method == "POST" and GRADING_PATHS.match(request.url.path):
+        try:
+            ADMISSION.check(grading.client_id(request))
+        except Rejected as exc:
+            return await rejected_handler(request, exc)
+    return await call_next(request)
+
 app.include_router(grading.router, prefix="/api")
 
 @app.get("/")
@@ -1,44 +1,241 @@
 import os
+import json
 import shutil
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-from app.services.orchestrator import run_pipeline
-from tempfile import TemporaryDirectory
-from typing import List
+import asyncio
+from PIL import Image
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from app.services.runs import run_dir, load_manifest
+from app.config.settings import (DOCUMENT_EXTENSIONS, CONCEPT_TABLE_EXTENSIONS, ADMISSION_MAX_WAIT_SECONDS,
+                                 RESULT_MAX_AGE_SECONDS)
+from app.services.jobs import JOBS, BATCHES
+from app.services.render import FORMATS, DEFAULT_FORMAT, render_run
+from app.services.analytics import ANALYTICS
+from app.services.admission import ADMISSION, Rejected
+from app.services.concept_tables import ConceptTableError, is_concept_table, parse_concept_table
+from app.services.deadline import request_deadline
+from app.services.webhooks import WEBHOOKS, ProgressNotifier, check_target
+from app.services.results import content_digest, negotiate_coding, encoded_copy, entity_tag, matches, render_bundle
+from tempfile import TemporaryDirectory, mkdtemp
+from typing import List, Optional
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up, even while the grading stack is still warming up"""
     return {"status": "healthy", "service": "Auto Math Grader System"}
 
+@router.get("/ready")
+async def readiness_check():
+    """Readiness: 503 until the background warm-up has loaded the grading stack"""
+    from app.services.startup import READINESS
+    status = READINESS.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@router.get("/admission")
+async def admission_metrics():
+    """Gradings in flight, queue depth, wait estimate and rejection counters"""
+    return ADMISSION.metrics()
+
+def client_id(request: Request) -> str:
+    """Client a grading counts against: the X-Client-Id header, else the caller's address"""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+def deadline_of(request: Request):
+    """Deadline of a grading request, started on arrival so queueing for a slot spends it too"""
+    return request_deadline(request.headers.get("x-deadline-seconds"))
+
+async def run_until_disconnect(request: Request, fn, *args, **kwargs):
+    """fn(*args, deadline=..., **kwargs) in the threadpool, cancelling the deadline if the client hangs up meanwhile"""
+    deadline = kwargs["deadline"]
+
+    async def watch():
+        # The body has been read, so the next message is the disconnect
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        deadline.cancel("client disconnected")
+
+    watcher = asyncio.create_task(watch())
+    try:
+        return await run_in_threadpool(fn, *args, **kwargs)
+    finally:
+        watcher.cancel()
+
+@router.get("/prompts")
+async def prompt_templates():
+    """Versions and estimated token counts of the loaded prompt templates"""
+    from app.services.prompts import REGISTRY
+    return REGISTRY.describe()
+
+def serve_result(request: Request, path: str, media_type: str, immutable: bool = False,
+                 filename: Optional[str] = None, vary: str = "Accept-Encoding"):
+    """
+    A result file with a strong ETag, answering 304 when the client's copy is current, compressed
+    when the client accepts it. Immutable (content-addressed) URLs may be cached without revalidation.
+    """
+    digest = content_digest(path)
+    coding = negotiate_coding(request.headers.get("accept-encoding", ""), media_type, os.path.getsize(path))
+    tag = entity_tag(digest, coding)
+    headers = {
+        "ETag": tag,
+        "Cache-Control": f"public, max-age={RESULT_MAX_AGE_SECONDS}, immutable" if immutable else "no-cache",
+        "Vary": vary,
+    }
+    if matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    if coding:
+        headers["Content-Encoding"] = coding
+        path = encoded_copy(path, coding, digest)
+    return FileResponse(path, media_type=media_type, headers=headers, filename=filename)
+
+# Files of a run that may be downloaded; nothing else in the output directory is served
+RUN_RESULT_FILES = {"analysis_table.md", "detailed_analysis.txt"}
+# Media types of the files served from a run directory
+RESULT_MEDIA_TYPES = {".md": "text/markdown", ".txt": "text/plain", ".json": "application/json"}
+
+def media_type_of(path: str) -> str:
+    return RESULT_MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
 @router.get("/results/{filename}")
-async def get_result_file(filename: str):
+async def get_result_file(filename: str, request: Request):
     """Serve generated result files"""
     from app.config.settings import STATIC_OUTPUT_DIR
+    if filename not in RUN_RESULT_FILES:
+        raise HTTPException(status_code=404, detail="File not found")
     file_path = os.path.join(STATIC_OUTPUT_DIR, filename)
     
-    if not os.path.exists(file_path):
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    return serve_result(request, file_path, media_type_of(file_path))
+
+def negotiate_format(request: Request, format: Optional[str]) -> str:
+    """Report format from ?format=, else the first Accept media type we can render"""
+    if format:
+        if format not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format. Allowed: {', '.join(FORMATS)}")
+        return format
+    by_media_type = {media_type: fmt for fmt, media_type in FORMATS.items()}
+    for part in request.headers.get("accept", "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in by_media_type:
+            return by_media_type[media_type]
+    return DEFAULT_FORMAT
+
+@router.get("/results/{run_id}/report")
+def get_run_report(run_id: str, request: Request, format: Optional[str] = None):
+    """Report of a run in md, html, csv, json or png (concept sheet overlay), rendered on first request"""
+    fmt = negotiate_format(request, format)
+    try:
+        path = render_run(run_id, fmt)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return serve_result(request, path, FORMATS[fmt], filename=f"report_{run_id}.{fmt}", vary="Accept, Accept-Encoding")
+
+def run_result_path(run_id: str, filename: str) -> str:
+    """Path of a downloadable result file of a run; 404 if there is none"""
+    if filename not in RUN_RESULT_FILES:
         raise HTTPException(status_code=404, detail="File not found")
+    try:
+        file_path = os.path.join(run_dir(run_id), filename)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Run not found")
     
-    return FileResponse(file_path)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_path
+
+@router.get("/results/{run_id}/{filename}")
+async def get_run_result_file(run_id: str, filename: str, request: Request):
+    """Serve a result file of one run (revalidated by ETag; prefer the content-addressed URL)"""
+    file_path = run_result_path(run_id, filename)
+    return serve_result(request, file_path, media_type_of(file_path))
+
+@router.get("/results/{run_id}/{digest}/{filename}")
+async def get_immutable_result_file(run_id: str, digest: str, filename: str, request: Request):
+    """Serve a result file by content address; the URL changes whenever the content does, so it is cached for good"""
+    file_path = run_result_path(run_id, filename)
+    if content_digest(file_path) != digest:
+        raise HTTPException(status_code=404, detail="File not found")
+    return serve_result(request, file_path, media_type_of(file_path), immutable=True)
+
+@router.get("/runs/{run_id}/bundle")
+async def get_run_bundle(run_id: str, request: Request):
+    """
+    Analysis table, detailed analysis and every problem's result in one response. Finished runs
+    never change, so the bundle of a run id is cached for good.
+    """
+    try:
+        path = render_bundle(run_id)
+    except ValueError:
+        path = None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return serve_result(request, path, "application/json", immutable=True)
+
+@router.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    """Summary of a stored run: lineage, per-page status and problem results"""
+    manifest = load_manifest(run_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return {
+        "run_id": manifest["run_id"],
+        "parent_run_id": manifest.get("parent_run_id"),
+        "created": manifest.get("created"),
+        "files": {role: len(manifest["inputs"][role]) for role in ("questions", "solutions", "submissions")},
+        "pages": [
+            {
+                "index": page["index"],
+                "question_page": page.get("question_page"),
+                "solution_page": page.get("solution_page"),
+                "reused": page["reused"],
+                "problems": [{"problem": p["problem"], "confidence": p["confidence"], "result": p["result"]} for p in page["problems"]],
+            }
+            for page in manifest["pages"]
+        ],
+        "fill_data": manifest.get("fill_data", {}),
+        "recomputed_concepts": manifest.get("recomputed_concepts"),
+        **format_result(manifest_result(manifest)),
+    }
+
+@router.get("/runs/{run_id}/problems/{number}/detail")
+def get_problem_detail(run_id: str, number: int):
+    """Full diagnosis of one problem, requested from the model on first access if it was graded at a lower verbosity"""
+    from app.services.orchestrator import run_problem_detail
+    try:
+        detail = run_problem_detail(run_id, number)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Run not found")
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"run_id": run_id, "problem": number, **detail}
 
 # Allowed image file types
-ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
+# Questions and solutions may also be multi-page documents
+ALLOWED_EXTENSIONS = IMAGE_EXTENSIONS | DOCUMENT_EXTENSIONS
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # 50MB for multi-page scans
+PAGE_ROLE_MODES = {"order", "marker"}
 
-def validate_file(file: UploadFile, file_type: str) -> None:
+def validate_file(file: UploadFile, file_type: str, allowed_extensions=ALLOWED_EXTENSIONS) -> None:
     """Validate uploaded file type and size"""
     if not file.filename:
         raise HTTPException(status_code=400, detail=f"{file_type} filename is required")
     
     # Check file extension
     file_ext = os.path.splitext(file.filename.lower())[1]
-    if file_ext not in ALLOWED_EXTENSIONS:
+    if file_ext not in allowed_extensions:
         raise HTTPException(
             status_code=400, 
-            detail=f"{file_type} must be an image file. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+            detail=f"{file_type} must be an image or document file. Allowed types: {', '.join(sorted(allowed_extensions))}"
         )
     
     # Check file size (read first chunk to estimate)
@@ -46,74 +243,443 @@ def validate_file(file: UploadFile, file_type: str) -> None:
     file_size = file.file.tell()
     file.file.seek(0)  # Reset to beginning
     
-    if file_size > MAX_FILE_SIZE:
+    max_size = MAX_DOCUMENT_SIZE if file_ext in DOCUMENT_EXTENSIONS else MAX_FILE_SIZE
+    if file_size > max_size:
         raise HTTPException(
             status_code=400, 
-            detail=f"{file_type} file size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB"
+            detail=f"{file_type} file size exceeds maximum allowed size of {max_size // (1024*1024)}MB"
         )
 
-@router.post("/analyze")
-async def analyze(
-    concept_sheet: UploadFile = File(...),
-    questions: List[UploadFile] = File(...),
-    solutions: List[UploadFile] = File(...),
-):
-    try:
-        # Validate inputs
+def save_upload(file: UploadFile, tmpdir: str, name: str) -> str:
+    """Save an upload under tmpdir keeping its extension (ingestion dispatches on it)"""
+    file_ext = os.path.splitext(file.filename.lower())[1]
+    path = os.path.join(tmpdir, f"{name}{file_ext}")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file.file, f)
+    return path
+
+def validate_submission(concept_sheet, questions, solutions, submissions, page_roles) -> None:
+    """Validate the file counts, types and sizes of one grading request"""
+    if submissions:
+        if questions or solutions:
+            raise HTTPException(status_code=400, detail="Send either combined submissions or questions and solutions, not both")
+        if page_roles not in PAGE_ROLE_MODES:
+            raise HTTPException(status_code=400, detail=f"page_roles must be one of: {', '.join(sorted(PAGE_ROLE_MODES))}")
+        if len(submissions) > 5:
+            raise HTTPException(status_code=400, detail="Maximum 5 submission documents allowed")
+    else:
         if len(questions) == 0 or len(solutions) == 0:
             raise HTTPException(status_code=400, detail="At least one question and solution required")
         if len(questions) != len(solutions):
             raise HTTPException(status_code=400, detail="Number of questions and solutions must match")
         if len(questions) > 5:
             raise HTTPException(status_code=400, detail="Maximum 5 question-solution pairs allowed")
-        
-        # Validate concept sheet
-        validate_file(concept_sheet, "Concept sheet")
-        
-        # Validate all question files
-        for i, q in enumerate(questions):
-            validate_file(q, f"Question {i+1}")
-        
-        # Validate all solution files
-        for i, s in enumerate(solutions):
-            validate_file(s, f"Solution {i+1}")
+    
+    # Validate concept sheet (an image, or a table parsed without the model)
+    validate_file(concept_sheet, "Concept sheet", IMAGE_EXTENSIONS | CONCEPT_TABLE_EXTENSIONS)
+    
+    # Validate all question files
+    for i, q in enumerate(questions):
+        validate_file(q, f"Question {i+1}")
+    
+    # Validate all solution files
+    for i, s in enumerate(solutions):
+        validate_file(s, f"Solution {i+1}")
 
-        with TemporaryDirectory() as tmpdir:
-            concept_path = os.path.join(tmpdir, concept_sheet.filename)
-            with open(concept_path, "wb") as f:
-                shutil.copyfileobj(concept_sheet.file, f)
-
-            q_paths, s_paths = [], []
-            for i, q in enumerate(questions):
-                qpath = os.path.join(tmpdir, f"question_{i+1}.jpg")
-                with open(qpath, "wb") as f:
-                    shutil.copyfileobj(q.file, f)
-                q_paths.append(qpath)
-
-            for i, s in enumerate(solutions):
-                spath = os.path.join(tmpdir, f"solution_{i+1}.jpg")
-                with open(spath, "wb") as f:
-                    shutil.copyfileobj(s.file, f)
-                s_paths.append(spath)
+    # Validate all combined submission documents
+    for i, d in enumerate(submissions):
+        validate_file(d, f"Submission {i+1}")
+
+def parse_original_dimensions(raw: Optional[str]) -> dict:
+    """Parse the client's {"concept_sheet": [w, h], "questions": [[w, h], ...], ...} form field"""
+    if not raw:
+        return {}
+    try:
+        dimensions = json.loads(raw)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="original_dimensions must be valid JSON")
+    if not isinstance(dimensions, dict):
+        raise HTTPException(status_code=400, detail="original_dimensions must be a JSON object")
+    return dimensions
+
+def describe_upload(path: str, role: str, original_size=None) -> dict:
+    """Record what was received for one upload: bytes, pixel size as sent and as captured"""
+    info = {"role": role, "file": os.path.basename(path), "bytes": os.path.getsize(path), "size": None}
+    if os.path.splitext(path.lower())[1] in IMAGE_EXTENSIONS:
+        try:
+            with Image.open(path) as image:  # reads the header only
+                info["size"] = list(image.size)
+        except Exception:
+            pass
+    info["original_size"] = original_size or info["size"]
+    return info
+
+def save_submission(tmpdir, concept_sheet, questions, solutions, submissions, page_roles,
+                    original_dimensions=None) -> dict:
+    """Save all uploads under tmpdir and return the run_pipeline arguments"""
+    original_dimensions = original_dimensions or {}
+    concept_path = os.path.join(tmpdir, concept_sheet.filename)
+    with open(concept_path, "wb") as f:
+        shutil.copyfileobj(concept_sheet.file, f)
+    if is_concept_table(concept_path):
+        # Reject a malformed table now rather than after the pages are cropped
+        try:
+            parse_concept_table(concept_path)
+        except ConceptTableError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid concept sheet: {str(e)}")
+    args = {
+        "concept_sheet": concept_path,
+        "questions": [save_upload(q, tmpdir, f"question_{i+1}") for i, q in enumerate(questions)],
+        "solutions": [save_upload(s, tmpdir, f"solution_{i+1}") for i, s in enumerate(solutions)],
+        "submissions": [save_upload(d, tmpdir, f"submission_{i+1}") for i, d in enumerate(submissions)],
+        "page_roles": page_roles,
+    }
+
+    def original(role, i=None):
+        value = original_dimensions.get(role)
+        if i is not None:
+            value = value[i] if isinstance(value, list) and i < len(value) else None
+        return value
+
+    uploads = [describe_upload(concept_path, "concept_sheet", original("concept_sheet"))]
+    for role in ("questions", "solutions", "submissions"):
+        uploads.extend(describe_upload(path, role, original(role, i)) for i, path in enumerate(args[role]))
+    for info in uploads:
+        print(f"[Upload] {info['role']} {info['file']}: {info['bytes']} bytes, size {info['size']}, original {info['original_size']}")
+    args["uploads"] = uploads
+    return args
+
+def manifest_result(manifest: dict) -> dict:
+    """The pipeline result fields of a stored run"""
+    return {
+        "run_id": manifest["run_id"],
+        "analysis_table": manifest["outputs"]["analysis_table"],
+        "analysis_path": manifest["outputs"]["analysis_path"],
+        "uploads": manifest.get("uploads", []),
+        "filtered_crops": manifest.get("filtered_crops", []),
+        "unmatched_solutions": [path for page in manifest["pages"] for path in page["unmatched_solutions"]],
+        "partial": manifest.get("partial", False),
+        "pending_problems": manifest.get("pending_problems", 0),
+    }
 
+def result_url(result: dict, path: Optional[str]) -> Optional[str]:
+    """Content-addressed URL under /api/results for an output file of a run"""
+    if not path:
+        return None
+    if not os.path.exists(path):
+        return f"/api/results/{result['run_id']}/{os.path.basename(path)}"
+    return f"/api/results/{result['run_id']}/{content_digest(path)}/{os.path.basename(path)}"
+
+def format_result(result: dict) -> dict:
+    """API response body for a finished pipeline run"""
+    return {
+        "success": True,
+        "run_id": result.get("run_id"),
+        "parent_run_id": result.get("parent_run_id"),
+        "analysis_table_url": result_url(result, result["analysis_table"]),
+        "detailed_analysis_url": result_url(result, result["analysis_path"]),
+        "report_url": f"/api/results/{result['run_id']}/report" if result.get("run_id") else None,
+        "bundle_url": f"/api/runs/{result['run_id']}/bundle" if result.get("run_id") else None,
+        "reused_pages": result.get("reused_pages", 0),
+        "recomputed_concepts": result.get("recomputed_concepts"),
+        "unmatched_solution_blocks": len(result.get("unmatched_solutions", [])),
+        "filtered_crops": len(result.get("filtered_crops", [])),
+        "uploads": result.get("uploads", []),
+        "partial": result.get("partial", False),
+        "pending_problems": result.get("pending_problems", 0),
+        "message": (f"Partial results: {result['pending_problems']} problems not graded in time"
+                    if result.get("pending_problems") else "Analysis completed successfully")
+    }
+
+@router.post("/analyze")
+async def analyze(
+    request: Request,
+    concept_sheet: UploadFile = File(...),
+    questions: List[UploadFile] = File(None),
+    solutions: List[UploadFile] = File(None),
+    submissions: List[UploadFile] = File(None),
+    page_roles: str = Form("order"),
+    original_dimensions: Optional[str] = Form(None),
+    student_id: Optional[str] = Form(None),
+    class_id: Optional[str] = Form(None),
+):
+    from app.services.orchestrator import run_pipeline  # heavy imports load on first use, not at startup
+    questions = questions or []
+    solutions = solutions or []
+    submissions = submissions or []
+    validate_submission(concept_sheet, questions, solutions, submissions, page_roles)
+    deadline = deadline_of(request)
+    ticket = ADMISSION.reserve(client_id(request))
+    try:
+        await run_in_threadpool(ADMISSION.wait, ticket, min(ADMISSION_MAX_WAIT_SECONDS, deadline.remaining()))
+        with TemporaryDirectory() as tmpdir:
+            args = save_submission(tmpdir, concept_sheet, questions, solutions, submissions, page_roles,
+                                   parse_original_dimensions(original_dimensions))
+            args.update(student_id=student_id, class_id=class_id, deadline=deadline)
             try:
-                result = run_pipeline(concept_path, q_paths, s_paths)
-                return {
-                    "success": True,
-                    "analysis_table_url": result["analysis_table"],
-                    "detailed_analysis_url": result["analysis_path"],
-                    "message": "Analysis completed successfully"
-                }
+                # Off the event loop, so status polls and admission refusals are answered meanwhile
+                result = await run_until_disconnect(request, run_pipeline, **args)
+                return format_result(result)
             except Exception as e:
                 raise HTTPException(
                     status_code=500, 
                     detail=f"Error during analysis: {str(e)}"
                 )
     
-    except HTTPException:
+    except (HTTPException, Rejected):
         raise
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"Unexpected error: {str(e)}"
         )
+    finally:
+        ADMISSION.release(ticket)
+
+@router.post("/jobs")
+async def submit_job(
+    request: Request,
+    concept_sheet: UploadFile = File(...),
+    questions: List[UploadFile] = File(None),
+    solutions: List[UploadFile] = File(None),
+    submissions: List[UploadFile] = File(None),
+    page_roles: str = Form("order"),
+    original_dimensions: Optional[str] = Form(None),
+    student_id: Optional[str] = Form(None),
+    class_id: Optional[str] = Form(None),
+    callback_url: Optional[str] = Form(None),
+    batch_id: Optional[str] = Form(None),
+):
+    """
+    Start a grading in the background and return immediately with a job id. With a callback_url
+    (or a batch that has one) progress and the result are pushed there, so there is no need to poll.
+    """
+    from app.services.orchestrator import run_pipeline
+    questions = questions or []
+    solutions = solutions or []
+    submissions = submissions or []
+    validate_submission(concept_sheet, questions, solutions, submissions, page_roles)
+    dimensions = parse_original_dimensions(original_dimensions)
+    callback = callback_target(callback_url)
+    if batch_id and BATCHES.get(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    deadline = deadline_of(request)
+    # The job holds its admission ticket (queue place, then slot) until it finishes
+    ticket = ADMISSION.reserve(client_id(request))
+
+    # The job outlives this request, so its uploads live until the job removes them
+    tmpdir = mkdtemp(prefix="grading-job-")
+    try:
+        args = save_submission(tmpdir, concept_sheet, questions, solutions, submissions, page_roles, dimensions)
+        args.update(student_id=student_id, class_id=class_id, deadline=deadline)
+        batch = join_batch(batch_id) if batch_id else None
+    except Exception as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        ADMISSION.release(ticket)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    callback = callback or (batch and batch["callback"])
+    fields = {"student_id": student_id, "class_id": class_id, "batch_id": batch_id,
+              "base_url": str(request.base_url).rstrip("/")}
+    try:
+        job_id = JOBS.submit(ADMISSION.run, ticket, run_pipeline, cleanup_dir=tmpdir, on_cancel=deadline.cancel,
+                             on_progress=ProgressNotifier(WEBHOOKS, callback, fields) if callback else None,
+                             on_finish=job_finished(callback, fields) if callback or batch_id else None,
+                             wait_timeout=min(ADMISSION_MAX_WAIT_SECONDS, deadline.remaining()), **args)
+    except Exception as e:
+        # Never started: give back the batch place, so the batch can still complete, and the admission ticket
+        if batch is not None:
+            BATCHES.leave(batch_id)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        ADMISSION.release(ticket)
+        raise HTTPException(status_code=503, detail=f"Could not start the job: {str(e)}")
+    position, wait = ADMISSION.position(ticket)
+    return {"job_id": job_id, "status_url": f"/api/jobs/{job_id}", "queue_position": position,
+            "estimated_wait_seconds": round(wait, 1), "batch_id": batch_id, "callback": callback}
+
+def callback_target(callback_url: Optional[str]) -> Optional[str]:
+    """Validated webhook target of a submission, or None"""
+    if not callback_url:
+        return None
+    try:
+        return check_target(callback_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def join_batch(batch_id: str) -> dict:
+    try:
+        return BATCHES.join(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def job_response(job: dict) -> dict:
+    """A job snapshot as the API returns it: the result formatted, or failed if it holds none"""
+    if job["status"] == "completed" and job["result"]:
+        if job["result"].get("analysis_table"):
+            job["result"] = format_result(job["result"])
+        else:
+            job["status"], job["result"] = "failed", None
+            job["error"] = job["error"] or ("Cancelled before any results" if job["cancelled"] else "Analysis produced no results")
+    return job
+
+def job_finished(callback: Optional[str], fields: dict):
+    """
+    on_finish listener of a job: sends job.completed / job.failed to its callback and records it in its
+    batch, sending batch.completed to the batch's callback once the batch's last job is done
+    """
+    def on_finish(job):
+        job = job_response(job)
+        result = job["result"] or {}
+        summary = {"job_id": job["job_id"], "student_id": fields["student_id"], "status": job["status"],
+                   "run_id": result.get("run_id"), "partial": result.get("partial", False),
+                   "pending_problems": result.get("pending_problems", 0), "bundle_url": result.get("bundle_url"),
+                   "error": job["error"]}
+        batch = BATCHES.finish(fields["batch_id"], summary) if fields["batch_id"] else None
+        if callback:
+            WEBHOOKS.send(callback, f"job.{job['status']}",
+                          dict(fields, job_id=job["job_id"], status=job["status"], result=job["result"], error=job["error"],
+                               cancelled=job["cancelled"]))
+        if batch is not None:
+            batch_callback = BATCHES.callback(fields["batch_id"])
+            if batch_callback:
+                WEBHOOKS.send(batch_callback, "batch.completed", dict(batch, base_url=fields["base_url"]))
+    return on_finish
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, since: int = 0):
+    """Job status plus progress events from index `since` on; includes the result once completed"""
+    job = JOBS.get(job_id, since=max(0, since))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Stop a job: model calls in flight are abandoned and it finishes with partial results"""
+    if not JOBS.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "cancelled": True}
+
+@router.post("/batches")
+async def create_batch(
+    size: int = Form(...),
+    callback_url: Optional[str] = Form(None),
+    class_id: Optional[str] = Form(None),
+):
+    """
+    Open a batch of `size` jobs (submitted to /api/jobs with its batch_id). Each job notifies the batch's
+    callback as it progresses and finishes, and batch.completed follows once all of them are done.
+    """
+    if size < 1:
+        raise HTTPException(status_code=400, detail="Batch size must be at least 1")
+    callback = callback_target(callback_url)
+    batch_id = BATCHES.create(size, callback=callback, class_id=class_id)
+    return {"batch_id": batch_id, "size": size, "callback": callback, "status_url": f"/api/batches/{batch_id}"}
+
+@router.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = BATCHES.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@router.get("/webhooks")
+async def webhook_metrics():
+    """Notifications pending, delivered, retried, dropped and failed, with the latest failures"""
+    return WEBHOOKS.metrics()
+
+def parse_indexes(raw: str, count: int, role: str) -> list[int]:
+    """Parse a comma separated list of 1-based file positions into 0-based indexes"""
+    try:
+        indexes = [int(part) - 1 for part in raw.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{role}_indexes must be comma separated numbers")
+    if len(indexes) != count:
+        raise HTTPException(status_code=400, detail=f"Give one {role}_indexes entry per replaced {role} file")
+    if any(i < 0 for i in indexes) or len(set(indexes)) != len(indexes):
+        raise HTTPException(status_code=400, detail=f"{role}_indexes must be distinct positions starting at 1")
+    return indexes
+
+@router.post("/runs/{run_id}/revise")
+async def revise(
+    request: Request,
+    run_id: str,
+    questions: List[UploadFile] = File(None),
+    question_indexes: str = Form(""),
+    solutions: List[UploadFile] = File(None),
+    solution_indexes: str = Form(""),
+    submissions: List[UploadFile] = File(None),
+    submission_indexes: str = Form(""),
+):
+    """
+    Re-grade a previous run with some files replaced. Each replaced file gives its 1-based position
+    in the original upload (e.g. solutions=@fixed.jpg, solution_indexes=3). Only changed pages are
+    regraded and only affected concept statuses are recomputed.
+    """
+    from app.services.orchestrator import revise_run
+    if load_manifest(run_id) is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    uploads = {"questions": questions or [], "solutions": solutions or [], "submissions": submissions or []}
+    raw_indexes = {"questions": question_indexes, "solutions": solution_indexes, "submissions": submission_indexes}
+    if not any(uploads.values()):
+        raise HTTPException(status_code=400, detail="At least one replacement file is required")
+
+    indexes = {}
+    for role, files in uploads.items():
+        indexes[role] = parse_indexes(raw_indexes[role], len(files), role[:-1])
+        for i, f in enumerate(files):
+            validate_file(f, f"Replacement {role[:-1]} {indexes[role][i] + 1}")
+
+    deadline = deadline_of(request)
+    ticket = ADMISSION.reserve(client_id(request))
+    try:
+        await run_in_threadpool(ADMISSION.wait, ticket, min(ADMISSION_MAX_WAIT_SECONDS, deadline.remaining()))
+        with TemporaryDirectory() as tmpdir:
+            replacements = {}
+            for role, files in uploads.items():
+                replacements[role] = {
+                    index: save_upload(f, tmpdir, f"{role[:-1]}_{index + 1}")
+                    for index, f in zip(indexes[role], files)
+                }
+            try:
+                result = await run_until_disconnect(request, revise_run, run_id, replacements, deadline=deadline)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if not result.get("analysis_table"):
+                raise HTTPException(status_code=500, detail="Error during analysis: no question-solution pairs found")
+            return format_result(result)
+    except (HTTPException, Rejected):
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Unexpected error: {str(e)}"
+        )
+    finally:
+        ADMISSION.release(ticket)
+
+@router.get("/analytics/classes/{class_id}/concepts")
+async def class_concepts(class_id: str):
+    """Tested/correct counts, mastery and error types of every concept across a class"""
+    return {"class_id": class_id, "concepts": ANALYTICS.class_concepts(class_id)}
+
+@router.get("/analytics/classes/{class_id}/students")
+async def class_students(class_id: str, concept_id: Optional[str] = None):
+    """Per-student totals in a class, optionally restricted to one concept"""
+    return {"class_id": class_id, "concept_id": concept_id, "students": ANALYTICS.class_students(class_id, concept_id)}
+
+@router.get("/analytics/classes/{class_id}/students/{student_id}")
+async def student_concepts(class_id: str, student_id: str):
+    """Concept mastery of one student"""
+    concepts = ANALYTICS.student_concepts(class_id, student_id)
+    if not concepts:
+        raise HTTPException(status_code=404, detail="No graded runs for this student")
+    return {"class_id": class_id, "student_id": student_id, "concepts": concepts}
+
+@router.post("/analytics/backfill")
+def backfill_analytics():
+    """Add stored runs that are missing from the analytics counters"""
+    return {"recorded": ANALYTICS.backfill()}
@@ -0,0 +1,169 @@
+import math
+import threading
+import time
+from collections import Counter, deque
+from app.config.settings import (ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_PER_CLIENT,
+                                 ADMISSION_MAX_WAIT_SECONDS, ADMISSION_INITIAL_ESTIMATE_SECONDS)
+
+# Weight of the latest grading in the running average of grading time
+EWMA_WEIGHT = 0.2
+
+class Rejected(Exception):
+    """A grading turned away: status_code is 429 (client over its limit) or 503 (server saturated)"""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class Ticket:
+    def __init__(self, client):
+        self.client = client
+        self.granted = False
+        self.released = False
+        self.queued_at = time.time()
+        self.started = None
+
+class AdmissionController:
+    """
+    Bounds concurrent gradings. At most max_in_flight run at once and at most max_queue wait
+    for a slot (first come, first served); each client may hold per_client of them. Anything beyond
+    that, or a wait estimated above max_wait, is rejected at once with a Retry-After estimate
+    from the running average grading time, so overload degrades into fast refusals instead of
+    every request slowing down until they all fail.
+    """
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 per_client=ADMISSION_PER_CLIENT, max_wait=ADMISSION_MAX_WAIT_SECONDS,
+                 initial_estimate=ADMISSION_INITIAL_ESTIMATE_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.max_wait = max_wait
+        self.average_seconds = float(initial_estimate)
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.queue = deque()
+        self.clients = Counter()
+        self.counters = Counter()
+        self.max_queue_seen = 0
+
+    def _estimated_wait(self, position):
+        """Seconds until the grading at queue position `position` (1 = next) starts"""
+        return math.ceil(position / self.max_in_flight) * self.average_seconds
+
+    def _refuse(self, client):
+        """Rejection for a new grading of client, or None if it can be admitted or queued"""
+        if self.clients[client] >= self.per_client:
+            self.counters["rejected_client_limit"] += 1
+            return Rejected(429, f"Too many gradings in progress for this client (limit {self.per_client})",
+                            self.average_seconds)
+        if self.in_flight < self.max_in_flight and not self.queue:
+            return None
+        if len(self.queue) >= self.max_queue:
+            self.counters["rejected_queue_full"] += 1
+            return Rejected(503, "Grading queue is full", self._estimated_wait(len(self.queue) + 1))
+        wait = self._estimated_wait(len(self.queue) + 1)
+        if wait > self.max_wait:
+            self.counters["rejected_wait"] += 1
+            return Rejected(503, f"Estimated wait of {wait:.0f}s exceeds {self.max_wait:.0f}s", wait)
+        return None
+
+    def check(self, client):
+        """Raise Rejected if a grading of client would be refused right now (reserves nothing)"""
+        with self.cond:
+            rejection = self._refuse(client)
+        if rejection is not None:
+            raise rejection
+
+    def reserve(self, client):
+        """Admit or queue a grading of client; raises Rejected when saturated"""
+        with self.cond:
+            rejection = self._refuse(client)
+            if rejection is not None:
+                raise rejection
+            ticket = Ticket(client)
+            self.clients[client] += 1
+            self.counters["admitted"] += 1
+            if self.in_flight < self.max_in_flight and not self.queue:
+                self._start(ticket)
+            else:
+                self.queue.append(ticket)
+                self.counters["queued"] += 1
+                self.max_queue_seen = max(self.max_queue_seen, len(self.queue))
+            return ticket
+
+    def _start(self, ticket):
+        ticket.granted = True
+        ticket.started = time.time()
+        self.in_flight += 1
+
+    def position(self, ticket):
+        """Queue position of a waiting ticket (1 = next) and its estimated wait, or (0, 0) once running"""
+        with self.cond:
+            if ticket.granted or ticket.released:
+                return 0, 0.0
+            position = self.queue.index(ticket) + 1
+            return position, self._estimated_wait(position)
+
+    def wait(self, ticket, timeout=None):
+        """Block until the ticket's grading may start; raises Rejected (503) if that takes over timeout seconds"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self.counters["timed_out"] += 1
+                    raise Rejected(503, "Timed out waiting for a grading slot", self.average_seconds)
+                self.cond.wait(remaining)
+
+    def release(self, ticket):
+        """Free the ticket's slot (or its queue place) and start the next queued grading"""
+        with self.cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.clients[ticket.client] -= 1
+            if self.clients[ticket.client] <= 0:
+                del self.clients[ticket.client]
+            if not ticket.granted:
+                self.queue.remove(ticket)
+                return
+            self.in_flight -= 1
+            self.counters["completed"] += 1
+            duration = time.time() - ticket.started
+            self.average_seconds += EWMA_WEIGHT * (duration - self.average_seconds)
+            while self.queue and self.in_flight < self.max_in_flight:
+                self._start(self.queue.popleft())
+            self.cond.notify_all()
+
+    def run(self, ticket, fn, *args, on_event=None, wait_timeout=None, **kwargs):
+        """
+        Wait (up to wait_timeout seconds) for the ticket's slot, run fn(*args, on_event=..., **kwargs)
+        and free the slot (background jobs)
+        """
+        try:
+            position, wait = self.position(ticket)
+            if position and on_event is not None:
+                on_event({"type": "queued", "position": position, "estimated_wait_seconds": round(wait, 1)})
+            self.wait(ticket, wait_timeout)
+            return fn(*args, on_event=on_event, **kwargs)
+        finally:
+            self.release(ticket)
+
+    def metrics(self):
+        with self.cond:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queue_depth": len(self.queue),
+                "max_queue": self.max_queue,
+                "max_queue_depth_seen": self.max_queue_seen,
+                "per_client_limit": self.per_client,
+                "estimated_wait_seconds": round(self._estimated_wait(len(self.queue) + 1) if self.in_flight >= self.max_in_flight else 0.0, 1),
+                "average_grading_seconds": round(self.average_seconds, 2),
+                "counters": dict(self.counters),
+            }
+
+ADMISSION = AdmissionController()
@@ -0,0 +1,246 @@
+import os
+import sqlite3
+import threading
+from collections import Counter
+from app.config.settings import ANALYTICS_DB_PATH, RUNS_DIR
+
+ERROR_TYPES = ("conceptual", "procedural", "calculation", "incomplete")
+# Keywords that identify the error type in free-text Phase 1 analysis when error_type is missing
+_ERROR_KEYWORDS = {
+    "conceptual": ("conceptual", "misconception", "wrong formula", "wrong approach"),
+    "procedural": ("procedural", "wrong step", "sign error", "order of operations"),
+    "calculation": ("calculation", "arithmetic", "computational"),
+    "incomplete": ("incomplete", "missing step", "did not finish", "left blank"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    parent_run_id TEXT,
+    class_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    created REAL,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS run_concepts (
+    run_id TEXT NOT NULL,
+    concept_id TEXT NOT NULL,
+    error_type TEXT NOT NULL,
+    tested INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (run_id, concept_id, error_type)
+);
+CREATE TABLE IF NOT EXISTS concept_stats (
+    class_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    concept_id TEXT NOT NULL,
+    concept_name TEXT,
+    tested INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, student_id, concept_id)
+);
+CREATE TABLE IF NOT EXISTS error_stats (
+    class_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    concept_id TEXT NOT NULL,
+    error_type TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, student_id, concept_id, error_type)
+);
+CREATE INDEX IF NOT EXISTS concept_stats_concept ON concept_stats (class_id, concept_id);
+CREATE INDEX IF NOT EXISTS error_stats_concept ON error_stats (class_id, concept_id);
+"""
+
+def error_type_of(result):
+    """Error type of a Phase 1 result: its error_type field, else keywords in its analysis"""
+    if result.get("is_correct"):
+        return "none"
+    declared = str(result.get("error_type") or "").strip().lower()
+    if declared in ERROR_TYPES:
+        return declared
+    analysis = str(result.get("analysis") or "").lower()
+    for error_type, keywords in _ERROR_KEYWORDS.items():
+        if any(keyword in analysis for keyword in keywords):
+            return error_type
+    return "unspecified"
+
+def run_counts(manifest):
+    """Per (concept id, error type) counts of tested and correct problems in one run"""
+    counts = Counter()
+    for page in manifest.get("pages", []):
+        for problem in page["problems"]:
+            result = problem["result"]
+            if result.get("concept_id") is None or result.get("error"):
+                continue
+            key = (str(result["concept_id"]), error_type_of(result))
+            counts[key + ("tested",)] += 1
+            if result.get("is_correct"):
+                counts[key + ("correct",)] += 1
+    keys = {(concept_id, error_type) for concept_id, error_type, _ in counts}
+    return {key: (counts[key + ("tested",)], counts[key + ("correct",)]) for key in keys}
+
+class AnalyticsStore:
+    """
+    Class-level concept mastery counters in SQLite. Each finished run adds its counts to
+    per (class, student, concept) rows once, so queries read aggregates instead of reports.
+    A revision replaces its parent's contribution instead of counting the student twice.
+    """
+
+    def __init__(self, path=ANALYTICS_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._db = None
+
+    @property
+    def db(self):
+        """The database, opened (and created) on first use rather than at import"""
+        with self._open_lock:
+            if self._db is None:
+                if self.path != ":memory:":
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.row_factory = sqlite3.Row
+                if self.path != ":memory:":
+                    db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(_SCHEMA)
+                self._db = db
+            return self._db
+
+    def _apply(self, run_id, class_id, student_id, sign, names=None):
+        """Add (sign=1) or retract (sign=-1) the stored counts of a run from the aggregates"""
+        rows = self.db.execute(
+            "SELECT concept_id, error_type, tested, correct FROM run_concepts WHERE run_id = ?", (run_id,)
+        ).fetchall()
+        for row in rows:
+            self.db.execute(
+                """INSERT INTO concept_stats (class_id, student_id, concept_id, concept_name, tested, correct)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (class_id, student_id, concept_id) DO UPDATE SET
+                       tested = tested + excluded.tested,
+                       correct = correct + excluded.correct,
+                       concept_name = COALESCE(excluded.concept_name, concept_name)""",
+                (class_id, student_id, row["concept_id"], (names or {}).get(row["concept_id"]),
+                 sign * row["tested"], sign * row["correct"]),
+            )
+            self.db.execute(
+                """INSERT INTO error_stats (class_id, student_id, concept_id, error_type, count)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (class_id, student_id, concept_id, error_type) DO UPDATE SET
+                       count = count + excluded.count""",
+                (class_id, student_id, row["concept_id"], row["error_type"], sign * (row["tested"] - row["correct"])),
+            )
+
+    def record_run(self, manifest):
+        """Add a finished run to the counters; recording the same run twice is a no-op"""
+        run_id = manifest["run_id"]
+        class_id = manifest.get("class_id") or "default"
+        student_id = manifest.get("student_id") or run_id
+        concepts = manifest.get("parsed_concepts", {}).get("concepts", {})
+        names = {str(cid): concept.get("name") for cid, concept in concepts.items()}
+        with self.lock, self.db:
+            if self.db.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+                return False
+            parent_id = manifest.get("parent_run_id")
+            parent = parent_id and self.db.execute(
+                "SELECT class_id, student_id FROM runs WHERE run_id = ? AND active = 1", (parent_id,)
+            ).fetchone()
+            if parent:
+                self._apply(parent_id, parent["class_id"], parent["student_id"], -1)
+                self.db.execute("UPDATE runs SET active = 0 WHERE run_id = ?", (parent_id,))
+
+            self.db.execute(
+                "INSERT INTO runs (run_id, parent_run_id, class_id, student_id, created) VALUES (?, ?, ?, ?, ?)",
+                (run_id, parent_id, class_id, student_id, manifest.get("created")),
+            )
+            self.db.executemany(
+                "INSERT INTO run_concepts (run_id, concept_id, error_type, tested, correct) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, cid, error_type, tested, correct) for (cid, error_type), (tested, correct) in run_counts(manifest).items()],
+            )
+            self._apply(run_id, class_id, student_id, 1, names)
+        return True
+
+    def backfill(self, runs_dir=RUNS_DIR):
+        """Record stored runs that predate the analytics store, oldest first so parents come before revisions"""
+        from app.services.runs import load_manifest
+        if not os.path.isdir(runs_dir):
+            return 0
+        manifests = [m for m in (load_manifest(run_id) for run_id in os.listdir(runs_dir)) if m]
+        manifests.sort(key=lambda m: m.get("created") or 0)
+        return sum(1 for manifest in manifests if self.record_run(manifest))
+
+    def _errors(self, where, params):
+        rows = self.db.execute(
+            f"SELECT concept_id, error_type, SUM(count) AS count FROM error_stats WHERE {where} "
+            "GROUP BY concept_id, error_type HAVING SUM(count) > 0",
+            params,
+        ).fetchall()
+        errors = {}
+        for row in rows:
+            errors.setdefault(row["concept_id"], {})[row["error_type"]] = row["count"]
+        return errors
+
+    def class_concepts(self, class_id):
+        """Mastery of every concept across a class"""
+        with self.lock:
+            rows = self.db.execute(
+                """SELECT concept_id, MAX(concept_name) AS concept_name, SUM(tested) AS tested,
+                          SUM(correct) AS correct, SUM(tested > 0) AS students
+                   FROM concept_stats WHERE class_id = ? GROUP BY concept_id""",
+                (class_id,),
+            ).fetchall()
+            errors = self._errors("class_id = ?", (class_id,))
+        return [_concept_row(row, errors, students=row["students"]) for row in _sorted(rows)]
+
+    def student_concepts(self, class_id, student_id):
+        """Mastery of every concept for one student"""
+        with self.lock:
+            rows = self.db.execute(
+                """SELECT concept_id, concept_name, tested, correct FROM concept_stats
+                   WHERE class_id = ? AND student_id = ?""",
+                (class_id, student_id),
+            ).fetchall()
+            errors = self._errors("class_id = ? AND student_id = ?", (class_id, student_id))
+        return [_concept_row(row, errors) for row in _sorted(rows)]
+
+    def class_students(self, class_id, concept_id=None):
+        """Per-student totals in a class, optionally for a single concept"""
+        where, params = "class_id = ?", [class_id]
+        if concept_id is not None:
+            where, params = where + " AND concept_id = ?", params + [str(concept_id)]
+        with self.lock:
+            rows = self.db.execute(
+                f"""SELECT student_id, SUM(tested) AS tested, SUM(correct) AS correct
+                    FROM concept_stats WHERE {where} GROUP BY student_id ORDER BY student_id""",
+                params,
+            ).fetchall()
+            runs = dict(self.db.execute(
+                "SELECT student_id, COUNT(*) FROM runs WHERE class_id = ? AND active = 1 GROUP BY student_id",
+                (class_id,),
+            ).fetchall())
+        return [
+            {"student_id": row["student_id"], "runs": runs.get(row["student_id"], 0), "tested": row["tested"],
+             "correct": row["correct"], "mastery": _ratio(row["correct"], row["tested"])}
+            for row in rows
+        ]
+
+def _ratio(correct, tested):
+    return round(correct / tested, 4) if tested else None
+
+def _sorted(rows):
+    return sorted(rows, key=lambda r: int(r["concept_id"]) if r["concept_id"].isdigit() else r["concept_id"])
+
+def _concept_row(row, errors, students=None):
+    entry = {
+        "concept_id": row["concept_id"],
+        "concept_name": row["concept_name"],
+        "tested": row["tested"],
+        "correct": row["correct"],
+        "mastery": _ratio(row["correct"], row["tested"]),
+        "errors": errors.get(row["concept_id"], {}),
+    }
+    if students is not None:
+        entry["students"] = students
+    return entry
+
+ANALYTICS = AnalyticsStore()
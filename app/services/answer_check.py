@@ -0,0 +1,347 @@
+import importlib.util
+import multiprocessing
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+from app.config.settings import ANSWER_CHECK_BUDGET_SECONDS, ANSWER_CHECK_WORKERS
+
+# Relative tolerance for numeric answers (rounded decimals such as 0.333 vs 1/3)
+NUMERIC_TOLERANCE = 1e-3
+# Random points (positive, so logs and roots stay real) at which expressions are compared
+SAMPLE_POINTS = 6
+# Symbols treated as the arbitrary constant of an antiderivative
+CONSTANT_SYMBOLS = ("c", "k")
+_FUNCTIONS = {"sin", "cos", "tan", "cot", "sec", "csc", "asin", "acos", "atan", "sinh", "cosh", "tanh",
+              "log", "ln", "exp", "sqrt", "pi", "oo"}
+_LETTER_RUN = re.compile(r"[a-z]{3,}")
+
+_UNICODE = {
+    "−": "-", "–": "-", "×": "*", "·": "*", "÷": "/", "²": "^2", "³": "^3",
+    "π": "pi", "∞": "oo", " ": " ",
+}
+_ROOT = re.compile(r"√\s*(\d+(?:\.\d+)?|[a-zA-Z]|\([^()]*\))")
+_ASSIGNMENT = re.compile(r"^\s*[a-zA-Z]\w*\s*=\s*(?!.*=)")
+_NUMBER = re.compile(r"^[+-]?(\d+(\.\d*)?|\.\d+)(/\d+(\.\d*)?)?$")
+
+def normalize(answer):
+    """Canonical text of a final answer: unified symbols, no spacing, no leading 'x =', no trailing period"""
+    text = _ROOT.sub(r"sqrt(\1)", str(answer or "").strip())
+    for symbol, replacement in _UNICODE.items():
+        text = text.replace(symbol, replacement)
+    text = text.strip().rstrip(".").strip()
+    text = _ASSIGNMENT.sub("", text)
+    text = re.sub(r"\s+(or|and)\s+", ",", text)
+    text = text.replace("**", "^").replace("$", "")
+    return re.sub(r"\s+", "", text).lower()
+
+def split_answers(text):
+    """Several solutions ("x = 2, x = 3", "2 or 3", "{2; 3}") as separate normalized answers"""
+    parts = re.split(r"[,;]", normalize(text).strip("{}[]"))
+    return sorted(part for part in (normalize(p) for p in parts) if part)
+
+def as_number(text):
+    """Numeric value of a normalized answer, or None if it is not a plain number or fraction"""
+    if not _NUMBER.match(text):
+        return None
+    try:
+        numerator, _, denominator = text.partition("/")
+        value = Fraction(numerator)
+        return value / Fraction(denominator) if denominator else value
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def numbers_match(a, b, tolerance=NUMERIC_TOLERANCE):
+    return abs(a - b) <= tolerance * max(1, abs(a), abs(b))
+
+_sympy_module = None
+
+def _sympy():
+    """sympy if installed (imported on first use; it is slow to import), else None"""
+    global _sympy_module
+    if _sympy_module is None:
+        try:
+            import sympy
+            from sympy.parsing import sympy_parser
+            _sympy_module = (sympy, sympy_parser)
+        except ImportError:
+            print("[AnswerCheck] sympy not installed, symbolic checks disabled")
+            _sympy_module = False
+    return _sympy_module or None
+
+def warm_up(wait=False):
+    """Start the symbolic check workers (each imports sympy) ahead of the first check"""
+    if not sympy_available():
+        return False
+    WORKERS.start()
+    return WORKERS.wait_ready() if wait else True
+
+def sympy_available():
+    """Whether sympy is installed, without importing it into this process"""
+    return importlib.util.find_spec("sympy") is not None
+
+def _parse(text, sympy, parser):
+    """sympy expression of a normalized answer; an equation a=b becomes a-b"""
+    transformations = parser.standard_transformations + (parser.implicit_multiplication_application, parser.convert_xor)
+    local = {"e": sympy.E, "ln": sympy.log}
+    sides = [parser.parse_expr(side, local_dict=local, transformations=transformations) for side in text.split("=")]
+    if len(sides) > 2:
+        raise ValueError("chained equation")
+    return sides[0] - sides[1] if len(sides) == 2 else sides[0], len(sides) == 2
+
+def _samples(expr_a, expr_b, symbols, sympy):
+    """Values of both expressions at the same random points; points where either is undefined are skipped"""
+    rng = random.Random(0)
+    values = []
+    for _ in range(SAMPLE_POINTS * 3):
+        point = {symbol: rng.uniform(0.5, 3.0) for symbol in symbols}
+        try:
+            a, b = complex(expr_a.evalf(subs=point)), complex(expr_b.evalf(subs=point))
+        except (TypeError, ValueError, ZeroDivisionError):
+            continue
+        if all(map(lambda v: v == v and abs(v) != float("inf"), (a, b))):
+            values.append((a, b))
+        if len(values) == SAMPLE_POINTS:
+            break
+    return values
+
+def _close(a, b, tolerance=NUMERIC_TOLERANCE):
+    return abs(a - b) <= tolerance * max(1, abs(a), abs(b))
+
+def _additive_constant(expr, sympy):
+    """The integration constant standing alone as a term of expr (the C of "x^2 + C"), or None"""
+    return next((term for term in sympy.Add.make_args(expr) if term.is_Symbol and term.name in CONSTANT_SYMBOLS), None)
+
+def _symbolic(s, r):
+    """
+    Equivalence of two normalized answers with sympy: equations up to a nonzero factor,
+    antiderivatives up to their constant, expressions by simplification and random sampling.
+    """
+    sympy, parser = _sympy()
+    a, a_is_equation = _parse(s, sympy, parser)
+    b, b_is_equation = _parse(r, sympy, parser)
+    if a_is_equation != b_is_equation:
+        return {"equivalent": None, "method": "undecided"}
+
+    # Only a standalone "+ C" in the reference makes it an antiderivative; elsewhere c and k are plain symbols
+    b_constant = None if b_is_equation else _additive_constant(b, sympy)
+    if b_constant is not None:
+        a_constant = _additive_constant(a, sympy)
+        if a_constant is None:
+            return {"equivalent": False, "method": "symbolic", "note": "missing integration constant"}
+        # Antiderivatives match if they differ by a constant
+        a, b = a - a_constant, b - b_constant
+        variables = sorted(a.free_symbols | b.free_symbols, key=lambda x: x.name)
+        values = _samples(a - b, sympy.Integer(0), variables, sympy)
+        if not values:
+            return {"equivalent": None, "method": "undecided"}
+        first = values[0][0]
+        same = all(_close(value, first) for value, _ in values)
+        return {"equivalent": same, "method": "symbolic up to constant"}
+
+    variables = sorted(a.free_symbols | b.free_symbols, key=lambda x: x.name)
+    values = _samples(a, b, variables, sympy)
+    if not values:
+        return {"equivalent": None, "method": "undecided"}
+    if a_is_equation:
+        # Same solution set when one side is a constant nonzero multiple of the other
+        ratios = [x / y for x, y in values if abs(y) > 1e-12]
+        same = len(ratios) == len(values) and all(_close(ratio, ratios[0]) for ratio in ratios) and abs(ratios[0]) > 1e-12
+        return {"equivalent": same, "method": "symbolic equation"}
+    if not all(_close(x, y) for x, y in values):
+        return {"equivalent": False, "method": "symbolic"}
+    # Sampling agrees; report whether plain expansion also proves it (logs and roots often need assumptions)
+    return {"equivalent": True, "method": "symbolic" if sympy.expand(a - b) == 0 else "sampled"}
+
+def _serve(conn):
+    """Worker process: import sympy, then answer (student, reference) pairs until the pipe closes"""
+    conn.send("ready" if _sympy() is not None else "unavailable")
+    while True:
+        try:
+            s, r = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = _symbolic(s, r)
+        except Exception as e:
+            result = {"equivalent": None, "method": "unparseable", "note": str(e)[:100]}
+        conn.send(result)
+
+class SymbolicWorkers:
+    """
+    Symbolic checks run in `size` worker processes instead of threads, so a simplification that
+    overruns its budget is killed (and its worker replaced) rather than left running and holding a
+    slot. Nothing queues behind busy workers: with none idle the check is simply undecided.
+    """
+
+    def __init__(self, size=ANSWER_CHECK_WORKERS):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = []
+        self.starting = []
+        self.busy = 0
+
+    def _spawn(self):
+        context = multiprocessing.get_context("spawn")
+        parent, child = context.Pipe()
+        process = context.Process(target=_serve, args=(child,), name="answer-check", daemon=True)
+        process.start()
+        child.close()
+        self.starting.append((process, parent))
+
+    def start(self):
+        """Start workers up to `size`; they become usable once sympy is imported"""
+        with self.lock:
+            while len(self.idle) + len(self.starting) + self.busy < self.size:
+                self._spawn()
+
+    def _promote(self):
+        for worker in list(self.starting):
+            process, conn = worker
+            if not process.is_alive():
+                self.starting.remove(worker)
+            elif conn.poll():
+                self.starting.remove(worker)
+                if conn.recv() == "ready":
+                    self.idle.append(worker)
+                else:
+                    process.kill()
+
+    def wait_ready(self, timeout=60):
+        """Block until every started worker is ready (used by tests and eager warm-ups)"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                self._promote()
+                if not self.starting:
+                    return bool(self.idle)
+            time.sleep(0.05)
+        return False
+
+    def check(self, s, r, budget):
+        with self.lock:
+            self._promote()
+            if not self.idle:
+                if not self.starting and self.busy < self.size:
+                    self._spawn()
+                return {"equivalent": None, "method": "busy"}
+            worker = self.idle.pop()
+            self.busy += 1
+        process, conn = worker
+        try:
+            conn.send((s, r))
+            if conn.poll(budget):
+                result = conn.recv()
+                with self.lock:
+                    self.idle.append(worker)
+                return result
+        except (EOFError, OSError) as e:
+            print(f"[AnswerCheck] Worker failed: {str(e)}")
+            result = {"equivalent": None, "method": "unparseable", "note": "worker failed"}
+        else:
+            print(f"[AnswerCheck] Symbolic check over {budget}s budget: {s!r} vs {r!r}")
+            result = {"equivalent": None, "method": "timeout"}
+        finally:
+            with self.lock:
+                self.busy -= 1
+        process.kill()
+        process.join()
+        conn.close()
+        with self.lock:
+            self._spawn()
+        return result
+
+WORKERS = SymbolicWorkers()
+
+# Outcomes that depend on load rather than on the answers, so they are never memoized
+_TRANSIENT = {"timeout", "busy"}
+_symbolic_cache = OrderedDict()
+_symbolic_cache_lock = threading.Lock()
+SYMBOLIC_CACHE_SIZE = 4096
+
+def _symbolic_within_budget(s, r, budget):
+    """Symbolic check with a time budget; an overrun or no free worker is undecided (and not memoized)"""
+    if not sympy_available() or any(run not in _FUNCTIONS for run in _LETTER_RUN.findall(s + " " + r)):
+        # Words ("no solution", "undefined") are not math the parser can judge
+        return {"equivalent": None, "method": "undecided"}
+    with _symbolic_cache_lock:
+        if (s, r) in _symbolic_cache:
+            _symbolic_cache.move_to_end((s, r))
+            return _symbolic_cache[(s, r)]
+    WORKERS.start()
+    result = WORKERS.check(s, r, budget)
+    if result["method"] not in _TRANSIENT:
+        with _symbolic_cache_lock:
+            _symbolic_cache[(s, r)] = result
+            if len(_symbolic_cache) > SYMBOLIC_CACHE_SIZE:
+                _symbolic_cache.popitem(last=False)
+    return result
+
+def check_answer(student, reference, budget=ANSWER_CHECK_BUDGET_SECONDS):
+    """
+    Compare a student's final answer with the reference answer.
+    Returns {"equivalent": True | False | None, "method": ...}; None means the local checks
+    can't decide and the answer needs the model. Decided results are memoized per normalized pair.
+    """
+    s, r = normalize(student), normalize(reference)
+    result = _check_text(s, r)
+    if result["equivalent"] is None and result["method"] == "undecided":
+        result = _symbolic_within_budget(s, r, budget)
+    return dict(result)
+
+@lru_cache(maxsize=4096)
+def _check_text(s, r):
+    """Cheap textual and numeric checks on normalized answers"""
+    if not s or not r:
+        return {"equivalent": None, "method": "missing"}
+    if s == r:
+        return {"equivalent": True, "method": "exact"}
+
+    s_parts, r_parts = split_answers(s), split_answers(r)
+    if len(r_parts) > 1 or len(s_parts) > 1:
+        if s_parts == r_parts:
+            return {"equivalent": True, "method": "set"}
+        s_numbers, r_numbers = [as_number(p) for p in s_parts], [as_number(p) for p in r_parts]
+        if None not in s_numbers and None not in r_numbers:
+            if len(s_numbers) != len(r_numbers):
+                return {"equivalent": False, "method": "set"}
+            same = all(numbers_match(a, b) for a, b in zip(sorted(s_numbers), sorted(r_numbers)))
+            return {"equivalent": same, "method": "numeric set"}
+        return {"equivalent": None, "method": "undecided"}
+
+    s_number, r_number = as_number(s), as_number(r)
+    if s_number is not None and r_number is not None:
+        return {"equivalent": numbers_match(s_number, r_number), "method": "numeric"}
+    return {"equivalent": None, "method": "undecided"}
+
+def final_answer(text):
+    """Final answer of a worked solution: the right-hand side of its last line"""
+    lines = [line.strip() for line in str(text or "").replace("\\n", "\n").splitlines() if line.strip()]
+    if not lines:
+        return ""
+    last = lines[-1]
+    if last.count("=") >= 1 and not _ASSIGNMENT.match(last):
+        last = last.rsplit("=", 1)[1]
+    return last
+
+def verify_verdict(result, budget=ANSWER_CHECK_BUDGET_SECONDS):
+    """
+    Check a Phase 1 verdict against the local answer check of its final answers.
+    Returns {"local", "method", "model", "agrees", "regrade"}. A wrong final answer the model
+    accepted is a clear error and asks for a regrade; a right final answer the model rejected
+    may still have a broken method, so it is only flagged.
+    """
+    check = check_answer(final_answer(result.get("student_transcription")),
+                         final_answer(result.get("correct_answer")), budget)
+    model = bool(result.get("is_correct"))
+    agrees = check["equivalent"] is None or check["equivalent"] == model
+    return {
+        "local": check["equivalent"],
+        "method": check["method"],
+        "model": model,
+        "agrees": agrees,
+        "regrade": not agrees and model and check["equivalent"] is False,
+    }
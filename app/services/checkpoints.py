@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import threading
+
+def content_key(*parts):
+    """Stable key of stage inputs: file contents for paths that exist, the text itself otherwise"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str) and os.path.isfile(part):
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class Checkpoints:
+    """
+    Completed stage outputs on disk, keyed by stage and by the content of the stage's inputs.
+    A resumed bulk run finds every finished model call here instead of paying for it again;
+    identical inputs in different items share one entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, stage, key[:2], f"{key}.json")
+
+    def get(self, stage, key):
+        path = self._path(stage, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def put(self, stage, key, value):
+        """Write atomically so an interrupted run never leaves a half-written checkpoint"""
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def cached(self, stage, key, compute, keep=lambda value: True):
+        """Checkpointed value of a stage, computing and storing it on a miss; keep() rejects failed outputs"""
+        value = self.get(stage, key)
+        if value is not None:
+            return value
+        value = compute()
+        if keep(value):
+            self.put(stage, key, value)
+        return value
@@ -1,46 +1,29 @@
-import base64
 import json
-import os
-from google import genai
-from app.config.settings import GEMINI_API_KEY
+from app.config.settings import GEMINI_API_KEY, CONCEPT_MODEL
+from app.services.prompts import REGISTRY
+from app.services.gemini_client import generate, image_part, mock_mode
+from app.services.concept_tables import ConceptTableError, is_concept_table, parse_concept_table
 
-# Initialize the Gemini client
 if not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE":
-    print("[WARNING] GEMINI_API_KEY not configured! Please set it in your .env file.")
-    print("[WARNING] Get your API key from: https://aistudio.google.com/app/apikey")
     print("[WARNING] Using mock concept parsing for testing...")
 
-client = genai.Client(api_key=GEMINI_API_KEY)
-
-def get_mime_type(path):
-    """Get MIME type based on file extension"""
-    ext = os.path.splitext(path.lower())[1]
-    mime_types = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.bmp': 'image/bmp',
-        '.tiff': 'image/tiff',
-        '.tif': 'image/tiff'
-    }
-    return mime_types.get(ext, 'image/jpeg')  # Default to jpeg
-
-def encode_image_b64(path):
-    """Encode image to base64 string"""
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
-
 def parse_concept_sheet(concept_sheet_path):
     """
     Parse the concept sheet to extract all concepts with their details.
     This is the foundation of the entire system.
+    Sheets given as a table (CSV, JSON, Markdown, XLSX) are read locally; images go to the model.
     """
+    if is_concept_table(concept_sheet_path):
+        try:
+            return parse_concept_table(concept_sheet_path)
+        except ConceptTableError as e:
+            return {"concepts": {}, "total_concepts": 0, "error": f"Invalid concept sheet: {str(e)}"}
     try:
         print(f"[DEBUG] Parsing concept sheet: {concept_sheet_path}")
         print(f"[DEBUG] API Key present: {bool(GEMINI_API_KEY and GEMINI_API_KEY != 'YOUR_KEY_HERE')}")
         
         # If no API key, return mock data for testing
-        if not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE":
+        if mock_mode():
             print("[DEBUG] Using mock concept sheet parsing for testing...")
             return {
                 "concepts": {
@@ -63,75 +46,16 @@ def parse_concept_sheet(concept_sheet_path):
         # Create content for concept sheet parsing
         content_parts = [
             {
-                "text": """You are an expert educational analyst. Your task is to parse a concept sheet and extract all concepts with their details.
-
-CRITICAL: This is the FOUNDATION of the entire grading system. You must extract ALL concepts with 100% accuracy.
-
-SYSTEMATIC EXTRACTION PROCESS:
-
-STEP 1 - SCAN THE ENTIRE SHEET:
-- Identify all rows/entries in the concept sheet table
-- Count the total number of concepts present
-- Note the structure: concept number, name, description, example columns
-
-STEP 2 - EXTRACT EACH CONCEPT PRECISELY:
-For EVERY concept in the sheet, extract:
-- Concept Number/ID (e.g., 1, 2, 3, etc.)
-- Concept Name (EXACT text as written - do not modify or abbreviate)
-- Concept Description/Explanation (complete text from the sheet)
-- Examples (any mathematical examples or formulas shown)
-
-STEP 3 - VERIFY COMPLETENESS:
-- Ensure you captured ALL concepts from top to bottom
-- Double-check that concept numbers are sequential or match the sheet
-- Verify that ALL fields are captured for each concept
-
-STEP 4 - FORMAT AS JSON:
-Return a structured JSON with ALL concepts organized by their ID numbers.
-
-Critical Requirements:
-- Extract EVERY SINGLE concept from the sheet (do not skip any)
-- Use EXACT concept names as written (preserve capitalization, spacing, terminology)
-- Include complete descriptions and examples
-- If a field is empty or missing, use an empty string ""
-- Never invent or modify concept names
-
-Return JSON in this exact format:
-{
-  "concepts": {
-    "1": {
-      "id": 1,
-      "name": "exact concept name from sheet",
-      "description": "complete description text",
-      "example": "example formulas or problems"
-    },
-    "2": {
-      "id": 2,
-      "name": "exact concept name from sheet",
-      "description": "complete description text",
-      "example": "example formulas or problems"
-    },
-    ...continue for ALL concepts...
-  },
-  "total_concepts": <total number of concepts extracted>
-}"""
+                "text": REGISTRY.get("concept_sheet_prompt")
             },
             {
                 "text": "Concept Sheet Image:"
             },
-            {
-                "inline_data": {
-                    "mime_type": get_mime_type(concept_sheet_path),
-                    "data": encode_image_b64(concept_sheet_path)
-                }
-            }
+            image_part(concept_sheet_path)
         ]
         
         print(f"[DEBUG] Calling Gemini API for concept sheet parsing...")
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=content_parts
-        )
+        response = generate("concepts", CONCEPT_MODEL, content_parts)
         print(f"[DEBUG] Concept parsing response received: {len(response.text) if hasattr(response, 'text') else 'No text'} characters")
         
         # Parse JSON response
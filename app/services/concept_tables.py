@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+import os
+import re
+from app.config.settings import CONCEPT_TABLE_EXTENSIONS
+
+# Upper bound on concepts in one sheet; larger tables are almost certainly the wrong file
+MAX_CONCEPTS = 500
+# Accepted column names (compared lowercase, without spaces, underscores and punctuation); other
+# headers starting with "Concept" name the concept, or number it ("Concept No.", "Concept Number")
+COLUMN_ALIASES = {
+    "id": {"id", "conceptid", "conceptnumber", "conceptno", "number", "no", "num"},
+    "name": {"name", "conceptname", "concept", "title", "topic"},
+    "description": {"description", "conceptdescription", "details", "explanation"},
+    "example": {"example", "examples", "sample"},
+}
+_NON_WORD = re.compile(r"[\W_]+")
+_MD_SEPARATOR = re.compile(r"^\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?$")
+
+class ConceptTableError(ValueError):
+    """A structured concept sheet that can't be used, with a message for the teacher"""
+
+def is_concept_table(path):
+    """Whether a concept sheet is a structured table (parsed locally) rather than an image"""
+    return os.path.splitext(path.lower())[1] in CONCEPT_TABLE_EXTENSIONS
+
+def _column(header):
+    words = _NON_WORD.sub(" ", str(header or "").lower()).split()
+    field = next((field for field, aliases in COLUMN_ALIASES.items() if "".join(words) in aliases), None)
+    if field or words[:1] != ["concept"]:
+        return field
+    return "id" if words[1:2] in (["no"], ["number"], ["id"]) else "name"
+
+def _read_text(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise ConceptTableError("The concept sheet is not valid text (save it as UTF-8)")
+
+def _rows_csv(path):
+    text = _read_text(path)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+
+def _rows_markdown(path):
+    """Cells of the first pipe table in a Markdown document"""
+    rows = []
+    for line in _read_text(path).splitlines():
+        line = line.strip()
+        if not line.startswith("|"):
+            if rows:
+                break
+            continue
+        if _MD_SEPARATOR.match(line):
+            continue
+        rows.append([cell.strip() for cell in line.strip("|").split("|")])
+    return rows
+
+def _rows_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ConceptTableError("XLSX concept sheets need the openpyxl package; upload CSV instead or install openpyxl")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        return [["" if cell is None else str(cell) for cell in row]
+                for row in sheet.iter_rows(values_only=True) if any(cell not in (None, "") for cell in row)]
+    finally:
+        workbook.close()
+
+def _records_json(path):
+    """Concept records of a JSON sheet: a list, {"concepts": list or id map}, or an id map"""
+    try:
+        data = json.loads(_read_text(path))
+    except json.JSONDecodeError as e:
+        raise ConceptTableError(f"The concept sheet is not valid JSON: {e}")
+    if isinstance(data, dict) and "concepts" in data:
+        data = data["concepts"]
+    if isinstance(data, dict):
+        data = [dict(value, id=value.get("id", key)) if isinstance(value, dict) else {"id": key, "name": value}
+                for key, value in data.items()]
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise ConceptTableError("A JSON concept sheet must be a list of concepts or a map of concept id to concept")
+    return [{_column(key) or key: value for key, value in item.items()} for item in data]
+
+def _records_table(rows):
+    """Concept records of a table whose first row is the header"""
+    if not rows:
+        raise ConceptTableError("The concept sheet is empty")
+    header = [_column(cell) for cell in rows[0]]
+    if "name" not in header:
+        raise ConceptTableError("The concept sheet needs a header row with a concept name column "
+                                f"(found: {', '.join(str(cell) for cell in rows[0])})")
+    records = []
+    for row in rows[1:]:
+        record = {}
+        for field, cell in zip(header, row):
+            if field and field not in record:
+                record[field] = cell
+        records.append(record)
+    return records
+
+def concepts_from_records(records):
+    """
+    Validated {"concepts": {id: {"id", "name", "description", "example"}}, "total_concepts"} from
+    concept records. Rows without an id are numbered after the previous row; ids must be unique integers.
+    """
+    if not records:
+        raise ConceptTableError("The concept sheet has no concepts")
+    if len(records) > MAX_CONCEPTS:
+        raise ConceptTableError(f"The concept sheet has {len(records)} concepts; at most {MAX_CONCEPTS} are supported")
+    concepts = {}
+    previous = 0
+    for line, record in enumerate(records, start=1):
+        name = str(record.get("name") or "").strip()
+        if not name:
+            raise ConceptTableError(f"Concept {line} has no name")
+        raw_id = str(record.get("id") if record.get("id") is not None else "").strip().rstrip(".")
+        try:
+            number = float(raw_id) if raw_id else previous + 1
+        except ValueError:
+            number = None
+        # Spreadsheets give whole numbers as 2.0; 1.5 is not an id
+        if number is None or not float(number).is_integer():
+            raise ConceptTableError(f"Concept {name!r} has id {raw_id!r}; ids must be whole numbers")
+        concept_id = int(number)
+        if concept_id < 1:
+            raise ConceptTableError(f"Concept {name!r} has id {concept_id}; ids start at 1")
+        if str(concept_id) in concepts:
+            raise ConceptTableError(f"Concept id {concept_id} is used twice")
+        previous = concept_id
+        concepts[str(concept_id)] = {
+            "id": concept_id,
+            "name": name,
+            "description": str(record.get("description") or "").strip(),
+            "example": str(record.get("example") or "").strip(),
+        }
+    return {"concepts": concepts, "total_concepts": len(concepts)}
+
+def parse_concept_table(path):
+    """Parse a CSV, JSON, Markdown or XLSX concept sheet locally; raises ConceptTableError if it is unusable"""
+    ext = os.path.splitext(path.lower())[1]
+    if ext == ".json":
+        records = _records_json(path)
+    elif ext == ".csv":
+        records = _records_table(_rows_csv(path))
+    elif ext in (".md", ".markdown"):
+        records = _records_table(_rows_markdown(path))
+    elif ext == ".xlsx":
+        records = _records_table(_rows_xlsx(path))
+    else:
+        raise ConceptTableError(f"Unsupported concept sheet format: {ext}")
+    parsed = concepts_from_records(records)
+    print(f"[Concepts] Parsed {parsed['total_concepts']} concepts from {os.path.basename(path)} without the model")
+    return parsed
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+# Crops with less ink than this fraction of their pixels are blank
+MIN_INK_DENSITY = 0.004
+# Fewer glyph-like components than this is a page number, a tick or a stray mark
+MIN_COMPONENTS = 3
+# A single blob filling more than this fraction of the crop is a smudge or a shadow
+MAX_BLOB_FILL = 0.35
+# Thin strips in the top band of the page wider than this aspect ratio may be running headers; they are
+# only dropped when a near copy was seen on an earlier page, since a one-line problem has the same shape
+HEADER_ASPECT = 10.0
+HEADER_BAND = 0.12
+# Headers repeat with small changes (page number, date), so they match more loosely than duplicates
+HEADER_SIMILARITY = 0.98
+# Perceptual hashes closer than this (in bits, out of 256) are duplicate candidates
+DUPLICATE_DISTANCE = 24
+# Candidates are confirmed by correlation of their downscaled ink images; text crops that
+# differ in a single digit still score ~0.985, recompressed copies of one crop score >0.995
+DUPLICATE_SIMILARITY = 0.993
+SIGNATURE_WIDTH = 128
+
+def ink_mask(gray):
+    """Binary mask of ink pixels; the fixed ceiling keeps Otsu from splitting paper noise on blank crops"""
+    otsu, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, mask = cv2.threshold(gray, min(otsu, 160), 255, cv2.THRESH_BINARY_INV)
+    return mask
+
+def dhash(gray, size=16):
+    """Difference hash (size*size bits): robust to rescaling and recompression of the same crop"""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def signature(gray):
+    """Fixed-width ink image used to confirm duplicate candidates"""
+    height = max(1, int(round(SIGNATURE_WIDTH * gray.shape[0] / float(gray.shape[1]))))
+    return cv2.resize(255 - gray, (SIGNATURE_WIDTH, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+def similarity(a, b):
+    """Normalized cross-correlation of two signatures (b is resized to a's shape)"""
+    if a.shape != b.shape:
+        b = cv2.resize(b, (a.shape[1], a.shape[0]), interpolation=cv2.INTER_AREA)
+    score = cv2.matchTemplate(a, b, cv2.TM_CCOEFF_NORMED)[0][0]
+    return float(score) if np.isfinite(score) else 0.0
+
+def crop_reject_reason(gray):
+    """Return why a crop is not worth a model call, or None if it looks like a problem"""
+    mask = ink_mask(gray)
+    density = cv2.countNonZero(mask) / float(mask.size)
+    if density < MIN_INK_DENSITY:
+        return f"blank (ink density {density:.4f})"
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    stats = stats[1:count]
+    glyphs = stats[stats[:, cv2.CC_STAT_AREA] >= 4]
+    if len(glyphs) < MIN_COMPONENTS:
+        return f"trivial ({len(glyphs)} components)"
+
+    largest = int(glyphs[:, cv2.CC_STAT_AREA].max())
+    if largest > MAX_BLOB_FILL * mask.size:
+        return "smudge (single dominant blob)"
+    return None
+
+def header_shaped(box=None, page_shape=None):
+    """Whether a crop is a thin strip in the top band of its page"""
+    if box is None or page_shape is None:
+        return False
+    x, y, w, h = box
+    return y + h < page_shape[0] * HEADER_BAND and w > HEADER_ASPECT * h
+
+class CropFilter:
+    """
+    Drops blank, trivial and duplicate crops within one submission before grading.
+    Keep one instance per role for the whole run so duplicates across pages collapse too.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.seen = []
+        self.headers = []
+        self.page = 0
+        self.dropped = []
+
+    def _header_reason(self, gray):
+        """A header-shaped strip is dropped only if it repeats one from an earlier page"""
+        h, sig = dhash(gray), signature(gray)
+        for page, seen_hash, seen_sig in self.headers:
+            if page != self.page and hamming(h, seen_hash) <= DUPLICATE_DISTANCE and similarity(seen_sig, sig) >= HEADER_SIMILARITY:
+                return "repeated header strip"
+        self.headers.append((self.page, h, sig))
+        return None
+
+    def _duplicate_reason(self, gray):
+        """Hash comparison is the cheap pass; only close hashes pay for the correlation check"""
+        h, aspect = dhash(gray), gray.shape[1] / float(gray.shape[0])
+        sig = None
+        for seen_hash, seen_aspect, seen_sig in self.seen:
+            if hamming(h, seen_hash) > DUPLICATE_DISTANCE or abs(aspect - seen_aspect) > 0.1 * aspect:
+                continue
+            sig = signature(gray) if sig is None else sig
+            if similarity(seen_sig, sig) >= DUPLICATE_SIMILARITY:
+                return "duplicate"
+        self.seen.append((h, aspect, signature(gray) if sig is None else sig))
+        return None
+
+    def filter(self, crops):
+        """Return the crop records of one page worth grading; rejected ones are kept in self.dropped"""
+        if not self.enabled:
+            return crops
+        self.page += 1
+        kept = []
+        for crop in crops:
+            gray = cv2.imread(crop["path"], cv2.IMREAD_GRAYSCALE)
+            if gray is None or gray.size == 0:
+                reason = "unreadable"
+            else:
+                reason = crop_reject_reason(gray)
+            if reason is None and header_shaped(crop.get("box"), crop.get("page_shape")):
+                reason = self._header_reason(gray)
+            if reason is None:
+                reason = self._duplicate_reason(gray)
+            if reason:
+                print(f"[Filter] Dropping {crop['path']}: {reason}")
+                self.dropped.append({"path": crop["path"], "reason": reason})
+            else:
+                kept.append(crop)
+        return kept
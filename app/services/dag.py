@@ -0,0 +1,97 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class TaskGraph:
+    """
+    Minimal dependency-graph executor. Each task runs on the pool as soon as the futures it depends on
+    have resolved, receiving their results as arguments. Tasks may add further tasks while running,
+    so stages whose fan-out is only known at run time (problems found on a page) join the same graph.
+    A failed dependency fails its dependents without running them. Tasks run in a copy of the
+    context they were added from, so per-run context (usage accounting) follows them onto the pool.
+    """
+
+    def __init__(self, max_workers, name="pipeline"):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.started = time.time()
+
+    def value(self, value):
+        """An already resolved future, for inputs that are known up front"""
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def add(self, name, fn, *deps, **kwargs):
+        """Schedule fn(*dep results, **kwargs) once all deps are done; returns its future"""
+        future = Future()
+        with self.lock:
+            self.tasks[name] = {"deps": [d.task_name for d in deps if hasattr(d, "task_name")],
+                                "queued": None, "start": None, "end": None}
+        future.task_name = name
+        context = contextvars.copy_context()
+        remaining = [len(deps)]
+        remaining_lock = threading.Lock()
+
+        def run():
+            record = self.tasks[name]
+            record["start"] = time.time()
+            try:
+                future.set_result(context.run(fn, *[d.result() for d in deps], **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                record["end"] = time.time()
+
+        def on_dep_done(dep):
+            if dep.cancelled() or dep.exception() is not None:
+                if not future.done():
+                    error = dep.exception() if not dep.cancelled() else RuntimeError(f"{name}: dependency cancelled")
+                    self.tasks[name]["end"] = time.time()
+                    future.set_exception(error)
+                return
+            with remaining_lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._submit(name, run, future)
+
+        if not deps:
+            self._submit(name, run, future)
+        for dep in deps:
+            dep.add_done_callback(on_dep_done)
+        return future
+
+    def _submit(self, name, run, future):
+        self.tasks[name]["queued"] = time.time()
+        try:
+            self.pool.submit(run)
+        except RuntimeError as e:  # pool already shut down
+            future.set_exception(e)
+
+    def critical_path(self):
+        """(seconds, [task names]) of the dependency chain that finished last"""
+        with self.lock:
+            tasks = {name: dict(t) for name, t in self.tasks.items() if t["end"] is not None}
+        if not tasks:
+            return 0.0, []
+        name = max(tasks, key=lambda n: tasks[n]["end"])
+        chain = [name]
+        while True:
+            deps = [d for d in tasks[chain[-1]]["deps"] if d in tasks]
+            if not deps:
+                break
+            chain.append(max(deps, key=lambda d: tasks[d]["end"]))
+        return tasks[name]["end"] - self.started, list(reversed(chain))
+
+    def report(self):
+        """Wall time against the summed task time, and the critical path"""
+        with self.lock:
+            busy = sum(t["end"] - t["start"] for t in self.tasks.values() if t["start"] and t["end"])
+        wall, chain = self.critical_path()
+        return {"wall_seconds": round(wall, 3), "task_seconds": round(busy, 3), "critical_path": chain}
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,122 @@
+import contextvars
+import threading
+import time
+from typing import Optional
+from app.config.settings import (REQUEST_DEADLINE_SECONDS, DEADLINE_RESERVE_SECONDS, DEADLINE_MIN_CALL_SECONDS,
+                                 MODEL_TIMEOUT_SECONDS)
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """A step was not started, or was abandoned, because the run's time budget is spent or its client left"""
+
+class Deadline:
+    """
+    End-to-end time budget of one grading request. Each model call may take the smaller of its
+    stage's timeout and what is left of the budget less `reserve` (kept for writing the results),
+    so a hung call can't outlive the request. cancel() ends the budget early, e.g. when the client
+    disconnects, and abandons calls waiting in wait_for(). seconds=None sets no budget, so only
+    cancellation and the stage timeouts apply.
+    """
+
+    def __init__(self, seconds=None, reserve=DEADLINE_RESERVE_SECONDS):
+        self.seconds = seconds
+        self.reserve = reserve
+        self.started = time.time()
+        self.expires = self.started + seconds if seconds else float("inf")
+        self.reason = None
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.waiters = set()
+
+    def remaining(self):
+        """Seconds left for model calls (the reserve excluded), 0 once cancelled"""
+        if self.cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires - self.reserve - time.time())
+
+    def exhausted(self, needed=DEADLINE_MIN_CALL_SECONDS):
+        """Whether less than `needed` seconds are left (always true once cancelled)"""
+        return self.cancelled.is_set() or self.remaining() < needed
+
+    def why(self):
+        """Why steps are no longer started"""
+        return self.reason or f"time budget of {self.seconds or 0:.0f}s exhausted"
+
+    def cancel(self, reason):
+        with self.lock:
+            if self.cancelled.is_set():
+                return
+            self.reason = reason
+            self.cancelled.set()
+            waiters = list(self.waiters)
+        print(f"[Deadline] Run cancelled: {reason}")
+        for done in waiters:
+            done.set()
+
+    def call_timeout(self, stage):
+        """Seconds a model call of `stage` may take; raises DeadlineExceeded if too little is left to start it"""
+        if self.exhausted():
+            raise DeadlineExceeded(f"{stage} call not started: {self.why()}")
+        return min(MODEL_TIMEOUT_SECONDS.get(stage, float("inf")), self.remaining())
+
+    def wait_for(self, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs) on a helper thread, returning as soon as it does or raising DeadlineExceeded
+        as soon as the run is cancelled. An abandoned call finishes (or times out) in the background.
+        """
+        outcome = {}
+        done = threading.Event()
+
+        def target():
+            try:
+                outcome["value"] = fn(*args, **kwargs)
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        with self.lock:
+            if self.cancelled.is_set():
+                raise DeadlineExceeded(f"call not started: {self.why()}")
+            self.waiters.add(done)
+        try:
+            threading.Thread(target=target, name="model-call", daemon=True).start()
+            done.wait()
+        finally:
+            with self.lock:
+                self.waiters.discard(done)
+        if "error" in outcome:
+            raise outcome["error"]
+        if "value" not in outcome:
+            raise DeadlineExceeded(f"call abandoned: {self.why()}")
+        return outcome["value"]
+
+    def state(self):
+        """JSON-friendly record of the budget, as stored in the run manifest"""
+        return {
+            "budget_seconds": self.seconds,
+            "elapsed_seconds": round(time.time() - self.started, 2),
+            "cancelled": self.reason,
+        }
+
+def request_deadline(requested: Optional[str] = None) -> Deadline:
+    """
+    Deadline of a new grading request: REQUEST_DEADLINE_SECONDS, or less if the client asked for less
+    (X-Deadline-Seconds); without either it only serves to cancel the run.
+    """
+    seconds = REQUEST_DEADLINE_SECONDS or None
+    try:
+        asked = float(requested) if requested else None
+    except ValueError:
+        asked = None
+    if asked is not None and asked > 0:
+        seconds = min(seconds, asked) if seconds else asked
+    return Deadline(seconds)
+
+def use_deadline(deadline: Optional[Deadline]) -> None:
+    """Make `deadline` the budget of the current context (and tasks it schedules on a TaskGraph)"""
+    _current.set(deadline)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
@@ -1,8 +1,18 @@
 import base64
+import hashlib
 import json
 import os
-from google import genai
-from app.config.settings import GEMINI_API_KEY
+import threading
+import time
+from types import SimpleNamespace
+from app.config.settings import (
+    GEMINI_API_KEY, GEMINI_BASE_URL, ROUTING_MODEL, SCREEN_MODEL, PHASE1_MODEL, PHASE2_MODEL,
+    MEDIA_UPLOAD_ENABLED, MEDIA_INLINE_MAX_BYTES, RESPONSES_MODE, RESPONSES_DIR,
+)
+from app.services.media import MEDIA
+from app.services.deadline import DeadlineExceeded, current_deadline
+from app.services.usage import ResponseRecorder, record_usage, part_bytes, request_key
+from app.services.prompts import REGISTRY, compact_json, phase1_tier, phase1_schema
 
 
 if not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE":
@@ -10,7 +20,111 @@ if not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE":
     print("[WARNING] Get your API key from: https://aistudio.google.com/app/apikey")
     print("[WARNING] Using mock responses for testing...")
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+_client = None
+_client_lock = threading.Lock()
+_recorder = ResponseRecorder(RESPONSES_DIR, RESPONSES_MODE) if RESPONSES_MODE in ("record", "replay") else None
+
+def mock_mode():
+    """No API key: answer with mock data (replayed responses need no key)"""
+    return (not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE") and RESPONSES_MODE != "replay"
+
+def get_client():
+    """
+    The process-wide Gemini client, built on first use. google.genai takes most of the API's
+    import time, so nothing imports it until a request (or the startup warm-up) needs it.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                http_options = {"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
+                _client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _client
+
+def generate(stage, model, contents, config=None):
+    """
+    The single entry point for model calls. Records the call's tokens, request bytes and time in
+    the current run's usage, and stores or replays responses when RESPONSES_MODE asks for it.
+    Under a run deadline the call is time-bounded and raises DeadlineExceeded when the budget runs out.
+    Returns an object with the response .text.
+    """
+    bytes_sent = part_bytes(contents)
+    key = request_key(model, contents, config, MEDIA.digest_of) if _recorder else None
+    if _recorder is not None and _recorder.mode == "replay":
+        recorded = _recorder.get(key)
+        if recorded is None:
+            record_usage(stage, model, bytes_sent=bytes_sent, replay_miss=True)
+            raise LookupError(f"No recorded response for this {stage} request")
+        record_usage(stage, model, input_tokens=recorded["input_tokens"], output_tokens=recorded["output_tokens"],
+                     bytes_sent=bytes_sent, seconds=recorded["seconds"])
+        return SimpleNamespace(text=recorded["text"])
+
+    try:
+        response, started = _call_model(stage, model, contents, config, bytes_sent)
+    except Exception as e:
+        # A file the service no longer has (deleted early, or uploaded under another key): send the bytes instead, once
+        inlined = inline_stale_files(contents) if stale_file_error(e) else None
+        if inlined is None:
+            raise
+        print(f"[Media] Uploaded image is gone ({str(e)[:80]}), retrying {stage} inline")
+        contents = inlined
+        bytes_sent = part_bytes(contents)
+        response, started = _call_model(stage, model, contents, config, bytes_sent)
+    seconds = time.time() - started
+    metadata = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(metadata, "prompt_token_count", 0) or 0
+    output_tokens = (getattr(metadata, "candidates_token_count", 0) or 0) + (getattr(metadata, "thoughts_token_count", 0) or 0)
+    record_usage(stage, model, input_tokens=input_tokens, output_tokens=output_tokens, bytes_sent=bytes_sent, seconds=seconds)
+    if _recorder is not None:
+        _recorder.put(key, {"stage": stage, "model": model, "text": response.text, "input_tokens": input_tokens,
+                            "output_tokens": output_tokens, "seconds": round(seconds, 3)})
+    return response
+
+def _call_model(stage, model, contents, config, bytes_sent):
+    """One generate_content call, bounded by the run deadline when there is one. Returns the response and its start time."""
+    deadline = current_deadline()
+    if deadline is None:
+        started = time.time()
+        return get_client().models.generate_content(model=model, contents=contents, config=config), started
+    # Bounded by the stage timeout and the run's remaining budget; abandoned if the run is cancelled
+    timeout = deadline.call_timeout(stage)
+    bounded = dict(config or {}, http_options={"timeout": int(timeout * 1000)})
+    started = time.time()
+    try:
+        return deadline.wait_for(get_client().models.generate_content, model=model, contents=contents, config=bounded), started
+    except DeadlineExceeded:
+        record_usage(stage, model, bytes_sent=bytes_sent, seconds=time.time() - started)
+        raise
+    except Exception as e:
+        if time.time() - started < timeout:
+            raise
+        record_usage(stage, model, bytes_sent=bytes_sent, seconds=time.time() - started)
+        raise DeadlineExceeded(f"{stage} call exceeded its {timeout:.0f}s budget") from e
+
+def stale_file_error(error):
+    """The API refused a request because a referenced file is missing or not readable with this key"""
+    return getattr(error, "code", None) in (403, 404) or getattr(error, "status", None) in ("PERMISSION_DENIED", "NOT_FOUND")
+
+def inline_stale_files(contents):
+    """
+    Contents with every uploaded-image reference replaced by the image's inline bytes, discarding those
+    handles from the cache. Returns None if nothing could be replaced (no references this process made).
+    """
+    if not isinstance(contents, list):
+        return None
+    replaced, parts = False, []
+    for part in contents:
+        file_data = part.get("file_data") if isinstance(part, dict) else None
+        path = MEDIA.source_of(file_data["file_uri"]) if file_data else None
+        if path is None or not os.path.exists(path):
+            parts.append(part)
+            continue
+        MEDIA.discard(MEDIA.digest_of(file_data["file_uri"]))
+        with open(path, "rb") as f:
+            parts.append(inline_part(f.read(), file_data["mime_type"]))
+        replaced = True
+    return parts if replaced else None
 
 def get_mime_type(path):
     """Get MIME type based on file extension"""
@@ -30,35 +144,139 @@ def encode_image_b64(path):
     with open(path, "rb") as f:
         return base64.b64encode(f.read()).decode("utf-8")
 
-def create_content_with_parsed_concepts(parsed_concepts, question, solution, prompt):
-    """Create content for Gemini API with parsed concepts and images"""
+def upload_once(path, data, digest, mime_type):
+    """
+    Handle of an image on the file service, uploading it only if no live handle for its
+    content exists yet. Returns None if the upload fails so the caller inlines the bytes.
+    """
+    with MEDIA.upload_lock(digest):
+        handle = MEDIA.get(digest)
+        if handle is not None:
+            MEDIA.count("reused", len(data))
+            return handle
+        try:
+            uploaded = get_client().files.upload(
+                file=path, config={"mime_type": mime_type, "display_name": digest[:40]}
+            )
+        except Exception as e:
+            print(f"[Media] Upload failed for {path}, sending inline: {str(e)}")
+            return None
+        handle = {"name": uploaded.name, "uri": uploaded.uri, "mime_type": mime_type,
+                  "expires": time.time() + MEDIA.ttl}
+        MEDIA.put(digest, handle)
+        MEDIA.count("uploaded", len(data))
+        record_usage("upload", "files", bytes_sent=len(data))
+        return handle
+
+def image_part(path):
+    """
+    Content part for an image: a reference to its uploaded copy when it is larger than the inline
+    limit (uploaded on first use), otherwise, or if uploading is off or fails, the inline bytes.
+    """
+    mime_type = get_mime_type(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    if MEDIA_UPLOAD_ENABLED and len(data) > MEDIA_INLINE_MAX_BYTES and RESPONSES_MODE != "replay" and not mock_mode():
+        handle = upload_once(path, data, hashlib.sha256(data).hexdigest(), mime_type)
+        if handle is not None:
+            MEDIA.remember(handle["uri"], path)
+            return {"file_data": {"file_uri": handle["uri"], "mime_type": mime_type}}
+    return inline_part(data, mime_type)
+
+def inline_part(data, mime_type):
+    MEDIA.count("inline", len(data))
+    return {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(data).decode("utf-8")}}
+
+def create_content_with_parsed_concepts(header, question, solution):
+    """Create content for Gemini API from the prepared Phase 1 header (instructions + concepts) and images"""
     content_parts = [
         {
-            "text": f"Instructions: {prompt}\n\nParsed Concept Sheet:\n{json.dumps(parsed_concepts, indent=2)}\n\nHere are the images to analyze:"
+            "text": header
         },
         {
             "text": "Question Image:"
         },
-        {
-            "inline_data": {
-                "mime_type": get_mime_type(question), 
-                "data": encode_image_b64(question)
-            }
-        },
+        image_part(question),
         {
             "text": "Solution Image:"
         },
-        {
-            "inline_data": {
-                "mime_type": get_mime_type(solution),
-                "data": encode_image_b64(solution)
-            }
-        }
+        image_part(solution)
     ]
     return content_parts
 
-def call_gemini_phase1(parsed_concepts, question, solution, prompt):
-    """Call Gemini API for Phase 1 analysis using parsed concepts"""
+def transcribe_question(question):
+    """
+    Cheap single-line transcription of a question crop on the routing model, used to shortlist
+    concepts before Phase 1. Returns "" on any failure so callers fall back to the full concept sheet.
+    """
+    if mock_mode():
+        return "Solve for x: 2x + 5 = 13"
+    try:
+        response = generate(
+            "transcription", ROUTING_MODEL,
+            [
+                {"text": REGISTRY.get("transcription_prompt")},
+                image_part(question),
+            ],
+            {"max_output_tokens": 256, "temperature": 0},
+        )
+        return (response.text or "").strip()
+    except Exception as e:
+        print(f"[Routing] Transcription failed for {question}: {str(e)}")
+        return ""
+
+def extract_json(response_text):
+    """Parse a JSON object from a model response, with or without a ``` fence"""
+    text = response_text.strip()
+    if "```" in text:
+        start = text.find("```json") + 7 if "```json" in text else text.find("```") + 3
+        end = text.find("```", start)
+        text = text[start:end if end != -1 else None].strip()
+    return json.loads(text)
+
+def screen_problem(question, solution, header):
+    """
+    Cascade first stage on the cheap screening model: transcribe the question, solve it and read the
+    student's final answer, without any diagnosis. Returns None on failure so the caller runs full Phase 1.
+    """
+    if mock_mode():
+        return {
+            "concept_id": 1,
+            "question_transcription": "Solve for x: 2x + 5 = 13",
+            "reference_answer": "x = 4",
+            "student_answer": "x = 4",
+            "confidence": 0.95,
+        }
+    try:
+        response = generate(
+            "screen", SCREEN_MODEL,
+            create_content_with_parsed_concepts(header, question, solution),
+            {"max_output_tokens": 512, "temperature": 0},
+        )
+        return extract_json(response.text or "")
+    except Exception as e:
+        print(f"[Cascade] Screening failed for {question}: {str(e)}")
+        return None
+
+def phase1_config(tier):
+    """Generation config of a Phase 1 verbosity tier: JSON in the tier's schema under its output budget, if it has one"""
+    config = {
+        "response_mime_type": "application/json",
+        "response_schema": phase1_schema(tier["name"]),
+    }
+    if tier["max_output_tokens"] is not None:
+        config["max_output_tokens"] = tier["max_output_tokens"]
+        if tier["thinking_budget"] is not None:
+            config["thinking_config"] = {"thinking_budget": tier["thinking_budget"]}
+            config["max_output_tokens"] += tier["thinking_budget"]
+    return config
+
+def call_gemini_phase1(parsed_concepts, question, solution, header, verbosity=None):
+    """
+    Call Gemini API for Phase 1 analysis; header is the prepared Phase 1 text from prompts.prepare_prompts,
+    written for the given verbosity tier (the configured one by default)
+    """
+    tier = phase1_tier(verbosity)
     try:
         print(f"[DEBUG] Starting Phase 1 analysis...")
         print(f"[DEBUG] Parsed concepts: {len(parsed_concepts.get('concepts', {}))} concepts")
@@ -67,7 +285,7 @@ def call_gemini_phase1(parsed_concepts, question, solution, prompt):
         print(f"[DEBUG] API Key present: {bool(GEMINI_API_KEY and GEMINI_API_KEY != 'YOUR_KEY_HERE')}")
         
         # If no API key, return mock data for testing
-        if not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE":
+        if mock_mode():
             print("[DEBUG] Using mock response for testing...")
             return {
                 "concept_id": 1,
@@ -77,19 +295,17 @@ def call_gemini_phase1(parsed_concepts, question, solution, prompt):
                 "correct_answer": "x = 4",
                 "is_correct": True,
                 "analysis": "Student correctly solved the equation by subtracting 5 from both sides and dividing by 2.",
-                "status_summary": "Correct solution"
+                "status_summary": "Correct solution",
+                "verbosity": tier["name"],
             }
         
         # Create content with parsed concepts and images
-        content = create_content_with_parsed_concepts(parsed_concepts, question, solution, prompt)
+        content = create_content_with_parsed_concepts(header, question, solution)
         print(f"[DEBUG] Content created with {len(content)} parts")
         
         # Generate response using the client
         print(f"[DEBUG] Calling Gemini API...")
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=content
-        )
+        response = generate("phase1", PHASE1_MODEL, content, phase1_config(tier))
         print(f"[DEBUG] Response received: {len(response.text) if hasattr(response, 'text') else 'No text'} characters")
         
         # Parse JSON response
@@ -115,6 +331,7 @@ def call_gemini_phase1(parsed_concepts, question, solution, prompt):
         try:
             result = json.loads(json_text)
             print(f"[DEBUG] Successfully parsed JSON with keys: {list(result.keys())}")
+            result["verbosity"] = tier["name"]
             return result
         except json.JSONDecodeError as e:
             print(f"[DEBUG] JSON parsing failed: {str(e)}")
@@ -131,6 +348,8 @@ def call_gemini_phase1(parsed_concepts, question, solution, prompt):
                 "status_summary": "Analysis failed - JSON parsing error"
             }
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"[ERROR] Phase 1 failed: {str(e)}")
         error_msg = str(e)
@@ -148,15 +367,15 @@ def call_gemini_phase1(parsed_concepts, question, solution, prompt):
             "status_summary": f"Analysis failed - {error_msg[:50]}..."
         }
 
-def call_gemini_phase2(parsed_concepts, phase1_results, prompt):
-    """Call Gemini API for Phase 2 synthesis using parsed concepts"""
+def call_gemini_phase2(parsed_concepts, phase1_results, header):
+    """Call Gemini API for Phase 2 synthesis; header is the prepared Phase 2 text from prompts.prepare_prompts"""
     try:
         print(f"[DEBUG] Starting Phase 2 synthesis...")
         print(f"[DEBUG] Parsed concepts: {len(parsed_concepts.get('concepts', {}))} concepts")
         print(f"[DEBUG] Phase 1 results: {len(phase1_results)} items")
         
         # If no API key, return mock data for testing
-        if not GEMINI_API_KEY or GEMINI_API_KEY == "YOUR_KEY_HERE":
+        if mock_mode():
             print("[DEBUG] Using mock synthesis response for testing...")
             return {
                 "fill_data": {
@@ -169,16 +388,13 @@ def call_gemini_phase2(parsed_concepts, phase1_results, prompt):
         # Create content for synthesis
         content_parts = [
             {
-                "text": f"Instructions: {prompt}\n\nParsed Concept Sheet:\n{json.dumps(parsed_concepts, indent=2)}\n\nPhase 1 Results:\n{json.dumps(phase1_results, indent=2)}"
+                "text": f"{header}\n\nPhase 1 Results:\n{compact_json(phase1_results)}"
             }
         ]
         
         print(f"[DEBUG] Calling Gemini API for synthesis...")
         # Generate response using the client
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=content_parts
-        )
+        response = generate("phase2", PHASE2_MODEL, content_parts)
         print(f"[DEBUG] Synthesis response received: {len(response.text) if hasattr(response, 'text') else 'No text'} characters")
         
         # Parse JSON response
@@ -214,6 +430,8 @@ def call_gemini_phase2(parsed_concepts, phase1_results, prompt):
                 "detailed_analysis": f"Error parsing Gemini response: {response_text[:500]}..."
             }
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"[ERROR] Phase 2 failed: {str(e)}")
         error_msg = str(e)
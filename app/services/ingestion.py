@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+from collections import deque
+from itertools import zip_longest
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+from app.config.settings import RASTER_DPI, MAX_DOCUMENT_PAGES, DOCUMENT_EXTENSIONS
+
+# Headings that mark a page as a question or a solution page when roles come from markers. They must
+# start the label or one of its lines: instructions like "Answer all questions" mark nothing
+QUESTION_MARKER = re.compile(r"^\s*(questions?|problems?|q\d+)\b", re.IGNORECASE | re.MULTILINE)
+SOLUTION_MARKER = re.compile(r"^\s*(solutions?|answer key|s\d+)\b", re.IGNORECASE | re.MULTILINE)
+
+def is_document(path):
+    """Check whether a file is a multi-page document rather than a single image"""
+    return os.path.splitext(path.lower())[1] in DOCUMENT_EXTENSIONS
+
+def _make_page(source, number, image, label=""):
+    """Build a page record; the digest identifies the page content independent of its file"""
+    return {
+        "source": source,
+        "number": number,
+        "image": image,
+        "label": label or "",
+        "digest": hashlib.sha256(image.tobytes()).hexdigest(),
+    }
+
+def _iter_pdf_pages(path, dpi):
+    try:
+        import pymupdf
+    except ImportError:
+        raise ValueError("PDF support requires PyMuPDF. Install it with: pip install pymupdf")
+
+    doc = pymupdf.open(path)
+    try:
+        if doc.page_count > MAX_DOCUMENT_PAGES:
+            raise ValueError(f"{os.path.basename(path)} has {doc.page_count} pages, maximum is {MAX_DOCUMENT_PAGES}")
+        for i in range(doc.page_count):
+            page = doc.load_page(i)
+            pix = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csRGB, alpha=False)
+            rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+            image = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+            # Page labels and the text layer (if any) carry question/solution markers
+            label = page.get_label() or page.get_text()[:200]
+            del pix, rgb
+            yield _make_page(path, i + 1, image, label)
+    finally:
+        doc.close()
+
+def _iter_tiff_pages(path, dpi):
+    with Image.open(path) as tiff:
+        for i, frame in enumerate(ImageSequence.Iterator(tiff)):
+            if i >= MAX_DOCUMENT_PAGES:
+                raise ValueError(f"{os.path.basename(path)} has more than {MAX_DOCUMENT_PAGES} pages")
+            rgb = frame.convert("RGB")
+            # Downscale frames scanned above the target DPI; never upscale
+            source_dpi = frame.info.get("dpi", (dpi, dpi))[0] or dpi
+            if source_dpi > dpi:
+                scale = dpi / float(source_dpi)
+                rgb = rgb.resize((max(1, int(rgb.width * scale)), max(1, int(rgb.height * scale))), Image.LANCZOS)
+            image = cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR)
+            label = frame.tag_v2.get(270, "") if hasattr(frame, "tag_v2") else ""
+            del rgb
+            yield _make_page(path, i + 1, image, str(label))
+
+def iter_pages(path, dpi=RASTER_DPI):
+    """
+    Lazily yield the pages of an image, PDF or multi-frame TIFF as BGR images.
+    Only one page is decoded at a time, so memory stays flat regardless of page count.
+    """
+    ext = os.path.splitext(path.lower())[1]
+    if ext == '.pdf':
+        yield from _iter_pdf_pages(path, dpi)
+    elif ext in ('.tif', '.tiff'):
+        yield from _iter_tiff_pages(path, dpi)
+    else:
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Could not load image from path: {path}")
+        yield _make_page(path, 1, image)
+
+def _chain_pages(paths, dpi):
+    for path in paths:
+        yield from iter_pages(path, dpi)
+
+def iter_page_pairs(questions, solutions, dpi=RASTER_DPI):
+    """Pair question pages with solution pages by order across all uploaded documents"""
+    for q_page, s_page in zip_longest(_chain_pages(questions, dpi), _chain_pages(solutions, dpi)):
+        if q_page is None or s_page is None:
+            print("[Ingestion] Question and solution page counts differ, extra pages ignored")
+            return
+        yield q_page, s_page
+
+def page_role(page):
+    """Return 'question', 'solution' or None based on markers in the page label (None if it has both)"""
+    label = page.get("label", "")
+    solution, question = SOLUTION_MARKER.search(label), QUESTION_MARKER.search(label)
+    if solution and not question:
+        return "solution"
+    if question and not solution:
+        return "question"
+    return None
+
+def iter_role_pairs(paths, mode="order", dpi=RASTER_DPI):
+    """
+    Split combined documents (questions and solutions in one file) into page pairs.
+    mode="order" alternates question, solution, question, ...
+    mode="marker" uses page labels/text markers and falls back to alternation for unmarked pages.
+    """
+    if mode not in ("order", "marker"):
+        raise ValueError(f"Unknown page role mode: {mode}")
+
+    pending = deque()
+    expected = "question"
+    for page in _chain_pages(paths, dpi):
+        role = page_role(page) if mode == "marker" else None
+        role = role or expected
+        if role == "question":
+            pending.append(page)
+            expected = "solution"
+        elif pending:
+            yield pending.popleft(), page
+            expected = "solution" if pending else "question"
+        else:
+            print(f"[Ingestion] Solution page {page['number']} of {page['source']} has no question page, skipping")
+    if pending:
+        print(f"[Ingestion] {len(pending)} question page(s) without a solution page, skipping")
@@ -0,0 +1,212 @@
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app.config.settings import JOB_TTL_SECONDS, ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE
+
+class JobStore:
+    """
+    Runs gradings in background threads and keeps their progress events in memory,
+    so clients can submit, return immediately and fetch per-problem results as they land.
+    Jobs are admitted gradings, so there is a thread for every admission slot and queue place: a job
+    granted a slot starts at once instead of holding it while it waits behind other jobs.
+    """
+
+    def __init__(self, max_workers=ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE, ttl=JOB_TTL_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="grading-job")
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, cleanup_dir=None, on_cancel=None, on_progress=None, on_finish=None, **kwargs):
+        """
+        Schedule fn(*args, on_event=..., **kwargs) and return the job id.
+        cleanup_dir (the job's upload directory) is removed when the job finishes.
+        on_cancel(reason) is called when the job is cancelled, to stop fn early.
+        on_progress(job_id, event) sees every progress event; on_finish(job) gets the final snapshot.
+        """
+        self._evict_expired()
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "events": [],
+                "result": None,
+                "error": None,
+                "created": time.time(),
+                "finished": None,
+                "cancelled": False,
+                "on_cancel": on_cancel,
+            }
+        try:
+            self.executor.submit(self._run, job_id, fn, args, kwargs, cleanup_dir, on_progress, on_finish)
+        except RuntimeError:
+            # Shutting down: the job never existed
+            with self.lock:
+                del self.jobs[job_id]
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs, cleanup_dir, on_progress=None, on_finish=None):
+        def on_event(event):
+            self.add_event(job_id, event)
+            if on_progress is not None:
+                try:
+                    on_progress(job_id, event)
+                except Exception as e:
+                    print(f"[Jobs] Progress listener of job {job_id} failed: {str(e)}")
+
+        self._update(job_id, status="running")
+        try:
+            result = fn(*args, on_event=on_event, **kwargs)
+            self._update(job_id, status="completed", result=result)
+        except Exception as e:
+            print(f"[Jobs] Job {job_id} failed: {str(e)}")
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            self._update(job_id, finished=time.time())
+            if cleanup_dir:
+                shutil.rmtree(cleanup_dir, ignore_errors=True)
+            if on_finish is not None:
+                try:
+                    on_finish(self.get(job_id))
+                except Exception as e:
+                    print(f"[Jobs] Finish listener of job {job_id} failed: {str(e)}")
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def add_event(self, job_id, event):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job["events"].append(dict(event, seq=len(job["events"])))
+
+    def get(self, job_id, since=0):
+        """Snapshot of a job with only the events from index `since` on, or None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {
+                "job_id": job_id,
+                "status": job["status"],
+                "events": job["events"][since:],
+                "next": len(job["events"]),
+                "result": job["result"],
+                "error": job["error"],
+                "cancelled": job["cancelled"],
+            }
+
+    def cancel(self, job_id, reason="cancelled by the client"):
+        """Ask a queued or running job to stop; it finishes with whatever it has. False if there is no such job"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job["finished"] or job["cancelled"]:
+                return True
+            job["cancelled"] = True
+            on_cancel = job["on_cancel"]
+        if on_cancel is not None:
+            on_cancel(reason)
+        return True
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            for job_id in [j for j, job in self.jobs.items() if job["finished"] and job["finished"] < cutoff]:
+                del self.jobs[job_id]
+
+class BatchStore:
+    """
+    Groups the jobs of one class (or any set of submissions) so a single notification can say all of
+    them are done. A batch is created with the number of jobs it will hold; each finished job records
+    a short summary, and the batch completes when every one of them has.
+    """
+
+    def __init__(self, ttl=JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def create(self, size, callback=None, class_id=None):
+        self._evict_expired()
+        batch_id = uuid.uuid4().hex
+        with self.lock:
+            self.batches[batch_id] = {
+                "batch_id": batch_id,
+                "size": size,
+                "class_id": class_id,
+                "callback": callback,
+                "submitted": 0,
+                "jobs": [],
+                "created": time.time(),
+                "finished": None,
+            }
+        return batch_id
+
+    def join(self, batch_id):
+        """Take a place in the batch for a new job and return the batch; KeyError if unknown, ValueError if full"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                raise KeyError(batch_id)
+            if batch["submitted"] >= batch["size"]:
+                raise ValueError(f"Batch already has its {batch['size']} jobs")
+            batch["submitted"] += 1
+            return dict(batch)
+
+    def leave(self, batch_id):
+        """Give back a place taken by a job that was never started"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is not None:
+                batch["submitted"] -= 1
+
+    def finish(self, batch_id, summary):
+        """Record a finished job; returns the batch snapshot once this was its last job, else None"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            batch["jobs"].append(summary)
+            if len(batch["jobs"]) < batch["size"]:
+                return None
+            batch["finished"] = time.time()
+        return self.get(batch_id)
+
+    def callback(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            return batch["callback"] if batch else None
+
+    def get(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            jobs = list(batch["jobs"])
+            return {
+                "batch_id": batch_id,
+                "status": "completed" if batch["finished"] else "open",
+                "class_id": batch["class_id"],
+                "size": batch["size"],
+                "submitted": batch["submitted"],
+                "finished_jobs": len(jobs),
+                "failed_jobs": sum(1 for job in jobs if job["status"] != "completed"),
+                "jobs": jobs,
+            }
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            for batch_id in [b for b, batch in self.batches.items()
+                             if (batch["finished"] or batch["created"]) < cutoff]:
+                del self.batches[batch_id]
+
+JOBS = JobStore()
+BATCHES = BatchStore()
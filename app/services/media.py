@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from app.config.settings import MEDIA_CACHE_PATH, MEDIA_HANDLE_TTL_SECONDS, GEMINI_API_KEY, GEMINI_BASE_URL
+
+def media_scope(api_key, base_url):
+    """Which file service handles belong to: files uploaded with one key (or to one endpoint) are not visible to another"""
+    return hashlib.sha256(f"{api_key}\n{base_url}".encode("utf-8")).hexdigest()[:16]
+
+class MediaCache:
+    """
+    Content hash of an image -> handle of its uploaded copy ({"name", "uri", "mime_type", "expires"}).
+    Persisted, so retries, revisions and later batches reference images already on the server instead
+    of inlining their bytes again. Handles are dropped a margin before the server deletes the file, and
+    are kept per scope (API key and endpoint) so a changed key or a stand-in server never sees them.
+    """
+
+    def __init__(self, path, ttl=MEDIA_HANDLE_TTL_SECONDS, scope=""):
+        self.path = path
+        self.ttl = ttl
+        self.scope = scope
+        self.lock = threading.Lock()
+        self.upload_locks = {}
+        self.scopes = {}
+        self.sources = {}
+        self.stats = {"uploaded": 0, "reused": 0, "inline": 0, "uploaded_bytes": 0, "reused_bytes": 0,
+                      "stale": 0}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                # Older caches were one flat map of handles without a scope; they are dropped
+                self.scopes = {k: v for k, v in json.load(f).items() if isinstance(v, dict) and "uri" not in v}
+        except (OSError, json.JSONDecodeError, AttributeError):
+            pass
+        self.handles = self.scopes.setdefault(scope, {})
+
+    def upload_lock(self, digest):
+        """Per-image lock so concurrent calls with the same crop upload it only once"""
+        with self.lock:
+            return self.upload_locks.setdefault(digest, threading.Lock())
+
+    def get(self, digest):
+        """Live handle of an image, or None"""
+        with self.lock:
+            handle = self.handles.get(digest)
+            if handle is not None and handle["expires"] <= time.time():
+                del self.handles[digest]
+                return None
+            return handle
+
+    def put(self, digest, handle):
+        with self.lock:
+            now = time.time()
+            self.handles = {d: h for d, h in self.handles.items() if h["expires"] > now}
+            self.handles[digest] = handle
+            self.scopes[self.scope] = self.handles
+            self._save()
+
+    def remember(self, uri, path):
+        """Local file behind a handle used in this process, so a stale handle can fall back to its bytes"""
+        with self.lock:
+            self.sources[uri] = path
+
+    def source_of(self, uri):
+        with self.lock:
+            return self.sources.get(uri)
+
+    def digest_of(self, uri):
+        """Content hash of the image behind a file uri (the uri itself if unknown)"""
+        with self.lock:
+            return next((digest for digest, handle in self.handles.items() if handle["uri"] == uri), uri)
+
+    def discard(self, digest):
+        """Forget a handle the server no longer recognizes"""
+        with self.lock:
+            if self.handles.pop(digest, None) is not None:
+                self.stats["stale"] += 1
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.scopes, f)
+        os.replace(tmp, self.path)
+
+    def count(self, event, size=0):
+        """Record how an image was sent: uploaded, reused (by handle) or inline"""
+        with self.lock:
+            self.stats[event] += 1
+            if f"{event}_bytes" in self.stats:
+                self.stats[f"{event}_bytes"] += size
+
+MEDIA = MediaCache(MEDIA_CACHE_PATH, scope=media_scope(GEMINI_API_KEY, GEMINI_BASE_URL))
@@ -1,115 +1,717 @@
-import os
 import json
+import os
+import threading
 import time
-from app.services.preprocessing import crop_blocks, pair_by_order
-from app.services.gemini_client import call_gemini_phase1, call_gemini_phase2
+from collections import defaultdict, deque
+from typing import Callable, Optional
+from app.services.preprocessing import crop_regions, save_page
+from app.services.pairing import pair_crops
+from app.services.crop_filter import CropFilter
+from app.services.ingestion import iter_page_pairs, iter_role_pairs
+from app.services.gemini_client import call_gemini_phase1, call_gemini_phase2, transcribe_question, screen_problem
+from app.services.answer_check import check_answer, verify_verdict
 from app.services.render import generate_analysis_table
 from app.services.concept_parser import parse_concept_sheet
-from app.config.settings import PHASE1_PROMPT_PATH, PHASE2_PROMPT_PATH, STATIC_OUTPUT_DIR
+from app.services.prompts import REGISTRY, prepare_prompts, phase1_header
+from app.services.checkpoints import content_key
+from app.services.dag import TaskGraph
+from app.services.usage import track_usage
+from app.services.deadline import Deadline, DeadlineExceeded, use_deadline, current_deadline
+from app.services.routing import concept_index
+from app.services.analytics import ANALYTICS
+from app.services.runs import create_run, run_dir, store_input, store_inputs, save_manifest, load_manifest, file_digest
+from app.config.settings import (CROP_FILTER_ENABLED, ROUTING_ENABLED, ROUTING_TOP_K, ROUTING_MIN_CONCEPTS,
+                                 CASCADE_ENABLED, CASCADE_MIN_CONFIDENCE, VERIFY_VERDICTS,
+                                 PIPELINE_WORKERS, PIPELINE_LOOKAHEAD, PHASE1_DETAIL, DEADLINE_PHASE2_SECONDS)
 
-def read_prompt(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+# Heading of the revised concepts' analysis appended to a revision's detailed analysis
+REVISION_UPDATE = "\n\nUpdate after revision"
 
-def run_pipeline(concept_sheet: str, questions: list[str], solutions: list[str]):
-    print(f"[DEBUG] Starting pipeline with concept sheet: {concept_sheet}")
-    print(f"[DEBUG] Concept sheet exists: {os.path.exists(concept_sheet)}")
-    if os.path.exists(concept_sheet):
-        print(f"[DEBUG] Concept sheet size: {os.path.getsize(concept_sheet)} bytes")
-    
-    # Step 0: Parse concept sheet first (FOUNDATION)
-    print("[STEP 0] Parsing concept sheet...")
-    parsed_concepts = parse_concept_sheet(concept_sheet)
-    print(f"[DEBUG] Parsed concepts: {len(parsed_concepts.get('concepts', {}))} concepts")
-    
+def checkpointed(checkpoint, stage: str, key: str, compute: Callable, keep: Callable = lambda value: True):
+    """compute() through the bulk run's checkpoint store when there is one"""
+    if checkpoint is None:
+        return compute()
+    return checkpoint.cached(stage, key, compute, keep)
+
+def failed_result(result: dict) -> bool:
+    """Phase 1 fallback and pending results stand in for failed or skipped calls and must not be checkpointed"""
+    summary = str(result.get("status_summary", ""))
+    return bool(result.get("pending")) or summary.startswith("Analysis failed") or summary.startswith("Error grading")
+
+def pending_result(index: int, reason: str) -> dict:
+    """Stand-in for a problem the run's time budget left ungraded; counts as neither correct nor wrong"""
+    return {
+        "concept_id": None,
+        "concept_name": "",
+        "is_correct": False,
+        "status_summary": f"Not graded - {reason}",
+        "pending": True,
+    }
+
+def crop_page_pair(index: int, q_page: dict, s_page: dict, crops_dir: str, crop_pool=None) -> tuple[list[dict], list[dict]]:
+    """
+    Segment one question page and one solution page into crop records. Independent of the
+    concept sheet, so it runs while the sheet is still being parsed. crop_pool (a process pool)
+    segments both pages off this process. Returns ([], []) when segmentation fails.
+    """
+    q_dir = os.path.join(crops_dir, f"q_{index}")
+    s_dir = os.path.join(crops_dir, f"s_{index}")
+    try:
+        if crop_pool is not None:
+            q_future = crop_pool.submit(crop_regions, q_page["image"], q_dir)
+            s_future = crop_pool.submit(crop_regions, s_page["image"], s_dir)
+            return q_future.result(), s_future.result()
+        return crop_regions(q_page["image"], q_dir), crop_regions(s_page["image"], s_dir)
+    except Exception as e:
+        print(f"[Preprocessing] Error processing page pair {index}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return [], []
+
+def pair_page_crops(index: int, q_page: dict, s_page: dict, q_regions: list[dict], s_regions: list[dict],
+                    q_filter: CropFilter, s_filter: CropFilter, crops_dir: str) -> tuple[list[dict], list[str]]:
+    """
+    Drop blank, trivial and duplicate crops with the run's filters and assign problem blocks.
+    Returns (pairs, unmatched solution crop paths); each pair carries a pairing confidence.
+    """
+    q_dir = os.path.join(crops_dir, f"q_{index}")
+    s_dir = os.path.join(crops_dir, f"s_{index}")
+    q_crops = q_filter.filter(q_regions)
+    s_crops = s_filter.filter(s_regions)
+    print(f"[Preprocessing] Extracted {len(q_crops)} question crops: {[c['path'] for c in q_crops]}")
+    print(f"[Preprocessing] Extracted {len(s_crops)} solution crops: {[c['path'] for c in s_crops]}")
+
+    # If preprocessing fails, use the full pages as fallback
+    if len(q_crops) == 0 or len(s_crops) == 0:
+        print(f"[FALLBACK] Using full pages instead of crops for page pair {index}")
+        return [{"question": save_page(q_page, q_dir), "solution": save_page(s_page, s_dir), "confidence": None}], []
+
+    pairing = pair_crops(q_crops, s_crops)
+    pairs = [
+        {"question": p["question"]["path"], "solution": p["solution"]["path"], "confidence": p["confidence"]}
+        for p in pairing["pairs"]
+    ]
+    # A question without a matching solution block is graded against the whole solution page
+    # so the model can still find the answer; it is never silently dropped.
+    if pairing["unmatched_questions"]:
+        page_path = save_page(s_page, s_dir)
+        for crop in pairing["unmatched_questions"]:
+            print(f"[Pairing] No solution block for {crop['path']}, grading against full solution page")
+            pairs.append({"question": crop["path"], "solution": page_path, "confidence": 0.0})
+    unmatched = [c["path"] for c in pairing["unmatched_solutions"]]
+    for path in unmatched:
+        print(f"[Pairing] Solution block {path} has no matching question")
+    return pairs, unmatched
+
+def grade_problem(index: int, parsed_concepts: dict, qpath: str, spath: str, phase1_header: str,
+                  verbosity: Optional[str] = None) -> dict:
+    """Run Phase 1 on a single question-solution pair, never raising; the header must be written for `verbosity`"""
+    try:
+        print(f"[Phase1] Evaluating problem {index}")
+        print(f"[Phase1] Question: {qpath}")
+        print(f"[Phase1] Solution: {spath}")
+        result = call_gemini_phase1(parsed_concepts, qpath, spath, phase1_header, verbosity)
+        concept = parsed_concepts.get("concepts", {}).get(str(result.get("concept_id")))
+        if concept is not None and not result.get("concept_name"):
+            # The minimal tier leaves the name out; it is known from the sheet
+            result["concept_name"] = concept.get("name", "")
+        print(f"[Phase1] Result for problem {index}: {result}")
+        return result
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"[Phase1] Error evaluating problem {index}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {
+            "concept_id": None,
+            "concept_name": "",
+            "is_correct": False,
+            "status_summary": f"Error grading problem {index}: {str(e)}"
+        }
+
+def route_problem(index: int, qpath: str, prompts: dict, transcription: Optional[str] = None) -> tuple[str, dict]:
+    """
+    Pick the Phase 1 header for one problem. On large concept sheets the question is transcribed
+    cheaply (unless a transcription is given) and only the top concepts by TF-IDF similarity are sent;
+    otherwise the full sheet is. Returns (header, routing record).
+    """
+    concepts = prompts["parsed_concepts"].get("concepts", {})
+    if not ROUTING_ENABLED or len(concepts) < ROUTING_MIN_CONCEPTS:
+        return prompts["phase1"], {"shortlist": None}
+    if not transcription:
+        transcription = transcribe_question(qpath)
+    shortlist = concept_index(prompts["parsed_concepts"], prompts["concepts"]).shortlist(transcription, ROUTING_TOP_K)
+    if not shortlist:
+        print(f"[Routing] Problem {index}: no concept matched the transcription, sending the full sheet")
+        return prompts["phase1"], {"shortlist": None, "transcription": transcription}
+    print(f"[Routing] Problem {index}: shortlisted concepts {shortlist} of {len(concepts)}")
+    return phase1_header(prompts, shortlist), {"shortlist": shortlist, "transcription": transcription}
+
+def grade_routed(index: int, parsed_concepts: dict, qpath: str, spath: str, prompts: dict,
+                 transcription: Optional[str] = None) -> tuple[dict, dict]:
+    """Grade one problem against its concept shortlist, escalating to the full sheet if none matched"""
+    header, routing = route_problem(index, qpath, prompts, transcription)
+    result = grade_problem(index, parsed_concepts, qpath, spath, header)
+    if routing["shortlist"] and str(result.get("concept_id")) not in routing["shortlist"]:
+        print(f"[Routing] Problem {index}: no shortlisted concept matched, regrading with the full sheet")
+        try:
+            result = grade_problem(index, parsed_concepts, qpath, spath, prompts["phase1"])
+            routing["escalated"] = True
+        except DeadlineExceeded as e:
+            print(f"[Routing] Problem {index}: keeping the shortlist result, {str(e)}")
+            routing["escalated"] = False
+    return result, routing
+
+def screen_result(index: int, parsed_concepts: dict, screen: dict, check: dict) -> Optional[dict]:
+    """
+    Phase 1 result for a screened problem whose final answer was verified locally, or None
+    when it needs the full analysis (wrong or unverifiable answer, low confidence, unknown concept).
+    """
+    concept = parsed_concepts.get("concepts", {}).get(str(screen.get("concept_id")))
+    try:
+        confidence = float(screen.get("confidence") or 0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    if check["equivalent"] is not True or confidence < CASCADE_MIN_CONFIDENCE or concept is None:
+        return None
+    return {
+        "concept_id": screen["concept_id"],
+        "concept_name": concept.get("name", ""),
+        "question_transcription": screen.get("question_transcription", ""),
+        "student_transcription": screen.get("student_answer", ""),
+        "correct_answer": screen.get("reference_answer", ""),
+        "is_correct": True,
+        "error_type": "none",
+        "analysis": f"Final answer {screen.get('student_answer')} matches the reference answer ({check['method']} check).",
+        "status_summary": f"Concept tested in question {index} & student is good in it",
+        "graded_by": "screen",
+    }
+
+def grade_staged(index: int, parsed_concepts: dict, qpath: str, spath: str, prompts: dict) -> tuple[dict, dict]:
+    """
+    Grade one problem through the enabled stages: with the cascade on, a cheap screening pass
+    settles verified correct answers; everything else gets the routed full Phase 1 analysis.
+    Returns (result, stage records for the problem record).
+    """
+    stages = {}
+    transcription = None
+    if CASCADE_ENABLED:
+        screen = screen_problem(qpath, spath, prompts["screen"])
+        if screen:
+            check = check_answer(screen.get("student_answer"), screen.get("reference_answer"))
+            result = screen_result(index, parsed_concepts, screen, check)
+            stages["cascade"] = {"screen": screen, "check": check, "escalated": result is None}
+            if result is not None:
+                print(f"[Cascade] Problem {index}: final answer verified ({check['method']}), skipping full analysis")
+                return result, stages
+            print(f"[Cascade] Problem {index}: escalating to full analysis (check {check})")
+            transcription = screen.get("question_transcription")
+        else:
+            stages["cascade"] = {"screen": None, "escalated": True}
+    result, stages["routing"] = grade_routed(index, parsed_concepts, qpath, spath, prompts, transcription)
+    if (PHASE1_DETAIL == "incorrect" and prompts["phase1_tier"] != "full"
+            and not result.get("is_correct") and not failed_result(result)):
+        result = problem_detail(index, parsed_concepts, qpath, spath, prompts, result)
+    if VERIFY_VERDICTS:
+        verification = verify_verdict(result)
+        if verification["regrade"]:
+            # The model accepted a final answer the local check proves wrong: ask once more with the full sheet
+            print(f"[Verify] Problem {index}: verdict contradicts the local answer check ({verification['method']}), regrading")
+            try:
+                result = grade_problem(index, parsed_concepts, qpath, spath, phase1_header(prompts, tier="full"), verbosity="full")
+                verification = dict(verify_verdict(result), regraded=True)
+            except DeadlineExceeded as e:
+                print(f"[Verify] Problem {index}: no time left to regrade, flagged ({str(e)})")
+        elif not verification["agrees"]:
+            print(f"[Verify] Problem {index}: verdict disagrees with the local answer check, flagged")
+        result["verification"] = verification
+    return result, stages
+
+def problem_detail(index: int, parsed_concepts: dict, qpath: str, spath: str, prompts: dict, result: dict) -> dict:
+    """
+    Full diagnosis (transcriptions and written analysis) of a problem graded at a lower verbosity tier,
+    asked against the concept it was matched to. The lower-tier result stands if the call fails.
+    """
+    concept_id = str(result.get("concept_id"))
+    known = concept_id in parsed_concepts.get("concepts", {})
+    header = phase1_header(prompts, [concept_id] if known else None, tier="full")
+    print(f"[Phase1] Problem {index}: requesting the full diagnosis")
+    try:
+        detailed = grade_problem(index, parsed_concepts, qpath, spath, header, verbosity="full")
+    except DeadlineExceeded as e:
+        print(f"[Phase1] Problem {index}: keeping the {result.get('verbosity')} result, {str(e)}")
+        return result
+    if failed_result(detailed):
+        return result
+    return dict(detailed, detail_of=result.get("verbosity"))
+
+def emit(on_event: Optional[Callable[[dict], None]], event_type: str, **data) -> None:
+    """Report pipeline progress to an optional listener; listener errors never break grading"""
+    if on_event is None:
+        return
+    try:
+        on_event({"type": event_type, **data})
+    except Exception as e:
+        print(f"[Events] Listener failed on {event_type}: {str(e)}")
+
+def page_key(q_digest: str, s_digest: str) -> str:
+    """Identity of a page pair by content; unchanged pages keep their key across revisions"""
+    return f"{q_digest}:{s_digest}"
+
+class ConceptSheetError(Exception):
+    """The concept sheet could not be parsed, so nothing can be graded"""
+
+def grading_inputs(parsed_concepts: dict, on_event: Optional[Callable[[dict], None]] = None) -> tuple[dict, dict]:
+    """Prepared prompts for a parsed concept sheet; the dependency every Phase 1 task waits on"""
     if parsed_concepts.get('error'):
         print(f"[ERROR] Concept sheet parsing failed: {parsed_concepts['error']}")
-        return {"analysis_table": None, "analysis_path": None}
-    
-    phase1_prompt = read_prompt(PHASE1_PROMPT_PATH)
-    phase2_prompt = read_prompt(PHASE2_PROMPT_PATH)
+        raise ConceptSheetError(parsed_concepts['error'])
+    # Instructions and the compact concept sheet are assembled once for every request of this run
+    prompts = prepare_prompts(parsed_concepts)
+    emit(on_event, "stage", stage="grading", total_concepts=len(parsed_concepts.get('concepts', {})))
+    return parsed_concepts, prompts
 
-    # Step 1: crop all question and solution sheets (each may have multiple problems)
-    all_q_crops, all_s_crops = [], []
-    for i, (q, s) in enumerate(zip(questions, solutions), start=1):
+def grade_pages(page_pairs, ready, crops_dir: str, graph: TaskGraph,
+                on_event: Optional[Callable[[dict], None]] = None, reuse: Optional[dict] = None,
+                checkpoint=None, crop_pool=None) -> dict:
+    """
+    Crop, pair and grade page pairs as tasks of `graph`. `ready` is the future of
+    (parsed concepts, prompts): cropping doesn't wait for it, and each problem's Phase 1 task
+    starts as soon as both its pair and `ready` are done. Filtering and pairing run in page order
+    because duplicate detection spans pages and problems are numbered across them.
+    Page pairs whose content matches an entry in `reuse` (page_key -> prior page record) keep
+    their prior results without any model call. With a checkpoint store, each graded problem is
+    saved under the content of its crops and prompts. Under a run deadline, problems whose grading
+    can't start or finish within the budget are recorded as pending, and a cancelled run stops
+    cropping further pages.
+    """
+    reuse = reuse or {}
+    pages = {}
+    problem_tasks = []
+    tasks_lock = threading.Lock()
+    q_filter, s_filter = CropFilter(CROP_FILTER_ENABLED), CropFilter(CROP_FILTER_ENABLED)
+
+    def grade_pair(inputs, problem, page_no):
+        parsed_concepts, prompts = inputs
+        number = problem["problem"]
+
+        def grade():
+            result, stages = grade_staged(number, parsed_concepts, problem["question"], problem["solution"], prompts)
+            return {"result": result, "stages": stages}
+
+        deadline = current_deadline()
+        problem_key = content_key(problem["question"], problem["solution"], prompts["phase1"], prompts["versions"], number)
         try:
-            print(f"[Preprocessing] Processing question-solution pair {i}")
-            print(f"[Preprocessing] Question file: {q}")
-            print(f"[Preprocessing] Solution file: {s}")
-            q_crops = crop_blocks(q, os.path.join(STATIC_OUTPUT_DIR, f"tmp_q_{i}"))
-            s_crops = crop_blocks(s, os.path.join(STATIC_OUTPUT_DIR, f"tmp_s_{i}"))
-            print(f"[Preprocessing] Extracted {len(q_crops)} question crops: {q_crops}")
-            print(f"[Preprocessing] Extracted {len(s_crops)} solution crops: {s_crops}")
-            all_q_crops.extend(q_crops)
-            all_s_crops.extend(s_crops)
-        except Exception as e:
-            print(f"[Preprocessing] Error processing pair {i}: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            # Skip this pair if preprocessing fails
+            if deadline is not None and deadline.exhausted():
+                raise DeadlineExceeded(deadline.why())
+            graded = checkpointed(checkpoint, "phase1", problem_key, grade, keep=lambda value: not failed_result(value["result"]))
+        except DeadlineExceeded as e:
+            print(f"[Deadline] Problem {number} left pending: {str(e)}")
+            reason = deadline.why() if deadline is not None and deadline.exhausted() else str(e)
+            graded = {"result": pending_result(number, reason), "stages": {}}
+        problem.update(result=graded["result"], **graded["stages"])
+        emit(on_event, "problem", problem=number, page=page_no, confidence=problem["confidence"], result=graded["result"],
+             pending=bool(graded["result"].get("pending")))
+
+    def pair_page(crops, problems_before, page_no, key, q_page, s_page):
+        pairs, unmatched = pair_page_crops(page_no, q_page, s_page, crops[0], crops[1], q_filter, s_filter, crops_dir)
+        print(f"[Preprocessing] Created {len(pairs)} question-solution pairs for page pair {page_no}")
+        problems = []
+        for offset, pair in enumerate(pairs, start=1):
+            problem = dict(pair, problem=problems_before + offset)
+            print(f"[Pairing] Problem {problem['problem']} pairing confidence: {pair['confidence']}")
+            problems.append(problem)
+            task = graph.add(f"phase1:{problem['problem']}", grade_pair, ready, problem=problem, page_no=page_no)
+            with tasks_lock:
+                problem_tasks.append(task)
+        pages[page_no] = {
+            "index": page_no,
+            "key": key,
+            "question_page": f"{os.path.basename(q_page['source'])} #{q_page['number']}",
+            "solution_page": f"{os.path.basename(s_page['source'])} #{s_page['number']}",
+            "problems": problems,
+            "unmatched_solutions": unmatched,
+            "reused": False,
+        }
+        return problems_before + len(problems)
+
+    def reuse_page(problems_before, page_no, prior):
+        print(f"[Revision] Page pair {page_no} unchanged, reusing {len(prior['problems'])} graded problems")
+        problems = []
+        for offset, problem in enumerate(prior["problems"], start=1):
+            problems.append(dict(problem, problem=problems_before + offset))
+            emit(on_event, "problem", problem=problems_before + offset, page=page_no, confidence=problem["confidence"],
+                 result=problem["result"], reused=True)
+        pages[page_no] = dict(prior, index=page_no, problems=problems, reused=True)
+        return problems_before + len(problems)
+
+    numbered = graph.value(0)
+    in_flight = deque()
+    deadline = current_deadline()
+    for page_no, (q_page, s_page) in enumerate(page_pairs, start=1):
+        if ready.done() and ready.exception() is not None:
+            break  # the concept sheet failed; don't decode or crop the rest
+        if deadline is not None and deadline.cancelled.is_set():
+            print(f"[Deadline] Not cropping page pair {page_no} or later: {deadline.why()}")
+            break
+        key = page_key(q_page["digest"], s_page["digest"])
+        prior = reuse.get(key)
+        if prior is not None:
+            numbered = graph.add(f"reuse:{page_no}", reuse_page, numbered, page_no=page_no, prior=prior)
             continue
 
-    print(f"[Preprocessing] Total question crops: {len(all_q_crops)}")
-    print(f"[Preprocessing] Total solution crops: {len(all_s_crops)}")
-    
-    # If preprocessing fails, use original images as fallback
-    if len(all_q_crops) == 0 or len(all_s_crops) == 0:
-        print("[FALLBACK] Using original images instead of crops")
-        pairs = list(zip(questions, solutions))
-    else:
-        pairs = pair_by_order(all_q_crops, all_s_crops)
-    
-    print(f"[Preprocessing] Created {len(pairs)} question-solution pairs")
+        print(f"[Preprocessing] Processing page pair {page_no}")
+        print(f"[Preprocessing] Question page: {q_page['source']} #{q_page['number']}")
+        print(f"[Preprocessing] Solution page: {s_page['source']} #{s_page['number']}")
+        crops = graph.add(f"crop:{page_no}", crop_page_pair, index=page_no, q_page=q_page, s_page=s_page,
+                          crops_dir=crops_dir, crop_pool=crop_pool)
+        numbered = graph.add(f"pair:{page_no}", pair_page, crops, numbered,
+                             page_no=page_no, key=key, q_page=q_page, s_page=s_page)
+        # Bound the decoded pages held in memory while earlier pages are still being cropped
+        in_flight.append(numbered)
+        if len(in_flight) > PIPELINE_LOOKAHEAD:
+            in_flight.popleft().result()
 
-    # Step 2: Phase 1 Grading Loop
-    phase1_results = []
-    if len(pairs) == 0:
-        print("[ERROR] No question-solution pairs found! Cannot proceed with analysis.")
-        return {"analysis_table": None, "analysis_path": None}
-    
-    for i, (qpath, spath) in enumerate(pairs, start=1):
-        try:
-            print(f"[Phase1] Evaluating problem {i}")
-            print(f"[Phase1] Question: {qpath}")
-            print(f"[Phase1] Solution: {spath}")
-            result = call_gemini_phase1(parsed_concepts, qpath, spath, phase1_prompt)
-            print(f"[Phase1] Result for problem {i}: {result}")
-            phase1_results.append(result)
-        except Exception as e:
-            print(f"[Phase1] Error evaluating problem {i}: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            phase1_results.append({
-                "concept_id": None,
-                "concept_name": "",
-                "is_correct": False,
-                "status_summary": f"Error grading problem {i}: {str(e)}"
-            })
-        time.sleep(0.5)
+    numbered.result()
+    ready.result()  # raises ConceptSheetError before any Phase 1 result is awaited
+    with tasks_lock:
+        tasks = list(problem_tasks)
+    for task in tasks:
+        task.result()
 
-    # Step 3: Phase 2 - Synthesis
-    print("[Phase2] Generating final analysis...")
+    filtered = q_filter.dropped + s_filter.dropped
+    print(f"[Filter] Skipped {len(filtered)} blank, trivial or duplicate crops")
+    return {"pages": [pages[n] for n in sorted(pages)], "filtered_crops": filtered}
+
+def page_results(pages: list[dict]) -> list[dict]:
+    """Phase 1 results of all page records in problem order"""
+    return [problem["result"] for page in pages for problem in page["problems"]]
+
+def synthesize(parsed_concepts: dict, phase1_results: list[dict], phase2_header: str) -> dict:
+    """Phase 2 over the given results"""
     print(f"[DEBUG] Phase 1 results for synthesis: {len(phase1_results)} items")
     for i, result in enumerate(phase1_results):
         print(f"[DEBUG] Result {i+1}: concept_id={result.get('concept_id')}, status_summary={result.get('status_summary', 'N/A')[:50]}...")
     
-    final = call_gemini_phase2(parsed_concepts, phase1_results, phase2_prompt)
+    final = call_gemini_phase2(parsed_concepts, phase1_results, phase2_header)
     print(f"[DEBUG] Phase 2 final result: {final}")
+    return final
 
-    os.makedirs(STATIC_OUTPUT_DIR, exist_ok=True)
-    fill_data = final.get("fill_data", {})
+def local_summary(parsed_concepts: dict, phase1_results: list[dict], reason: str, pending: int = 0) -> dict:
+    """
+    Phase 2 stand-in computed without the model: each tested concept's status from its graded
+    problems, and a short analysis saying what was skipped and how many problems are pending.
+    """
+    concepts = parsed_concepts.get("concepts", {})
+    verdicts = defaultdict(list)
+    for result in phase1_results:
+        if result.get("concept_id") is not None and not result.get("pending"):
+            verdicts[str(result["concept_id"])].append(bool(result.get("is_correct")))
+    fill_data = {}
+    lines = []
+    for concept_id in sorted(verdicts, key=lambda k: (0, int(k)) if k.isdigit() else (1, k)):
+        correct, tested = sum(verdicts[concept_id]), len(verdicts[concept_id])
+        status = "Mastered" if correct == tested else "Partially correct" if correct else "Needs practice"
+        fill_data[concept_id] = f"{status} - {correct} of {tested} problems correct"
+        name = concepts.get(concept_id, {}).get("name", f"Concept {concept_id}")
+        lines.append(f"- {name}: {fill_data[concept_id]}")
+    note = f"Summary computed without the written analysis ({reason})."
+    if pending:
+        note += f" {pending} problems were not graded and are marked pending."
+    return {"fill_data": fill_data, "detailed_analysis": "\n".join([note, ""] + lines), "local": True}
+
+def synthesize_within_budget(parsed_concepts: dict, phase1_results: list[dict], run_phase2: Callable,
+                             on_event: Optional[Callable[[dict], None]] = None, pending: int = 0) -> dict:
+    """
+    Phase 2 through run_phase2(), or the local summary instead when too little of the run's budget
+    is left for it (as when problems were left pending for lack of time) or it runs out of time.
+    """
+    deadline = current_deadline()
+    reason = None
+    if deadline is not None and deadline.exhausted(DEADLINE_PHASE2_SECONDS):
+        reason = deadline.why() if deadline.exhausted() else f"only {deadline.remaining():.0f}s left of the time budget"
+    if reason is None:
+        print("[Phase2] Generating final analysis...")
+        emit(on_event, "stage", stage="synthesis")
+        try:
+            return run_phase2()
+        except DeadlineExceeded as e:
+            reason = str(e)
+    print(f"[Deadline] Skipping Phase 2, summarizing locally: {reason}")
+    emit(on_event, "stage", stage="local_summary", reason=reason, pending=pending)
+    return local_summary(parsed_concepts, phase1_results, reason, pending)
+
+def write_outputs(run_id: str, concept_sheet: str, phase1_results: list[dict], fill_data: dict,
+                  detailed_analysis: str, parsed_concepts: dict) -> dict:
+    """Write the analysis table and the detailed analysis into the run directory"""
+    out_dir = run_dir(run_id)
     print(f"[DEBUG] Fill data extracted: {fill_data}")
     print(f"[DEBUG] Fill data keys: {list(fill_data.keys())}")
     
     # Generate analysis table using parsed concepts
-    analysis_table_path = os.path.join(STATIC_OUTPUT_DIR, "analysis_table.md")
-    analysis_text_path = os.path.join(STATIC_OUTPUT_DIR, "detailed_analysis.txt")
+    analysis_table_path = os.path.join(out_dir, "analysis_table.md")
+    analysis_text_path = os.path.join(out_dir, "detailed_analysis.txt")
 
     print(f"[DEBUG] Generating analysis table...")
     generate_analysis_table(concept_sheet, phase1_results, fill_data, analysis_table_path, parsed_concepts)
     print(f"[DEBUG] Analysis table saved to: {analysis_table_path}")
 
     with open(analysis_text_path, "w", encoding="utf-8") as f:
-        f.write(final.get("detailed_analysis", ""))
-
+        f.write(detailed_analysis)
     return {"analysis_table": analysis_table_path, "analysis_path": analysis_text_path}
+
+def finish_run(run_id: str, manifest: dict) -> dict:
+    """Persist the manifest and build the pipeline result"""
+    save_manifest(run_id, manifest)
+    try:
+        ANALYTICS.record_run(manifest)
+    except Exception as e:
+        # Analytics must never fail a grading
+        print(f"[Analytics] Could not record run {run_id}: {str(e)}")
+    pages = manifest["pages"]
+    return {
+        "run_id": run_id,
+        "parent_run_id": manifest.get("parent_run_id"),
+        "analysis_table": manifest["outputs"]["analysis_table"],
+        "analysis_path": manifest["outputs"]["analysis_path"],
+        "unmatched_solutions": [path for page in pages for path in page["unmatched_solutions"]],
+        "filtered_crops": manifest.get("filtered_crops", []),
+        "uploads": manifest.get("uploads", []),
+        "reused_pages": sum(1 for page in pages if page["reused"]),
+        "recomputed_concepts": manifest.get("recomputed_concepts"),
+        "partial": manifest.get("partial", False),
+        "pending_problems": manifest.get("pending_problems", 0),
+    }
+
+def run_pipeline(concept_sheet: str, questions: list[str], solutions: list[str],
+                 submissions: Optional[list[str]] = None, page_roles: str = "order",
+                 on_event: Optional[Callable[[dict], None]] = None, uploads: Optional[list[dict]] = None,
+                 student_id: Optional[str] = None, class_id: Optional[str] = None,
+                 checkpoint=None, crop_pool=None, deadline: Optional[Deadline] = None):
+    """
+    Grade a submission. Questions and solutions may be images, PDFs or multi-page TIFFs;
+    combined documents holding both go in `submissions` and are split by `page_roles`.
+    on_event receives progress events (stages and each graded problem) as they happen.
+    uploads describes the received files (sizes, original dimensions) and is kept with the result.
+    Every run is stored under its run id so it can later be revised with revise_run.
+    student_id and class_id attribute the run in the class analytics.
+    checkpoint (a Checkpoints store) and crop_pool (a process pool for segmentation) are used by bulk grading.
+    deadline bounds every stage and model call; when it runs low the run finishes with partial
+    results (ungraded problems pending, Phase 2 replaced by a local summary).
+    """
+    use_deadline(deadline)
+    if deadline is not None and deadline.exhausted():
+        print(f"[Deadline] Not starting the pipeline: {deadline.why()}")
+        emit(on_event, "error", message=f"Not started: {deadline.why()}")
+        return {"run_id": None, "analysis_table": None, "analysis_path": None}
+    print(f"[DEBUG] Starting pipeline with concept sheet: {concept_sheet}")
+    print(f"[DEBUG] Concept sheet exists: {os.path.exists(concept_sheet)}")
+    if os.path.exists(concept_sheet):
+        print(f"[DEBUG] Concept sheet size: {os.path.getsize(concept_sheet)} bytes")
+
+    run_id = create_run()
+    inputs = store_inputs(run_id, concept_sheet, questions, solutions, submissions)
+    usage = track_usage()
+    print(f"[DEBUG] Run id: {run_id}")
+    
+    # The run is a stage graph: concept sheet parsing (FOUNDATION of every Phase 1 call) runs
+    # alongside page decoding and cropping, and each problem is graded once its pair and the concepts are ready
+    graph = TaskGraph(PIPELINE_WORKERS)
+    try:
+        print("[STEP 0] Parsing concept sheet...")
+        emit(on_event, "stage", stage="concepts")
+        concepts = graph.add("concepts", checkpointed, checkpoint=checkpoint, stage="concepts",
+                             key=content_key(inputs["concept_sheet"], REGISTRY.version("concept_sheet_prompt")),
+                             compute=lambda: parse_concept_sheet(concept_sheet), keep=lambda value: not value.get("error"))
+        ready = graph.add("prompts", grading_inputs, concepts, on_event=on_event)
+
+        if inputs["submissions"]:
+            page_pairs = iter_role_pairs(inputs["submissions"], mode=page_roles)
+        else:
+            page_pairs = iter_page_pairs(inputs["questions"], inputs["solutions"])
+        graded = grade_pages(page_pairs, ready, os.path.join(run_dir(run_id), "crops"), graph, on_event,
+                             checkpoint=checkpoint, crop_pool=crop_pool)
+        parsed_concepts, prompts = ready.result()
+    except ConceptSheetError as e:
+        emit(on_event, "error", message=str(e))
+        return {"run_id": run_id, "analysis_table": None, "analysis_path": None}
+    finally:
+        print(f"[DAG] {graph.report()}")
+        graph.shutdown()
+    print(f"[DEBUG] Parsed concepts: {len(parsed_concepts.get('concepts', {}))} concepts")
+    phase1_results = page_results(graded["pages"])
+
+    if len(phase1_results) == 0:
+        print("[ERROR] No question-solution pairs found! Cannot proceed with analysis.")
+        emit(on_event, "error", message="No question-solution pairs found")
+        return {"run_id": run_id, "analysis_table": None, "analysis_path": None}
+
+    # Step 3: Phase 2 - Synthesis
+    pending = sum(1 for result in phase1_results if result.get("pending"))
+    final = synthesize_within_budget(parsed_concepts, phase1_results, lambda: checkpointed(
+        checkpoint, "phase2", content_key(prompts["phase2"], phase1_results),
+        lambda: synthesize(parsed_concepts, phase1_results, prompts["phase2"]), keep=lambda value: bool(value.get("fill_data")),
+    ), on_event, pending)
+    fill_data = final.get("fill_data", {})
+    detailed_analysis = final.get("detailed_analysis", "")
+
+    outputs = write_outputs(run_id, concept_sheet, phase1_results, fill_data, detailed_analysis, parsed_concepts)
+    return finish_run(run_id, {
+        "run_id": run_id,
+        "parent_run_id": None,
+        "student_id": student_id,
+        "class_id": class_id,
+        "created": time.time(),
+        "page_roles": page_roles,
+        "inputs": inputs,
+        "concept_sheet_digest": file_digest(inputs["concept_sheet"]),
+        "parsed_concepts": parsed_concepts,
+        "pages": graded["pages"],
+        "filtered_crops": graded["filtered_crops"],
+        "fill_data": fill_data,
+        "detailed_analysis": detailed_analysis,
+        "outputs": outputs,
+        "uploads": uploads or [],
+        "usage": usage.as_list(),
+        "deadline": deadline.state() if deadline is not None else None,
+        "pending_problems": pending,
+        "partial": bool(pending or final.get("local")),
+    })
+
+def run_problem_detail(run_id: str, number: int) -> dict:
+    """
+    Full diagnosis of problem `number` of a stored run, fetched the first time a teacher opens it
+    when the problem was graded at a lower verbosity tier. Kept next to the run, which stays unchanged.
+    Returns {"result", "cached"}.
+    """
+    manifest = load_manifest(run_id)
+    if manifest is None:
+        raise ValueError(f"Run {run_id} not found")
+    problem = next((p for page in manifest["pages"] for p in page["problems"] if p["problem"] == number), None)
+    if problem is None:
+        raise LookupError(f"Run {run_id} has no problem {number}")
+    if problem["result"].get("verbosity", "full") == "full":
+        return {"result": problem["result"], "cached": True}
+
+    path = os.path.join(run_dir(run_id), "details", f"{number}.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return {"result": json.load(f), "cached": True}
+    parsed_concepts = manifest["parsed_concepts"]
+    result = problem_detail(number, parsed_concepts, problem["question"], problem["solution"],
+                            prepare_prompts(parsed_concepts), problem["result"])
+    if result is not problem["result"]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    return {"result": result, "cached": False}
+
+def concepts_of(pages: list[dict]) -> set[str]:
+    """Concept ids graded on the given page records"""
+    return {
+        str(problem["result"].get("concept_id"))
+        for page in pages for problem in page["problems"]
+        if problem["result"].get("concept_id") is not None
+    }
+
+def revise_run(run_id: str, replacements: dict, on_event: Optional[Callable[[dict], None]] = None,
+               uploads: Optional[list[dict]] = None, deadline: Optional[Deadline] = None):
+    """
+    Re-grade a previous run after some of its files were replaced.
+    replacements maps a role ("questions", "solutions", "submissions") to {0-based index: new file path}.
+    Pages are diffed by content hash: only changed pages are cropped and graded again, and Phase 2
+    only recomputes the concepts whose Phase 1 results changed. Everything else is reused.
+    deadline bounds the regrading as in run_pipeline.
+    """
+    previous = load_manifest(run_id)
+    if previous is None:
+        raise ValueError(f"Run {run_id} not found")
+
+    inputs = {role: list(previous["inputs"][role]) for role in ("questions", "solutions", "submissions")}
+    inputs["concept_sheet"] = previous["inputs"]["concept_sheet"]
+    for role, files in replacements.items():
+        for index in files:
+            if index < 0 or index >= len(inputs[role]):
+                raise ValueError(f"{role} index {index + 1} does not exist in run {run_id}")
+
+    new_run_id = create_run()
+    usage = track_usage()
+    use_deadline(deadline)
+    print(f"[Revision] Revising run {run_id} as {new_run_id}")
+    for role, files in replacements.items():
+        for index, path in files.items():
+            # Replaced files are copied into the new run; unchanged ones stay in the parent run
+            inputs[role][index] = store_input(new_run_id, path, f"{role[:-1]}_{index + 1}")
+
+    parsed_concepts = previous["parsed_concepts"]
+    # Pages with problems the parent run left pending (or failed to grade) are graded again, changed or not
+    unfinished = [page for page in previous["pages"] if any(failed_result(p["result"]) for p in page["problems"])]
+    unfinished_keys = {page["key"] for page in unfinished}
+    reuse = {page["key"]: page for page in previous["pages"] if page["key"] not in unfinished_keys}
+    graph = TaskGraph(PIPELINE_WORKERS)
+    try:
+        ready = graph.value(grading_inputs(parsed_concepts, on_event))
+        prompts = ready.result()[1]
+        if inputs["submissions"]:
+            page_pairs = iter_role_pairs(inputs["submissions"], mode=previous.get("page_roles", "order"))
+        else:
+            page_pairs = iter_page_pairs(inputs["questions"], inputs["solutions"])
+        graded = grade_pages(page_pairs, ready, os.path.join(run_dir(new_run_id), "crops"), graph, on_event, reuse)
+    finally:
+        graph.shutdown()
+    pages = graded["pages"]
+    phase1_results = page_results(pages)
+    if len(phase1_results) == 0:
+        emit(on_event, "error", message="No question-solution pairs found")
+        return {"run_id": new_run_id, "analysis_table": None, "analysis_path": None}
+
+    # Concepts touched by regraded pages, or by pages that disappeared or were unfinished, need a new status
+    new_keys = {page["key"] for page in pages}
+    affected = concepts_of([page for page in pages if not page["reused"]])
+    affected |= concepts_of([page for page in previous["pages"] if page["key"] not in new_keys])
+    affected |= concepts_of(unfinished)
+    affected &= set(parsed_concepts.get("concepts", {}).keys())
+    print(f"[Revision] {sum(1 for p in pages if not p['reused'])} page pairs regraded, concepts to recompute: {sorted(affected)}")
+
+    fill_data = dict(previous.get("fill_data", {}))
+    detailed_analysis = previous.get("detailed_analysis", "")
+    pending = sum(1 for result in phase1_results if result.get("pending"))
+    final = {}
+    if affected:
+        print("[Phase2] Recomputing statuses of changed concepts...")
+        subset = {
+            "concepts": {cid: parsed_concepts["concepts"][cid] for cid in sorted(affected, key=str)},
+            "total_concepts": len(affected),
+        }
+        subset_results = [r for r in phase1_results if str(r.get("concept_id")) in affected]
+        final = synthesize_within_budget(subset, subset_results,
+                                         lambda: synthesize(subset, subset_results, prepare_prompts(subset)["phase2"]),
+                                         on_event, pending)
+        fill_data.update({cid: status for cid, status in final.get("fill_data", {}).items() if cid in affected})
+        if final.get("detailed_analysis"):
+            # Replace the update of an earlier revision instead of stacking one per revision
+            detailed_analysis = detailed_analysis.split(REVISION_UPDATE)[0]
+            detailed_analysis = f"{detailed_analysis}{REVISION_UPDATE} (concepts {', '.join(sorted(affected))}):\n{final['detailed_analysis']}"
+
+    outputs = write_outputs(new_run_id, inputs["concept_sheet"], phase1_results, fill_data, detailed_analysis, parsed_concepts)
+    return finish_run(new_run_id, dict(
+        previous,
+        run_id=new_run_id,
+        parent_run_id=run_id,
+        created=time.time(),
+        inputs=inputs,
+        pages=pages,
+        filtered_crops=graded["filtered_crops"],
+        fill_data=fill_data,
+        detailed_analysis=detailed_analysis,
+        outputs=outputs,
+        uploads=uploads or [],
+        recomputed_concepts=sorted(affected),
+        usage=usage.as_list(),
+        deadline=deadline.state() if deadline is not None else None,
+        pending_problems=pending,
+        partial=bool(pending or final.get("local")),
+    ))
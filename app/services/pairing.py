@@ -0,0 +1,156 @@
+import cv2
+import numpy as np
+
+# Pairs whose assignment cost exceeds this are reported as unmatched instead of graded together
+MAX_PAIR_COST = 0.6
+# Size problem-number markers are normalized to before template matching
+MARKER_SIZE = (32, 32)
+
+# Weights of the individual cost terms (sum to 1 so cost and confidence stay in [0, 1])
+ORDER_WEIGHT = 0.45
+POSITION_WEIGHT = 0.3
+MARKER_WEIGHT = 0.25
+
+def extract_marker(gray):
+    """
+    Cut out the leading glyph group of the first text line (typically the problem number,
+    e.g. "1." or "Q2") without OCR. Returns a normalized patch or None.
+    """
+    _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(th, connectivity=8)
+    comps = [s for s in stats[1:count] if s[cv2.CC_STAT_AREA] >= 8]
+    if not comps:
+        return None
+
+    # First text line: components starting near the topmost one
+    top = min(s[cv2.CC_STAT_TOP] for s in comps)
+    line_h = max(int(np.median([s[cv2.CC_STAT_HEIGHT] for s in comps])), 1)
+    line = sorted((s for s in comps if s[cv2.CC_STAT_TOP] <= top + line_h), key=lambda s: s[cv2.CC_STAT_LEFT])
+
+    # Leading group: glyphs separated by less than half a line height
+    x0, y0 = line[0][cv2.CC_STAT_LEFT], line[0][cv2.CC_STAT_TOP]
+    x1, y1 = x0 + line[0][cv2.CC_STAT_WIDTH], y0 + line[0][cv2.CC_STAT_HEIGHT]
+    for s in line[1:]:
+        if s[cv2.CC_STAT_LEFT] - x1 > line_h / 2:
+            break
+        x1 = max(x1, s[cv2.CC_STAT_LEFT] + s[cv2.CC_STAT_WIDTH])
+        y0 = min(y0, s[cv2.CC_STAT_TOP])
+        y1 = max(y1, s[cv2.CC_STAT_TOP] + s[cv2.CC_STAT_HEIGHT])
+    # A marker is short; a long leading group is a word, not a number
+    if x1 - x0 > 3 * line_h:
+        return None
+    return cv2.resize(th[y0:y1, x0:x1], MARKER_SIZE, interpolation=cv2.INTER_AREA)
+
+def marker_similarity(a, b):
+    """Normalized cross-correlation of two marker patches in [0, 1]; None if either is missing"""
+    if a is None or b is None:
+        return None
+    score = cv2.matchTemplate(a.astype(np.float32), b.astype(np.float32), cv2.TM_CCOEFF_NORMED)[0][0]
+    if not np.isfinite(score):
+        return None
+    return float(max(0.0, score))
+
+def crop_features(crops):
+    """Layout descriptors and problem-number markers for a list of crop records"""
+    n = len(crops)
+    features = []
+    for rank, crop in enumerate(crops):
+        x, y, w, h = crop["box"]
+        page_h, page_w = crop["page_shape"][:2]
+        gray = cv2.imread(crop["path"], cv2.IMREAD_GRAYSCALE)
+        features.append({
+            "rank": rank / (n - 1) if n > 1 else 0.0,
+            "y": (y + h / 2.0) / page_h,
+            "x": (x + w / 2.0) / page_w,
+            "marker": extract_marker(gray) if gray is not None and gray.size else None,
+        })
+    return features
+
+def pair_cost(qf, sf):
+    """Cost in [0, 1] of grading question crop qf against solution crop sf"""
+    cost = ORDER_WEIGHT * abs(qf["rank"] - sf["rank"])
+    cost += POSITION_WEIGHT * min(1.0, abs(qf["y"] - sf["y"]) + 0.5 * abs(qf["x"] - sf["x"]))
+    similarity = marker_similarity(qf["marker"], sf["marker"])
+    # Without markers on both sides, this term is neutral
+    cost += MARKER_WEIGHT * (0.5 if similarity is None else 1.0 - similarity)
+    return cost
+
+def hungarian(cost):
+    """
+    Minimum-cost assignment for an n x m cost matrix with n <= m.
+    Returns assignment[i] = column for each row i.
+    """
+    n, m = len(cost), len(cost[0])
+    INF = float("inf")
+    u, v = [0.0] * (n + 1), [0.0] * (m + 1)
+    p, way = [0] * (m + 1), [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0, delta, j1 = p[j0], INF, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j], way[j] = cur, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    assignment = [0] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            assignment[p[j] - 1] = j - 1
+    return assignment
+
+def pair_crops(q_crops, s_crops, max_cost=MAX_PAIR_COST):
+    """
+    Assign question crops to solution crops by layout position, reading order and
+    problem-number markers. Returns pairs with confidence plus the crops left unmatched,
+    so a segmentation mismatch no longer shifts every following pair.
+    """
+    result = {"pairs": [], "unmatched_questions": [], "unmatched_solutions": []}
+    if not q_crops or not s_crops:
+        result["unmatched_questions"] = list(q_crops)
+        result["unmatched_solutions"] = list(s_crops)
+        return result
+
+    q_feats, s_feats = crop_features(q_crops), crop_features(s_crops)
+    transposed = len(q_crops) > len(s_crops)
+    rows, cols = (s_feats, q_feats) if transposed else (q_feats, s_feats)
+    cost = [[pair_cost(*((c, r) if transposed else (r, c))) for c in cols] for r in rows]
+    assignment = hungarian(cost)
+
+    matched = []
+    for r, c in enumerate(assignment):
+        qi, si = (c, r) if transposed else (r, c)
+        if cost[r][c] <= max_cost:
+            matched.append((qi, si, cost[r][c]))
+    matched.sort()
+
+    matched_q = {qi for qi, _, _ in matched}
+    matched_s = {si for _, si, _ in matched}
+    result["pairs"] = [
+        {"question": q_crops[qi], "solution": s_crops[si], "confidence": round(1.0 - c, 3)}
+        for qi, si, c in matched
+    ]
+    result["unmatched_questions"] = [c for i, c in enumerate(q_crops) if i not in matched_q]
+    result["unmatched_solutions"] = [c for i, c in enumerate(s_crops) if i not in matched_s]
+    return result
@@ -1,6 +1,7 @@
 import cv2
 import numpy as np
 import os
+from app.services.segmentation import segment_regions
 
 def load_gray(path):
     img = cv2.imread(path)
@@ -9,65 +10,130 @@ def load_gray(path):
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     return img, gray
 
+# Width of the pyramid level block detection runs on; boxes are mapped back to full resolution,
+# so detection cost and its thresholds don't depend on the camera resolution
+DETECTION_WIDTH = 1000
+# Padding around each block, in detection-level pixels (scaled with the page)
+CROP_PADDING = 3
+# Skew below this is left alone; estimates above the maximum are layout, not a tilted page
+MIN_SKEW_DEGREES = 0.3
+MAX_SKEW_DEGREES = 15
+
+def pyramid_level(gray, width=DETECTION_WIDTH):
+    """Copy of gray at most width pixels wide (halved with pyrDown, then area-resized) and its (x, y) scale to full resolution"""
+    level = gray
+    while level.shape[1] >= 2 * width:
+        level = cv2.pyrDown(level)
+    if level.shape[1] > width:
+        level = cv2.resize(level, (width, max(1, round(level.shape[0] * width / level.shape[1]))),
+                           interpolation=cv2.INTER_AREA)
+    return level, (gray.shape[1] / level.shape[1], gray.shape[0] / level.shape[0])
+
+def skew_angle(gray):
+    """Rotation in degrees (counter-clockwise) that straightens the ink on a page, 0 if there is nothing to fix"""
+    _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    points = cv2.findNonZero(th)
+    if points is None:
+        return 0.0
+    angle = cv2.minAreaRect(points)[-1]
+    # OpenCV versions report minAreaRect angles in different ranges; fold into [-45, 45)
+    angle = (angle + 45) % 90 - 45
+    return angle if MIN_SKEW_DEGREES <= abs(angle) <= MAX_SKEW_DEGREES else 0.0
+
+def rotation_matrix(shape, angle):
+    h, w = shape[:2]
+    return cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, 1.0)
+
 def deskew(gray):
-    coords = np.column_stack(np.where(gray < 255))
-    if len(coords) == 0:
+    angle = skew_angle(gray)
+    if not angle:
         return gray
-    angle = cv2.minAreaRect(coords)[-1]
-    if angle < -45:
-        angle = 90 + angle
-    (h, w) = gray.shape
-    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
-    return cv2.warpAffine(gray, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    h, w = gray.shape
+    return cv2.warpAffine(gray, rotation_matrix(gray.shape, angle), (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
 
-def find_blocks(gray, min_area=1500):
+def find_blocks(gray, min_area=None):
+    """Return problem boxes (x, y, w, h) in reading order; min_area defaults to a resolution-scaled value"""
     print(f"[DEBUG] Finding blocks in image of shape: {gray.shape}")
-    _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
-    dil = cv2.dilate(th, kernel, iterations=1)
-    contours, _ = cv2.findContours(dil, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    print(f"[DEBUG] Found {len(contours)} contours")
-    boxes = []
-    for i, c in enumerate(contours):
-        x, y, w, h = cv2.boundingRect(c)
-        area = w * h
-        print(f"[DEBUG] Contour {i}: area={area}, min_area={min_area}")
-        if area > min_area:
-            boxes.append((x, y, w, h))
-            print(f"[DEBUG] Added box: ({x}, {y}, {w}, {h})")
-    boxes = sorted(boxes, key=lambda b: b[1])
+    boxes = segment_regions(gray, min_area=min_area)
     print(f"[DEBUG] Final boxes: {boxes}")
     return boxes
 
-def crop_blocks(image_path, out_dir):
+def full_resolution_box(box, scale, shape, pad=CROP_PADDING):
+    """Detection-level box (x, y, w, h) as padded full-resolution bounds (x0, y0, x1, y1) clamped to the page"""
+    x, y, w, h = box
+    sx, sy = scale
+    full_h, full_w = shape[:2]
+    x0 = max(0, int((x - pad) * sx))
+    y0 = max(0, int((y - pad) * sy))
+    x1 = min(full_w, int(np.ceil((x + w + pad) * sx)))
+    y1 = min(full_h, int(np.ceil((y + h + pad) * sy)))
+    return x0, y0, x1, y1
+
+def cut(img, bounds, rotation=None):
+    """Region of the page, taken from the deskewed page when rotation is given (only the region is warped)"""
+    x0, y0, x1, y1 = bounds
+    if rotation is None:
+        return img[y0:y1, x0:x1]
+    shifted = rotation.copy()
+    shifted[0, 2] -= x0
+    shifted[1, 2] -= y0
+    return cv2.warpAffine(img, shifted, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def crop_regions(img, out_dir):
+    """
+    Crop the problem blocks of an already decoded BGR image into out_dir.
+    Skew and blocks are found on a low-resolution pyramid level; each block is then cut from the
+    full-resolution (deskewed) page. Returns crop records with the file path, the block box in
+    full-resolution coordinates and the page shape.
+    """
     os.makedirs(out_dir, exist_ok=True)
-    try:
-        img, gray = load_gray(image_path)
-        gray = deskew(gray)
-        boxes = find_blocks(gray)
-        crops = []
-        print(f"[DEBUG] Found {len(boxes)} blocks in image")
-        for i, (x, y, w, h) in enumerate(boxes, start=1):
-            pad = 5
-            crop = img[y - pad:y + h + pad, x - pad:x + w + pad]
-            print(f"[DEBUG] Block {i}: crop shape = {crop.shape}")
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    level, scale = pyramid_level(gray)
+    angle = skew_angle(level)
+    if angle:
+        print(f"[DEBUG] Deskewing page by {angle:.2f} degrees")
+        level = cv2.warpAffine(level, rotation_matrix(level.shape, angle), (level.shape[1], level.shape[0]),
+                               flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    rotation = rotation_matrix(img.shape, angle) if angle else None
+    boxes = find_blocks(level)
+    crops = []
+    print(f"[DEBUG] Found {len(boxes)} blocks in image (detected at {level.shape[1]}x{level.shape[0]})")
+    for i, box in enumerate(boxes, start=1):
+        bounds = full_resolution_box(box, scale, img.shape)
+        crop = cut(img, bounds, rotation)
+        print(f"[DEBUG] Block {i}: crop shape = {crop.shape}")
+        
+        # Check if crop is empty
+        if crop.size == 0 or crop.shape[0] == 0 or crop.shape[1] == 0:
+            print(f"[DEBUG] Block {i} is empty, skipping")
+            continue
             
-            # Check if crop is empty
-            if crop.size == 0 or crop.shape[0] == 0 or crop.shape[1] == 0:
-                print(f"[DEBUG] Block {i} is empty, skipping")
-                continue
-                
-            fname = os.path.join(out_dir, f"block_{i}.jpg")
-            success = cv2.imwrite(fname, crop)
-            if not success:
-                print(f"[DEBUG] Failed to write block {i}, skipping")
-                continue
-            crops.append(fname)
-            print(f"[DEBUG] Successfully saved block {i} to {fname}")
-        return crops
+        fname = os.path.join(out_dir, f"block_{i}.jpg")
+        success = cv2.imwrite(fname, crop)
+        if not success:
+            print(f"[DEBUG] Failed to write block {i}, skipping")
+            continue
+        x, y, w, h = box
+        full_box = (int(x * scale[0]), int(y * scale[1]), int(round(w * scale[0])), int(round(h * scale[1])))
+        crops.append({"path": fname, "box": full_box, "page_shape": img.shape[:2]})
+        print(f"[DEBUG] Successfully saved block {i} to {fname}")
+    return crops
+
+def crop_image(img, out_dir):
+    """Crop the problem blocks of an already decoded BGR image and return their paths"""
+    return [crop["path"] for crop in crop_regions(img, out_dir)]
+
+def crop_blocks(image_path, out_dir):
+    try:
+        img, _ = load_gray(image_path)
+        return crop_image(img, out_dir)
     except Exception as e:
         raise ValueError(f"Error processing image {image_path}: {str(e)}")
 
-def pair_by_order(q_crops, s_crops):
-    n = min(len(q_crops), len(s_crops))
-    return list(zip(q_crops[:n], s_crops[:n]))
+def save_page(page, out_dir):
+    """Write a rasterized page to disk so it can be sent to the model as a whole"""
+    os.makedirs(out_dir, exist_ok=True)
+    fname = os.path.join(out_dir, "page.jpg")
+    if not cv2.imwrite(fname, page["image"]):
+        raise ValueError(f"Could not write page {page['number']} of {page['source']}")
+    return fname
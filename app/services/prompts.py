@@ -0,0 +1,160 @@
+import hashlib
+import json
+import math
+import os
+import re
+from app.config.settings import PROMPTS_DIR, PHASE1_VERBOSITY
+
+# Rough token estimate used for reporting; Gemini averages ~4 characters per token on English text
+CHARS_PER_TOKEN = 4
+_WORD_OR_SYMBOL = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text):
+    """Estimate the token count of a text without a model round trip"""
+    if not text:
+        return 0
+    # Symbol-heavy text (math, JSON) tokenizes worse than prose, so take the larger estimate
+    return max(math.ceil(len(text) / CHARS_PER_TOKEN), len(_WORD_OR_SYMBOL.findall(text)))
+
+class PromptRegistry:
+    """
+    Loads every prompt template in a directory once, versions it by content hash
+    and reports its size, so requests are assembled from memory instead of disk reads.
+    """
+
+    def __init__(self, prompt_dir):
+        self.prompt_dir = prompt_dir
+        self.templates = {}
+        self.load()
+
+    def load(self):
+        templates = {}
+        for fname in sorted(os.listdir(self.prompt_dir)):
+            if not fname.endswith(".txt"):
+                continue
+            with open(os.path.join(self.prompt_dir, fname), "r", encoding="utf-8") as f:
+                text = f.read()
+            templates[os.path.splitext(fname)[0]] = {
+                "text": text,
+                "version": hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+                "tokens": estimate_tokens(text),
+            }
+        self.templates = templates
+        print(f"[Prompts] Loaded {len(templates)} templates: "
+              + ", ".join(f"{k} v{v['version']} (~{v['tokens']} tokens)" for k, v in templates.items()))
+
+    def get(self, name):
+        if name not in self.templates:
+            raise KeyError(f"Unknown prompt template: {name}")
+        return self.templates[name]["text"]
+
+    def version(self, name):
+        return self.templates[name]["version"]
+
+    def describe(self):
+        """Version and token count of every template"""
+        return {name: {"version": t["version"], "tokens": t["tokens"]} for name, t in self.templates.items()}
+
+REGISTRY = PromptRegistry(PROMPTS_DIR)
+
+_TEXT = {"type": "STRING"}
+_CONCEPT_ID = {"type": "INTEGER", "nullable": True}
+_VERDICT = {"type": "BOOLEAN"}
+_ERROR_TYPE = {"type": "STRING", "enum": ["conceptual", "procedural", "calculation", "incomplete", "none"]}
+
+# Phase 1 verbosity tiers: prompt template, response fields and output budget. Thinking tokens count
+# as output, so capped tiers cap them too (None leaves the model's default). Every tier returns the two
+# final answers, which the local answer check (verify_verdict) compares.
+PHASE1_TIERS = {
+    "minimal": {
+        "template": "phase1_minimal_prompt",
+        "fields": {"concept_id": _CONCEPT_ID, "student_transcription": _TEXT, "correct_answer": _TEXT,
+                   "is_correct": _VERDICT, "status_summary": _TEXT},
+        "max_output_tokens": 192,
+        "thinking_budget": 0,
+    },
+    "standard": {
+        "template": "phase1_standard_prompt",
+        "fields": {"concept_id": _CONCEPT_ID, "concept_name": _TEXT, "student_transcription": _TEXT,
+                   "correct_answer": _TEXT, "is_correct": _VERDICT, "error_type": _ERROR_TYPE, "status_summary": _TEXT},
+        "max_output_tokens": 384,
+        "thinking_budget": 1024,
+    },
+    "full": {
+        "template": "phase1_prompt",
+        "fields": {"concept_id": _CONCEPT_ID, "concept_name": _TEXT, "question_transcription": _TEXT,
+                   "student_transcription": _TEXT, "correct_answer": _TEXT, "is_correct": _VERDICT,
+                   "error_type": _ERROR_TYPE, "analysis": _TEXT, "status_summary": _TEXT},
+        # Uncapped like the original prompt: a long diagnosis must not be cut off mid-JSON
+        "max_output_tokens": None,
+        "thinking_budget": None,
+    },
+}
+
+def phase1_tier(name=None):
+    """Settings of a Phase 1 verbosity tier (the configured one by default)"""
+    name = (name or PHASE1_VERBOSITY).lower()
+    if name not in PHASE1_TIERS:
+        raise ValueError(f"Unknown Phase 1 verbosity {name!r}; expected one of {', '.join(PHASE1_TIERS)}")
+    return dict(PHASE1_TIERS[name], name=name)
+
+def phase1_schema(tier):
+    """Compact response schema of a tier, so the model returns exactly its fields and nothing else"""
+    fields = PHASE1_TIERS[tier]["fields"]
+    return {"type": "OBJECT", "properties": fields, "required": list(fields), "property_ordering": list(fields)}
+
+def compact_concepts(parsed_concepts):
+    """
+    Token-minimal serialization of a parsed concept sheet: a list instead of an id-keyed map
+    (the id is inside each entry), no indentation, empty fields dropped, unicode kept as-is.
+    """
+    concepts = parsed_concepts.get("concepts", {})
+    entries = []
+    for key in sorted(concepts, key=lambda k: int(k) if str(k).isdigit() else str(k)):
+        concept = concepts[key]
+        entry = {"id": concept.get("id", key), "name": concept.get("name", "")}
+        for field in ("description", "example"):
+            if concept.get(field):
+                entry[field] = concept[field]
+        entries.append(entry)
+    return json.dumps(entries, separators=(",", ":"), ensure_ascii=False)
+
+def compact_json(data):
+    """Compact JSON for per-request payloads such as Phase 1 results"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+def prepare_prompts(parsed_concepts, registry=REGISTRY):
+    """
+    Build the static text of every Phase 1 and Phase 2 request once per parsed concept sheet.
+    Per-request code only appends images or Phase 1 results to these headers.
+    """
+    concepts_text = compact_concepts(parsed_concepts)
+    tier = phase1_tier()
+    prepared = {
+        "concepts": concepts_text,
+        "phase1_tier": tier["name"],
+        "phase1": f"Instructions: {registry.get(tier['template'])}\n\nParsed Concept Sheet:\n{concepts_text}\n\nHere are the images to analyze:",
+        "phase2": f"Instructions: {registry.get('phase2_prompt')}\n\nParsed Concept Sheet:\n{concepts_text}",
+        "screen": f"Instructions: {registry.get('screen_prompt')}\n\nParsed Concept Sheet:\n{concepts_text}\n\nHere are the images to analyze:",
+        "versions": {name: registry.version(name) for name in (tier["template"], "phase2_prompt")},
+    }
+    # Kept to rebuild the Phase 1 header for a concept shortlist (see phase1_header)
+    prepared["parsed_concepts"] = parsed_concepts
+    print(f"[Prompts] Prepared headers: phase1 ~{estimate_tokens(prepared['phase1'])} tokens, "
+          f"phase2 ~{estimate_tokens(prepared['phase2'])} tokens")
+    return prepared
+
+def phase1_header(prepared, concept_ids=None, tier=None, registry=REGISTRY):
+    """
+    Phase 1 header at the prepared tier unless another is given. With concept_ids it lists only
+    those shortlisted concepts, and the model is told the list is a shortlist so an unlisted
+    concept comes back as null; without, it lists the whole sheet.
+    """
+    template = registry.get(PHASE1_TIERS[tier or prepared["phase1_tier"]]["template"])
+    if concept_ids is None:
+        return f"Instructions: {template}\n\nParsed Concept Sheet:\n{prepared['concepts']}\n\nHere are the images to analyze:"
+    concepts = prepared["parsed_concepts"].get("concepts", {})
+    subset = {"concepts": {cid: concepts[cid] for cid in concept_ids if cid in concepts}}
+    return (f"Instructions: {template}\n\n"
+            f"Parsed Concept Sheet (shortlist of the concepts most likely tested; if none of them matches, "
+            f"return concept_id null):\n{compact_concepts(subset)}\n\nHere are the images to analyze:")
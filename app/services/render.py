@@ -1,72 +1,262 @@
+import csv
+import html
+import io
 import json
 import os
+from collections import defaultdict
+from app.config.settings import COORDS_TEMPLATE_PATH
+from app.services.runs import run_dir, load_manifest
+from app.services.concept_tables import is_concept_table
 
-def generate_analysis_table(concept_sheet_path, phase1_results, fill_data, out_path, parsed_concepts=None):
-    """Generate a table that matches the concept sheet structure with Status column filled"""
-    print(f"[DEBUG] Render: Generating concept sheet table...")
-    print(f"[DEBUG] Render: Phase 1 results: {len(phase1_results)} items")
-    print(f"[DEBUG] Render: Fill data: {fill_data}")
-    
-    # Create the concept sheet table structure
-    table_data = []
-    
-    # Add header matching the concept sheet format
-    table_data.append("| Concept No. | Concept (With Explanation) | Example | Status |")
-    table_data.append("|-------------|----------------------------|---------|--------|")
-    
-    # Get all concept IDs from parsed concepts (FOUNDATION)
-    if parsed_concepts and 'concepts' in parsed_concepts:
-        all_concept_ids = sorted([int(k) for k in parsed_concepts['concepts'].keys()], key=int)
-        print(f"[DEBUG] Render: Processing concepts from parsed sheet: {all_concept_ids}")
+# Output formats: file extension and media type
+FORMATS = {
+    "md": "text/markdown",
+    "html": "text/html",
+    "csv": "text/csv",
+    "json": "application/json",
+    "png": "image/png",
+}
+DEFAULT_FORMAT = "md"
+
+def build_report(phase1_results, fill_data, parsed_concepts=None, detailed_analysis="", run_id=None):
+    """
+    Collect everything a renderer needs in one pass: Phase 1 results are indexed by concept id
+    once, so every row is a dict lookup instead of a scan over all results.
+    """
+    by_concept = defaultdict(list)
+    for number, result in enumerate(phase1_results, start=1):
+        if result.get("concept_id") is not None:
+            by_concept[str(result["concept_id"])].append((number, result))
+
+    concepts = (parsed_concepts or {}).get("concepts", {})
+    if concepts:
+        # Get all concept IDs from parsed concepts (FOUNDATION)
+        concept_ids = sorted(concepts.keys(), key=lambda k: int(k) if str(k).isdigit() else str(k))
     else:
         # Fallback to fill_data if no parsed concepts
-        all_concept_ids = sorted([int(k) for k in fill_data.keys()], key=int)
-        print(f"[DEBUG] Render: Processing concepts from fill_data: {all_concept_ids}")
-    
-    # Add each concept with its details and status
-    for concept_id in all_concept_ids:
-        concept_id_str = str(concept_id)
-        status = fill_data.get(concept_id_str, 'No status available')
-        
-        # Get concept name from parsed concepts (PRIORITY)
-        if parsed_concepts and 'concepts' in parsed_concepts and concept_id_str in parsed_concepts['concepts']:
-            concept_display = parsed_concepts['concepts'][concept_id_str]['name']
+        concept_ids = sorted(fill_data.keys(), key=lambda k: int(k) if str(k).isdigit() else str(k))
+
+    rows = []
+    for concept_id in concept_ids:
+        concept_id = str(concept_id)
+        tested = by_concept.get(concept_id, [])
+        if concept_id in concepts:
+            concept = concepts[concept_id]
+            name = concept.get("name", f"Concept {concept_id}")
         else:
             # Fallback to Phase 1 results or generic name
-            concept_result = None
-            for result in phase1_results:
-                if str(result.get('concept_id', '')) == concept_id_str:
-                    concept_result = result
+            concept = {}
+            named = [r.get("concept_name") for _, r in tested if r.get("concept_name") not in (None, "", "No matching concept")]
+            name = named[0] if named else f"Concept {concept_id}"
+        rows.append({
+            "concept_id": concept_id,
+            "name": name,
+            "description": concept.get("description", ""),
+            "example": concept.get("example", ""),
+            "status": fill_data.get(concept_id, "No status available"),
+            "problems": [number for number, _ in tested],
+            "correct": sum(1 for _, r in tested if r.get("is_correct")),
+            "incorrect": sum(1 for _, r in tested if not r.get("is_correct")),
+        })
+
+    return {
+        "run_id": run_id,
+        "rows": rows,
+        "problems": phase1_results,
+        "detailed_analysis": detailed_analysis,
+    }
+
+def _table_cell(text, limit=None):
+    # Clean up text for table formatting
+    text = str(text).replace('\n', ' ').replace('|', '-')
+    if limit and len(text) > limit:
+        text = text[:limit - 3] + "..."
+    return text
+
+def render_markdown(report, status_limit=None):
+    """Concept sheet table with the Status column filled"""
+    lines = [
+        "# Concept Analysis Results",
+        "",
+        "This table shows the analysis of each concept from the concept sheet with the Status column filled based on student performance.",
+        "",
+        "| Concept No. | Concept (With Explanation) | Example | Status |",
+        "|-------------|----------------------------|---------|--------|",
+    ]
+    for row in report["rows"]:
+        lines.append(f"| {row['concept_id']} | {_table_cell(row['name'])} | See analysis | {_table_cell(row['status'], status_limit)} |")
+    lines += ["", "## Detailed Analysis", "", "See detailed_analysis.txt for comprehensive report."]
+    return "\n".join(lines).encode("utf-8")
+
+def render_html(report):
+    """Standalone HTML page with the filled table and the detailed analysis"""
+    rows = "\n".join(
+        "<tr><td>{}</td><td><strong>{}</strong><br><small>{}</small></td><td>{}</td><td>{}</td></tr>".format(
+            html.escape(row["concept_id"]), html.escape(row["name"]), html.escape(row["description"]),
+            html.escape(row["example"]), html.escape(row["status"]),
+        )
+        for row in report["rows"]
+    )
+    analysis = "".join(f"<p>{html.escape(p)}</p>" for p in report["detailed_analysis"].split("\n\n") if p.strip())
+    page = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Concept Analysis Results</title>
+<style>body{{font-family:sans-serif;margin:2rem}}table{{border-collapse:collapse}}td,th{{border:1px solid #ccc;padding:.4rem;vertical-align:top}}</style>
+</head><body>
+<h1>Concept Analysis Results</h1>
+<table><tr><th>Concept No.</th><th>Concept (With Explanation)</th><th>Example</th><th>Status</th></tr>
+{rows}
+</table>
+<h2>Detailed Analysis</h2>
+{analysis}
+</body></html>"""
+    return page.encode("utf-8")
+
+def render_csv(report):
+    """One row per concept, for spreadsheets"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["concept_id", "name", "status", "tested_in_problems", "correct", "incorrect"])
+    for row in report["rows"]:
+        writer.writerow([row["concept_id"], row["name"], row["status"],
+                         " ".join(str(n) for n in row["problems"]), row["correct"], row["incorrect"]])
+    return buffer.getvalue().encode("utf-8")
+
+def render_json(report):
+    """Full structured report: concept rows, per-problem results and the detailed analysis"""
+    return json.dumps(report, ensure_ascii=False).encode("utf-8")
+
+def _wrap(draw, text, font, width):
+    words, lines, line = str(text).split(), [], ""
+    for word in words:
+        candidate = f"{line} {word}".strip()
+        if draw.textlength(candidate, font=font) <= width or not line:
+            line = candidate
+        else:
+            lines.append(line)
+            line = word
+    if line:
+        lines.append(line)
+    return lines
+
+def render_overlay(report, concept_sheet_path):
+    """
+    The concept sheet image with statuses filled in. Uses the coordinates template when present
+    (concept id -> [x, y, w, h] of its Status cell), otherwise appends a status panel on the right.
+    A concept sheet given as a table has no image, so the panel stands alone.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default()
+    coords = {}
+    if is_concept_table(concept_sheet_path):
+        sheet = Image.new("RGB", (0, max(400, 40 * len(report["rows"]))), "white")
+    else:
+        sheet = Image.open(concept_sheet_path).convert("RGB")
+    if sheet.width and os.path.exists(COORDS_TEMPLATE_PATH):
+        with open(COORDS_TEMPLATE_PATH, "r", encoding="utf-8") as f:
+            coords = json.load(f)
+
+    if coords:
+        draw = ImageDraw.Draw(sheet)
+        for row in report["rows"]:
+            box = coords.get(row["concept_id"])
+            if not box:
+                continue
+            x, y, w, h = box
+            draw.rectangle([x, y, x + w, y + h], fill="white")
+            for i, line in enumerate(_wrap(draw, row["status"], font, w - 4)):
+                if (i + 1) * 12 > h:
                     break
-            
-            if concept_result and concept_result.get('concept_name') != 'No matching concept':
-                concept_name = concept_result.get('concept_name', f'Concept {concept_id}')
-                concept_display = concept_name
-            else:
-                # For concepts not tested, use generic name
-                concept_display = f'Concept {concept_id}'
-        
-        # Clean up text for table formatting
-        status_clean = status.replace('\n', ' ').replace('|', '-')
-        
-        # Truncate long text for better table display
-        if len(status_clean) > 80:
-            status_clean = status_clean[:77] + "..."
-        
-        # Add row to table - preserve original concept structure
-        table_data.append(f"| {concept_id} | {concept_display} | See analysis | {status_clean} |")
-    
-    # Join the table
-    table_content = "\n".join(table_data)
-    
+                draw.text((x + 2, y + 2 + i * 12), line, fill="black", font=font)
+        out = sheet
+    else:
+        panel_w = max(400, sheet.width // 2)
+        out = Image.new("RGB", (sheet.width + panel_w, sheet.height), "white")
+        out.paste(sheet, (0, 0))
+        draw = ImageDraw.Draw(out)
+        y = 10
+        for row in report["rows"]:
+            for line in _wrap(draw, f"{row['concept_id']}. {row['name']}: {row['status']}", font, panel_w - 20):
+                if y > out.height - 14:
+                    break
+                draw.text((sheet.width + 10, y), line, fill="black", font=font)
+                y += 12
+            y += 6
+    buffer = io.BytesIO()
+    out.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def render(report, fmt, concept_sheet_path=None):
+    """Render a report in one of FORMATS"""
+    if fmt == "md":
+        return render_markdown(report)
+    if fmt == "html":
+        return render_html(report)
+    if fmt == "csv":
+        return render_csv(report)
+    if fmt == "json":
+        return render_json(report)
+    if fmt == "png":
+        if not concept_sheet_path:
+            raise ValueError("The png overlay needs the concept sheet image")
+        return render_overlay(report, concept_sheet_path)
+    raise ValueError(f"Unknown report format: {fmt}")
+
+def report_path(out_dir, fmt):
+    """Cache location of a rendered format inside a run directory"""
+    return os.path.join(out_dir, "analysis_table.md" if fmt == "md" else f"report.{fmt}")
+
+def render_cached(out_dir, fmt, report_factory, concept_sheet_path=None):
+    """
+    Render a format on first request and reuse the file afterwards. Finished runs never change,
+    so the run directory plus the format is a complete cache key. report_factory builds the
+    report only on a cache miss.
+    """
+    path = report_path(out_dir, fmt)
+    if os.path.exists(path):
+        return path
+    data = render(report_factory(), fmt, concept_sheet_path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    print(f"[DEBUG] Render: {fmt} report saved to {path}")
+    return path
+
+def render_run(run_id, fmt=DEFAULT_FORMAT):
+    """
+    Path of a stored run's report in the given format, rendered from its manifest on first use.
+    Returns None if the run does not exist.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown report format: {fmt}")
+    manifest = load_manifest(run_id)
+    if manifest is None:
+        return None
+
+    def report_factory():
+        detailed_analysis = ""
+        analysis_path = manifest.get("outputs", {}).get("analysis_path")
+        if analysis_path and os.path.exists(analysis_path):
+            with open(analysis_path, "r", encoding="utf-8") as f:
+                detailed_analysis = f.read()
+        results = [problem["result"] for page in manifest["pages"] for problem in page["problems"]]
+        return build_report(results, manifest.get("fill_data", {}), manifest.get("parsed_concepts"),
+                            detailed_analysis, run_id)
+
+    return render_cached(run_dir(run_id), fmt, report_factory, manifest["inputs"]["concept_sheet"])
+
+def generate_analysis_table(concept_sheet_path, phase1_results, fill_data, out_path, parsed_concepts=None):
+    """Generate a table that matches the concept sheet structure with Status column filled"""
+    print(f"[DEBUG] Render: Generating concept sheet table...")
+    print(f"[DEBUG] Render: Phase 1 results: {len(phase1_results)} items")
+    report = build_report(phase1_results, fill_data, parsed_concepts)
+    print(f"[DEBUG] Render: Processing concepts: {[row['concept_id'] for row in report['rows']]}")
+
     # Save to file
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write("# Concept Analysis Results\n\n")
-        f.write("This table shows the analysis of each concept from the concept sheet with the Status column filled based on student performance.\n\n")
-        f.write(table_content)
-        f.write("\n\n## Detailed Analysis\n\n")
-        f.write("See detailed_analysis.txt for comprehensive report.")
-    
+    with open(out_path, "wb") as f:
+        f.write(render_markdown(report))
+
     print(f"[DEBUG] Render: Concept sheet table saved to {out_path}")
     return out_path
@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+import threading
+from typing import Optional
+from app.config.settings import RESULT_COMPRESS_MIN_BYTES
+from app.services.runs import run_dir, load_manifest, file_digest
+
+# Media types worth compressing; PNG reports are compressed already
+COMPRESSIBLE_TYPES = ("text/", "application/json")
+# File suffix of the compressed copy for each content coding
+CODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+def content_digest(path):
+    """SHA-256 of a result file, recomputed only when the file's size or mtime changes"""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    digest = file_digest(path)
+    with _digests_lock:
+        _digests[path] = (version, digest)
+    return digest
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def supported_codings():
+    """Content codings this server can produce, most preferred first"""
+    return (["br"] if _brotli() is not None else []) + ["gzip"]
+
+def negotiate_coding(accept_encoding: str, media_type: str, size: int) -> Optional[str]:
+    """Coding to send a result in given the client's Accept-Encoding, or None for identity"""
+    if size < RESULT_COMPRESS_MIN_BYTES or not media_type.startswith(COMPRESSIBLE_TYPES):
+        return None
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    ranked = [(weights.get(coding, weights.get("*", 0.0)), -rank, coding)
+              for rank, coding in enumerate(supported_codings())]
+    weight, _, coding = max(ranked)
+    return coding if weight > 0 else None
+
+def encoded_copy(path, coding, digest):
+    """
+    Path of the file compressed with `coding`, written on first use. The copy is named after the
+    content digest, so a file that changes never serves a stale copy.
+    """
+    encoded = f"{path}.{digest[:16]}{CODING_SUFFIXES[coding]}"
+    if os.path.exists(encoded):
+        return encoded
+    with open(path, "rb") as f:
+        data = f.read()
+    if coding == "br":
+        data = _brotli().compress(data, quality=11)
+    else:
+        data = gzip.compress(data, compresslevel=9, mtime=0)
+    tmp = f"{encoded}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, encoded)
+    return encoded
+
+def entity_tag(digest, coding=None):
+    """Strong ETag of one representation: each coding of the same content gets its own tag"""
+    return f'"{digest}-{coding}"' if coding else f'"{digest}"'
+
+def matches(if_none_match: Optional[str], tag: str) -> bool:
+    """Whether an If-None-Match header covers the tag (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or tag in tags or f"W/{tag}" in tags
+
+def read_text(path):
+    if not path or not os.path.exists(path):
+        return ""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def render_bundle(run_id):
+    """
+    Path of a run's bundle (analysis table, detailed analysis and every problem's result in one
+    JSON document), written on first request. Finished runs never change, so it is never rebuilt.
+    Returns None if the run does not exist.
+    """
+    manifest = load_manifest(run_id)
+    if manifest is None:
+        return None
+    path = os.path.join(run_dir(run_id), "bundle.json")
+    if os.path.exists(path):
+        return path
+    outputs = manifest.get("outputs", {})
+    bundle = {
+        "run_id": run_id,
+        "parent_run_id": manifest.get("parent_run_id"),
+        "created": manifest.get("created"),
+        "partial": manifest.get("partial", False),
+        "pending_problems": manifest.get("pending_problems", 0),
+        "fill_data": manifest.get("fill_data", {}),
+        "analysis_table": read_text(outputs.get("analysis_table")),
+        "detailed_analysis": read_text(outputs.get("analysis_path")),
+        "problems": [
+            {"problem": problem["problem"], "page": page["index"], "confidence": problem["confidence"],
+             "result": problem["result"]}
+            for page in manifest["pages"] for problem in page["problems"]
+        ],
+    }
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(bundle, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+    return path
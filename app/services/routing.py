@@ -0,0 +1,95 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+# Candidates scoring below this fraction of the best match are dropped from the shortlist,
+# so a clearly dominant concept is sent alone
+RELATIVE_CUTOFF = 0.35
+# Parsed concept sheets whose indexes are kept in memory
+INDEX_CACHE_SIZE = 16
+
+_WORD = re.compile(r"[a-z]{2,}")
+# Notation that names a topic on its own: integrals, roots, sums, limits, trig and log functions
+_SYMBOLS = re.compile(r"[∫√∑∏π∞θ≤≥≠^!]|\b(?:sin|cos|tan|cot|sec|csc|log|ln|lim|dx|dy|dt|d/dx)\b")
+_STOPWORDS = {
+    "the", "of", "and", "to", "in", "is", "for", "on", "with", "by", "as", "an", "at", "be", "or", "it",
+    "its", "this", "that", "from", "are", "find", "solve", "value", "following", "given", "using", "use",
+    "show", "calculate", "evaluate", "determine", "question", "problem", "answer", "example",
+}
+
+_SUFFIXES = ("ations", "ation", "ives", "ive", "als", "al", "ing", "es", "s")
+
+def stem(word):
+    """Crude suffix stripping so "integration", "integral" and "integrals" meet"""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4 and not word.endswith("ss"):
+            return word[:-len(suffix)]
+    return word
+
+def terms(text):
+    """Index terms of a text: lowercase words without stopwords plus math notation"""
+    text = str(text or "").lower()
+    words = [w for w in _WORD.findall(text) if w not in _STOPWORDS]
+    return [stem(w) for w in words] + _SYMBOLS.findall(text)
+
+class ConceptIndex:
+    """
+    TF-IDF vectors of the concepts of one parsed concept sheet with an inverted index,
+    so a problem transcription is scored only against concepts that share a term with it.
+    """
+
+    def __init__(self, parsed_concepts):
+        concepts = parsed_concepts.get("concepts", {})
+        documents = {
+            str(cid): terms(" ".join(str(concept.get(field, "")) for field in ("name", "name", "description", "example")))
+            for cid, concept in concepts.items()
+        }
+        frequency = Counter(term for doc in documents.values() for term in set(doc))
+        n = max(1, len(documents))
+        self.idf = {term: math.log((1 + n) / (1 + df)) + 1.0 for term, df in frequency.items()}
+        self.postings = {}
+        for cid, doc in documents.items():
+            weights = {term: count * self.idf[term] for term, count in Counter(doc).items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, weight in weights.items():
+                self.postings.setdefault(term, []).append((cid, weight / norm))
+        self.size = len(documents)
+
+    def scores(self, text):
+        """Cosine similarity of a text to every concept sharing a term with it"""
+        weights = {term: count * self.idf[term] for term, count in Counter(terms(text)).items() if term in self.idf}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        scores = Counter()
+        for term, weight in weights.items():
+            for cid, concept_weight in self.postings[term]:
+                scores[cid] += weight / norm * concept_weight
+        return scores
+
+    def shortlist(self, text, k):
+        """
+        Up to k concept ids most similar to the text, best first, stopping early at candidates
+        far below the best one. Empty when nothing matches, meaning the text can't be routed.
+        """
+        ranked = self.scores(text).most_common(k)
+        if not ranked or ranked[0][1] <= 0:
+            return []
+        best = ranked[0][1]
+        return [cid for cid, score in ranked if score >= RELATIVE_CUTOFF * best]
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def concept_index(parsed_concepts, key):
+    """The ConceptIndex of a concept sheet, built once per key (the compact concept text)"""
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = ConceptIndex(parsed_concepts)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
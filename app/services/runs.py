@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from app.config.settings import RUNS_DIR, RUN_RETENTION_DAYS, RUNS_MAX_MB, RUN_SWEEP_INTERVAL_SECONDS
+
+_RUN_ID = re.compile(r"^[0-9a-f]{32}$")
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+def file_digest(path):
+    """SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def run_dir(run_id):
+    """Directory of a run; rejects anything that is not a run id so it can't escape RUNS_DIR"""
+    if not _RUN_ID.match(run_id or ""):
+        raise ValueError(f"Invalid run id: {run_id}")
+    return os.path.join(RUNS_DIR, run_id)
+
+def create_run():
+    """Allocate a new run id and its directory, sweeping expired runs first"""
+    sweep_runs()
+    run_id = uuid.uuid4().hex
+    os.makedirs(run_dir(run_id), exist_ok=True)
+    return run_id
+
+def store_input(run_id, path, name):
+    """Copy an input file into the run so later revisions can re-read it after uploads are gone"""
+    inputs_dir = os.path.join(run_dir(run_id), "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+    stored = os.path.join(inputs_dir, name + os.path.splitext(path)[1].lower())
+    shutil.copyfile(path, stored)
+    return stored
+
+def store_inputs(run_id, concept_sheet, questions, solutions, submissions):
+    """Copy all inputs of a run; returns the stored paths by role"""
+    return {
+        "concept_sheet": store_input(run_id, concept_sheet, "concept_sheet"),
+        "questions": [store_input(run_id, p, f"question_{i+1}") for i, p in enumerate(questions)],
+        "solutions": [store_input(run_id, p, f"solution_{i+1}") for i, p in enumerate(solutions)],
+        "submissions": [store_input(run_id, p, f"submission_{i+1}") for i, p in enumerate(submissions or [])],
+    }
+
+def save_manifest(run_id, manifest):
+    """Write the run manifest atomically so readers never see a partial file"""
+    path = os.path.join(run_dir(run_id), "manifest.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(manifest, updated=time.time()), f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+def load_manifest(run_id):
+    """Manifest of a finished run, or None if the run does not exist"""
+    try:
+        path = os.path.join(run_dir(run_id), "manifest.json")
+    except ValueError:
+        return None
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def _run_age_reference(path):
+    """When a run was last written: its manifest's update time, else its directory's mtime"""
+    manifest = os.path.join(path, "manifest.json")
+    return os.path.getmtime(manifest if os.path.exists(manifest) else path)
+
+def sweep_runs(runs_dir=RUNS_DIR, retention_days=RUN_RETENTION_DAYS, max_mb=RUNS_MAX_MB,
+               interval=RUN_SWEEP_INTERVAL_SECONDS, now=None):
+    """
+    Delete runs older than the retention period, then the oldest ones while the store is over its size
+    cap. Runs whose inputs a kept revision still reads are kept with it. At most one sweep per `interval`
+    seconds; returns the deleted run ids.
+    """
+    global _last_sweep
+    now = time.time() if now is None else now
+    if (not retention_days and not max_mb) or not os.path.isdir(runs_dir):
+        return []
+    with _sweep_lock:
+        if interval and now - _last_sweep < interval:
+            return []
+        _last_sweep = now
+        runs = {}
+        for run_id in os.listdir(runs_dir):
+            path = os.path.join(runs_dir, run_id)
+            if _RUN_ID.match(run_id) and os.path.isdir(path):
+                runs[run_id] = {"path": path, "written": _run_age_reference(path)}
+        cutoff = now - retention_days * 86400 if retention_days else float("-inf")
+        expired = {run_id for run_id, run in runs.items() if run["written"] < cutoff}
+        if max_mb:
+            total = sum(_dir_bytes(run["path"]) for run_id, run in runs.items() if run_id not in expired)
+            for run_id in sorted((r for r in runs if r not in expired), key=lambda r: runs[r]["written"]):
+                if total <= max_mb * 1024 * 1024:
+                    break
+                total -= _dir_bytes(runs[run_id]["path"])
+                expired.add(run_id)
+        # Unchanged inputs of a revision stay in the run they were uploaded to
+        for run_id in set(runs) - expired:
+            try:
+                with open(os.path.join(runs[run_id]["path"], "manifest.json"), "r", encoding="utf-8") as f:
+                    inputs = json.load(f).get("inputs", {})
+            except (OSError, ValueError):
+                continue
+            for paths in inputs.values():
+                for path in paths if isinstance(paths, list) else [paths]:
+                    parts = os.path.relpath(path, runs_dir).split(os.sep)
+                    expired.discard(parts[0])
+        for run_id in expired:
+            shutil.rmtree(runs[run_id]["path"], ignore_errors=True)
+    if expired:
+        print(f"[Runs] Deleted {len(expired)} expired runs")
+    return sorted(expired)
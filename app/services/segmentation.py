@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+from collections import defaultdict
+
+# Reference page width the original fixed parameters were tuned for (A4 at ~200 DPI)
+REFERENCE_WIDTH = 1700
+# Fraction of the page area below which a merged region is treated as noise
+MIN_REGION_FRACTION = 0.0004
+# Regions wider than this fraction of the page are full-width bands (headers, long problems)
+FULL_WIDTH_FRACTION = 0.6
+
+def _odd(n):
+    n = max(3, int(round(n)))
+    return n if n % 2 == 1 else n + 1
+
+def adaptive_params(shape):
+    """Derive kernel size and area thresholds from the page resolution"""
+    h, w = shape[:2]
+    scale = w / float(REFERENCE_WIDTH)
+    return {
+        # A light dilation only joins the strokes of one glyph/word; merging is done on the index
+        "kernel": (_odd(5 * scale), _odd(3 * scale)),
+        "noise_area": max(4, int(12 * scale * scale)),
+        "min_area": max(100, int(h * w * MIN_REGION_FRACTION)),
+    }
+
+def component_stats(gray, kernel):
+    """Binarize once and return connected component boxes (x, y, w, h, area) without background"""
+    _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    element = cv2.getStructuringElement(cv2.MORPH_RECT, kernel)
+    dil = cv2.dilate(th, element, iterations=1)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(dil, connectivity=8)
+    return stats[1:count]
+
+class GridIndex:
+    """Uniform grid over box extents for finding nearby boxes without an O(n^2) scan"""
+
+    def __init__(self, cell):
+        self.cell = max(1, int(cell))
+        self.cells = defaultdict(list)
+
+    def _keys(self, box):
+        x0, y0, x1, y1 = box
+        for cx in range(int(x0) // self.cell, int(x1) // self.cell + 1):
+            for cy in range(int(y0) // self.cell, int(y1) // self.cell + 1):
+                yield cx, cy
+
+    def insert(self, key, box):
+        for k in self._keys(box):
+            self.cells[k].append(key)
+
+    def query(self, box):
+        found = set()
+        for k in self._keys(box):
+            found.update(self.cells.get(k, ()))
+        return found
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def merge_regions(boxes, gap_x, gap_y):
+    """
+    Union boxes (x0, y0, x1, y1) whose gap is within gap_x/gap_y and repeat on the merged
+    boxes until nothing changes, so overlapping regions never come out as separate problems.
+    """
+    boxes = [tuple(b) for b in boxes]
+    while True:
+        index = GridIndex(max(gap_x, gap_y) * 4)
+        grown = [(x0 - gap_x, y0 - gap_y, x1 + gap_x, y1 + gap_y) for x0, y0, x1, y1 in boxes]
+        for i, g in enumerate(grown):
+            index.insert(i, g)
+
+        parent = list(range(len(boxes)))
+        for i, g in enumerate(grown):
+            for j in index.query(g):
+                if j > i and _intersects(g, boxes[j]):
+                    ri, rj = _find(parent, i), _find(parent, j)
+                    if ri != rj:
+                        parent[rj] = ri
+
+        groups = defaultdict(list)
+        for i in range(len(boxes)):
+            groups[_find(parent, i)].append(boxes[i])
+        merged = [
+            (min(b[0] for b in g), min(b[1] for b in g), max(b[2] for b in g), max(b[3] for b in g))
+            for g in groups.values()
+        ]
+        if len(merged) == len(boxes):
+            return merged
+        boxes = merged
+
+def reading_order(boxes, page_width):
+    """
+    Order (x, y, w, h) boxes column by column: full-width regions split the page into bands,
+    columns inside a band come from the union of region x-extents, top to bottom within each.
+    """
+    if not boxes:
+        return []
+    full = [b for b in boxes if b[2] >= page_width * FULL_WIDTH_FRACTION]
+    rest = [b for b in boxes if b[2] < page_width * FULL_WIDTH_FRACTION]
+
+    # Band edges at the vertical centre of each full-width region
+    cuts = sorted(b[1] + b[3] / 2.0 for b in full)
+    bands = defaultdict(list)
+    for b in full + rest:
+        centre = b[1] + b[3] / 2.0
+        bands[sum(1 for c in cuts if c < centre)].append(b)
+
+    ordered = []
+    for band in sorted(bands):
+        members = bands[band]
+        # Merge overlapping x-intervals into columns
+        columns = []
+        for b in sorted(members, key=lambda b: b[0]):
+            if columns and b[0] <= columns[-1][1]:
+                columns[-1][1] = max(columns[-1][1], b[0] + b[2])
+            else:
+                columns.append([b[0], b[0] + b[2]])
+        def column_of(b):
+            for ci, (c0, c1) in enumerate(columns):
+                if c0 <= b[0] <= c1:
+                    return ci
+            return len(columns)
+        ordered.extend(sorted(members, key=lambda b: (column_of(b), b[1], b[0])))
+    return ordered
+
+def segment_regions(gray, min_area=None):
+    """
+    Segment a grayscale page into problem regions (x, y, w, h) in reading order.
+    Component statistics are computed once; nearby components are merged through a grid index
+    using gaps derived from the median text height, so one problem yields one region.
+    """
+    params = adaptive_params(gray.shape)
+    min_area = params["min_area"] if min_area is None else min_area
+
+    stats = component_stats(gray, params["kernel"])
+    stats = stats[stats[:, cv2.CC_STAT_AREA] >= params["noise_area"]]
+    if len(stats) == 0:
+        return []
+
+    # Median component height approximates the handwriting line height
+    line_h = float(np.median(stats[:, cv2.CC_STAT_HEIGHT]))
+    gap_x = max(2, int(line_h * 2.0))
+    gap_y = max(2, int(line_h * 1.5))
+
+    boxes = [(x, y, x + w, y + h) for x, y, w, h in stats[:, :4].tolist()]
+    merged = merge_regions(boxes, gap_x, gap_y)
+    regions = [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in merged if (x1 - x0) * (y1 - y0) > min_area]
+    print(f"[DEBUG] Segmentation: {len(stats)} components -> {len(merged)} merged -> {len(regions)} regions "
+          f"(line_h={line_h:.1f}, gap=({gap_x}, {gap_y}), min_area={min_area})")
+    return reading_order(regions, gray.shape[1])
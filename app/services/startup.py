@@ -0,0 +1,44 @@
+import threading
+import time
+
+class Readiness:
+    """
+    Tracks the background warm-up that imports the grading stack (OpenCV, NumPy, google.genai)
+    and builds the Gemini client, so the process can answer liveness checks before it is ready.
+    """
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def warm_up(self):
+        self.started = time.time()
+        try:
+            import app.services.orchestrator  # noqa: F401 - pulls in cv2, numpy and the services
+            from app.services.gemini_client import get_client
+            get_client()
+            from app.services.answer_check import warm_up
+            warm_up()
+            print(f"[Startup] Warm-up finished in {time.time() - self.started:.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            print(f"[Startup] Warm-up failed: {self.error}")
+        finally:
+            self.finished = time.time()
+            # Even a failed warm-up leaves the process usable; imports are retried on first use
+            self.ready.set()
+
+    def start(self):
+        """Run the warm-up on a daemon thread and return immediately"""
+        threading.Thread(target=self.warm_up, name="warm-up", daemon=True).start()
+
+    def status(self):
+        return {
+            "ready": self.ready.is_set(),
+            "warmup_seconds": round(self.finished - self.started, 3) if self.finished else None,
+            "error": self.error,
+        }
+
+READINESS = Readiness()
@@ -0,0 +1,101 @@
+import base64
+import contextvars
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+
+_current = contextvars.ContextVar("usage", default=None)
+
+class Usage:
+    """Model calls of one run: per (stage, model) call count, tokens, bytes sent and model seconds"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0, "bytes_sent": 0,
+                                          "seconds": 0.0, "replay_misses": 0})
+
+    def add(self, stage, model, input_tokens=0, output_tokens=0, bytes_sent=0, seconds=0.0, replay_miss=False):
+        with self.lock:
+            entry = self.calls[(stage, model)]
+            entry["calls"] += 1
+            entry["input_tokens"] += int(input_tokens or 0)
+            entry["output_tokens"] += int(output_tokens or 0)
+            entry["bytes_sent"] += int(bytes_sent or 0)
+            entry["seconds"] += seconds
+            entry["replay_misses"] += int(replay_miss)
+
+    def as_list(self):
+        """JSON-friendly entries, as stored in the run manifest"""
+        with self.lock:
+            return [dict(entry, stage=stage, model=model, seconds=round(entry["seconds"], 3))
+                    for (stage, model), entry in sorted(self.calls.items())]
+
+def track_usage():
+    """Start accounting model calls in the current context (and tasks it schedules on a TaskGraph)"""
+    usage = Usage()
+    _current.set(usage)
+    return usage
+
+def record_usage(stage, model, **counts):
+    """Add a model call to the usage of the current run, if one is being tracked"""
+    usage = _current.get()
+    if usage is not None:
+        usage.add(stage, model, **counts)
+
+def part_bytes(contents):
+    """Request bytes of content parts: text, base64 inline data and file references"""
+    total = 0
+    for part in contents:
+        if "text" in part:
+            total += len(part["text"].encode("utf-8"))
+        elif "inline_data" in part:
+            total += len(part["inline_data"]["data"])
+        elif "file_data" in part:
+            total += len(part["file_data"]["file_uri"])
+    return total
+
+def request_key(model, contents, config, resolve_uri=lambda uri: uri):
+    """
+    Stable key of a model request. Images are keyed by the hash of their bytes, so the same crop
+    matches whether it was sent inline or by file handle, and run directories don't matter.
+    """
+    normalized = []
+    for part in contents:
+        if "inline_data" in part:
+            normalized.append({"image": hashlib.sha256(base64.b64decode(part["inline_data"]["data"])).hexdigest()})
+        elif "file_data" in part:
+            normalized.append({"image": resolve_uri(part["file_data"]["file_uri"])})
+        else:
+            normalized.append(part)
+    payload = json.dumps([model, normalized, config], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseRecorder:
+    """
+    Model responses on disk keyed by request, so evaluations can be replayed offline.
+    mode is "record" (call the model and store every response) or "replay" (answer from disk only).
+    """
+
+    def __init__(self, directory, mode):
+        self.directory = directory
+        self.mode = mode
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, response):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(response, f, ensure_ascii=False)
+        os.replace(tmp, path)
@@ -0,0 +1,306 @@
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import json
+import queue
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlparse
+from app.config.settings import (WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_MAX_PENDING, WEBHOOK_MAX_ATTEMPTS,
+                                 WEBHOOK_RETRY_SECONDS, WEBHOOK_RETRY_MAX_SECONDS, WEBHOOK_TIMEOUT_SECONDS,
+                                 WEBHOOK_PROGRESS_INTERVAL_SECONDS, WEBHOOK_ALLOWED_HOSTS, WEBHOOK_LOCAL_QUEUES,
+                                 WEBHOOK_MAX_LOCAL_QUEUES)
+
+SIGNATURE_HEADER = "X-Grader-Signature"
+# Statuses worth another attempt; any other 4xx means the receiver refuses the notification for good
+RETRY_STATUSES = {408, 409, 425, 429}
+# Signatures older than this are rejected by verify(), so a captured notification can't be replayed later
+SIGNATURE_TOLERANCE_SECONDS = 300
+# Connection pools kept for receivers (one per host and address); beyond that they are rebuilt
+MAX_POOLS = 64
+
+def public_address(address: str) -> bool:
+    """Whether an IP address is on the public internet (not loopback, private, link-local, multicast or reserved)"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def resolve_target(hostname: str, port: int, allowed_hosts=WEBHOOK_ALLOWED_HOSTS) -> str:
+    """
+    Address to connect to for a callback host. A listed host may resolve anywhere; any other host
+    (allowed when the list is empty) must resolve to public addresses only, so a callback can't reach
+    the server's own network. Raises ValueError if the host is refused, OSError if it doesn't resolve.
+    """
+    host = hostname.lower()
+    if allowed_hosts and host not in allowed_hosts:
+        raise ValueError(f"Callback host {hostname} is not allowed")
+    addresses = [info[4][0] for info in socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)]
+    if host not in allowed_hosts:
+        refused = [address for address in addresses if not public_address(address)]
+        if refused:
+            raise ValueError(f"Callback host {hostname} resolves to a non-public address ({refused[0]})")
+    return addresses[0]
+
+def default_port(parsed) -> int:
+    return parsed.port or (443 if parsed.scheme == "https" else 80)
+
+def check_target(target: str, secret=WEBHOOK_SECRET, allowed_hosts=WEBHOOK_ALLOWED_HOSTS,
+                 local_queues=WEBHOOK_LOCAL_QUEUES) -> str:
+    """
+    Validate a callback target: an http(s) URL (needs WEBHOOK_SECRET and a host resolve_target accepts)
+    or, with WEBHOOK_LOCAL_QUEUES on, queue://<name>, an in-process queue that stands in for a receiver.
+    Raises ValueError.
+    """
+    parsed = urlparse(target)
+    if parsed.scheme == "queue":
+        if not local_queues:
+            raise ValueError("queue:// callbacks are disabled (WEBHOOK_LOCAL_QUEUES)")
+        if not parsed.netloc:
+            raise ValueError("queue:// callback needs a queue name")
+        return target
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("Callback must be an http(s) URL" + (" or queue://<name>" if local_queues else ""))
+    if not secret:
+        raise ValueError("HTTP callbacks are disabled: WEBHOOK_SECRET is not set")
+    try:
+        resolve_target(parsed.hostname, default_port(parsed), allowed_hosts)
+    except OSError:
+        raise ValueError(f"Callback host {parsed.hostname} does not resolve")
+    return target
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    """Signature header value: HMAC-SHA256 of "<timestamp>.<body>" """
+    digest = hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def verify(secret: str, header: Optional[str], body: bytes, tolerance=SIGNATURE_TOLERANCE_SECONDS) -> bool:
+    """Receiver side: whether a signature header is valid for the body and recent enough"""
+    fields = dict(part.split("=", 1) for part in (header or "").split(",") if "=" in part)
+    try:
+        timestamp = int(fields.get("t", ""))
+    except ValueError:
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), f"t={timestamp},v1={fields.get('v1', '')}")
+
+class WebhookDispatcher:
+    """
+    Delivers notifications in the background so gradings never wait on a receiver. Deliveries run on
+    `workers` threads; a failed one (connection error, timeout, 5xx, 429) is retried after a doubling,
+    jittered backoff (or the receiver's Retry-After) until max_attempts. A notification keeps its id
+    across retries (X-Grader-Delivery), so receivers can drop duplicates. Each attempt resolves the
+    receiver's host again and connects to the address it checked, so a host that was public when the
+    job was submitted can't be re-pointed at an internal address (DNS rebinding).
+    """
+
+    def __init__(self, workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 retry_seconds=WEBHOOK_RETRY_SECONDS, retry_max_seconds=WEBHOOK_RETRY_MAX_SECONDS,
+                 timeout=WEBHOOK_TIMEOUT_SECONDS, secret=WEBHOOK_SECRET, allowed_hosts=WEBHOOK_ALLOWED_HOSTS,
+                 max_local_queues=WEBHOOK_MAX_LOCAL_QUEUES):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webhook")
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.timeout = timeout
+        self.secret = secret
+        self.allowed_hosts = allowed_hosts
+        self.max_local_queues = max_local_queues
+        self.cond = threading.Condition()
+        self.schedule = []
+        self.order = itertools.count()
+        self.pending = 0
+        self.scheduler = None
+        self.queues = {}
+        self.counters = Counter()
+        self.failures = deque(maxlen=50)
+        self.pools = {}
+
+    def local_queue(self, name: str) -> queue.Queue:
+        """
+        The in-process queue behind queue://<name>; each item is {"headers": ..., "payload": ...}.
+        Raises ValueError when max_local_queues already exist.
+        """
+        with self.cond:
+            if name not in self.queues:
+                if len(self.queues) >= self.max_local_queues:
+                    raise ValueError(f"Too many local queues (limit {self.max_local_queues})")
+                self.queues[name] = queue.Queue(maxsize=self.max_pending)
+            return self.queues[name]
+
+    def send(self, target: str, event_type: str, data: dict) -> Optional[str]:
+        """Queue a notification for delivery; returns its id, or None if too many are pending"""
+        notification = {"id": uuid.uuid4().hex, "type": event_type, "created": time.time(), "data": data}
+        delivery = {
+            "id": notification["id"],
+            "type": event_type,
+            "target": target,
+            "body": json.dumps(notification, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"),
+            "attempt": 0,
+        }
+        with self.cond:
+            if self.pending >= self.max_pending:
+                self.counters["dropped"] += 1
+                print(f"[Webhooks] Dropped {event_type} for {target}: {self.pending} notifications pending")
+                return None
+            self.pending += 1
+            self.counters["queued"] += 1
+            self._schedule(delivery, time.time())
+            if self.scheduler is None:
+                self.scheduler = threading.Thread(target=self._loop, name="webhook-scheduler", daemon=True)
+                self.scheduler.start()
+        return notification["id"]
+
+    def _schedule(self, delivery, due):
+        heapq.heappush(self.schedule, (due, next(self.order), delivery))
+        self.cond.notify()
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.schedule or self.schedule[0][0] > time.time():
+                    self.cond.wait(self.schedule[0][0] - time.time() if self.schedule else None)
+                _, _, delivery = heapq.heappop(self.schedule)
+            self.executor.submit(self._attempt, delivery)
+
+    def _headers(self, delivery):
+        headers = {
+            "Content-Type": "application/json",
+            "X-Grader-Event": delivery["type"],
+            "X-Grader-Delivery": delivery["id"],
+            "X-Grader-Attempt": str(delivery["attempt"]),
+        }
+        if self.secret:
+            headers[SIGNATURE_HEADER] = sign(self.secret, int(time.time()), delivery["body"])
+        return headers
+
+    def _pool(self, parsed, address):
+        """Connection pool to the checked address of a receiver; TLS and the Host header still use its hostname"""
+        port = default_port(parsed)
+        key = (parsed.scheme, parsed.hostname.lower(), address, port)
+        with self.cond:
+            pool = self.pools.get(key)
+            if pool is None:
+                import urllib3
+                if len(self.pools) >= MAX_POOLS:
+                    self.pools.clear()
+                options = {"timeout": urllib3.Timeout(self.timeout), "retries": False}
+                if parsed.scheme == "https":
+                    import certifi
+                    pool = urllib3.HTTPSConnectionPool(address, port, server_hostname=parsed.hostname,
+                                                       assert_hostname=parsed.hostname, cert_reqs="CERT_REQUIRED",
+                                                       ca_certs=certifi.where(), **options)
+                else:
+                    pool = urllib3.HTTPConnectionPool(address, port, **options)
+                self.pools[key] = pool
+            return pool
+
+    def _post(self, delivery):
+        """One attempt; returns (delivered, retry, retry_after, detail)"""
+        headers = self._headers(delivery)
+        parsed = urlparse(delivery["target"])
+        if parsed.scheme == "queue":
+            try:
+                self.local_queue(parsed.netloc).put_nowait({"headers": headers, "payload": json.loads(delivery["body"])})
+                return True, False, None, "queued"
+            except queue.Full:
+                return False, True, None, "local queue full"
+            except ValueError as e:
+                return False, False, None, str(e)
+        try:
+            address = resolve_target(parsed.hostname, default_port(parsed), self.allowed_hosts)
+        except ValueError as e:
+            return False, False, None, str(e)
+        except OSError as e:
+            return False, True, None, f"{parsed.hostname} does not resolve: {str(e)}"
+        path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+        headers["Host"] = parsed.netloc.rsplit("@", 1)[-1]
+        try:
+            response = self._pool(parsed, address).urlopen("POST", path, body=delivery["body"], headers=headers,
+                                                           redirect=False, retries=False, assert_same_host=False)
+        except Exception as e:
+            return False, True, None, str(e)
+        if 200 <= response.status < 300:
+            return True, False, None, str(response.status)
+        retry_after = None
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            pass
+        retry = response.status >= 500 or response.status in RETRY_STATUSES
+        return False, retry, retry_after, f"HTTP {response.status}"
+
+    def _attempt(self, delivery):
+        delivery["attempt"] += 1
+        try:
+            delivered, retry, retry_after, detail = self._post(delivery)
+        except Exception as e:
+            delivered, retry, retry_after, detail = False, True, None, str(e)
+        with self.cond:
+            if delivered:
+                self.pending -= 1
+                self.counters["delivered"] += 1
+                return
+            if retry and delivery["attempt"] < self.max_attempts:
+                backoff = min(self.retry_max_seconds, self.retry_seconds * 2 ** (delivery["attempt"] - 1))
+                delay = retry_after if retry_after is not None else backoff * random.uniform(0.5, 1.0)
+                self.counters["retried"] += 1
+                self._schedule(delivery, time.time() + min(delay, self.retry_max_seconds))
+                print(f"[Webhooks] {delivery['type']} to {delivery['target']} failed ({detail}), "
+                      f"attempt {delivery['attempt']}/{self.max_attempts}, retrying in {delay:.1f}s")
+                return
+            self.pending -= 1
+            self.counters["failed"] += 1
+            self.failures.append({"id": delivery["id"], "type": delivery["type"], "target": delivery["target"],
+                                  "attempts": delivery["attempt"], "error": detail, "at": time.time()})
+        print(f"[Webhooks] Gave up on {delivery['type']} to {delivery['target']} after {delivery['attempt']} attempts: {detail}")
+
+    def metrics(self):
+        with self.cond:
+            return {"pending": self.pending, "scheduled": len(self.schedule), **self.counters,
+                    "recent_failures": list(self.failures)}
+
+class ProgressNotifier:
+    """
+    on_event listener of a job that sends job.progress notifications: the stage and graded count plus the
+    problems graded since the last one, at most one per `interval` seconds (the rest ride with the next).
+    """
+
+    def __init__(self, dispatcher, target, fields, interval=WEBHOOK_PROGRESS_INTERVAL_SECONDS):
+        self.dispatcher = dispatcher
+        self.target = target
+        self.fields = fields
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_sent = 0.0
+        self.stage = None
+        self.graded = 0
+        self.problems = []
+
+    def __call__(self, job_id, event):
+        with self.lock:
+            if event.get("type") == "stage":
+                self.stage = event.get("stage")
+            elif event.get("type") == "problem":
+                self.graded += 1
+                self.problems.append(event)
+            else:
+                return
+            now = time.time()
+            if now - self.last_sent < self.interval:
+                return
+            data = dict(self.fields, job_id=job_id, stage=self.stage, graded=self.graded, problems=self.problems)
+            self.last_sent, self.problems = now, []
+        self.dispatcher.send(self.target, "job.progress", data)
+
+WEBHOOKS = WebhookDispatcher()
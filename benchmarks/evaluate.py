@@ -0,0 +1,234 @@
+"""
+Accuracy-versus-cost evaluation of pipeline configurations.
+
+Grades a labeled gold set under each configuration of a matrix and reports grading accuracy
+next to latency, tokens, bytes sent and estimated cost per student, so the fastest configuration
+that doesn't regress quality can be picked.
+
+    python benchmarks/evaluate.py --gold gold.jsonl --configs configs.json --mode record --responses eval_responses/
+    python benchmarks/evaluate.py --gold gold.jsonl --configs configs.json --mode replay --responses eval_responses/
+
+The gold set has one JSON object per line (paths relative to the file):
+    {"student_id": "s1", "concept_sheet": "sheet.png", "questions": [...], "solutions": [...], "submissions": [...],
+     "expected": {"problems": [{"concept_id": 1, "is_correct": true}, ...],
+                  "statuses": {"1": "mastered", "2": "not_mastered", "3": "not_tested"}}}
+Statuses are mastered (all problems of the concept correct), partial, not_mastered or not_tested.
+
+configs.json maps a configuration name to the environment settings it changes; the first one is
+the baseline the others are compared with:
+    {"baseline": {}, "lite-phase1": {"PHASE1_MODEL": "gemini-2.5-flash-lite"}, "cascade": {"CASCADE_ENABLED": "true"}}
+
+Each configuration runs in a fresh interpreter, since settings are read at import time.
+--mode record stores every model response under --responses; --mode replay answers from there
+without network or API key, so a matrix can be re-scored offline (configurations that send
+requests never recorded show up as replay misses).
+
+benchmarks/fixtures holds a two-student gold set, a two-configuration matrix and its recorded
+responses, so the harness runs offline (tests/test_evaluate.py replays it):
+    python benchmarks/evaluate.py --gold benchmarks/fixtures/gold.jsonl --configs benchmarks/fixtures/configs.json \
+        --mode replay --responses benchmarks/fixtures/responses
+After a prompt or request change, re-record it with --mode record against a model (or a stand-in
+server via GEMINI_BASE_URL) that grades s1 correct and s2 wrong.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# USD per million tokens (input, output); override with --prices
+DEFAULT_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
+def load_gold(path):
+    """Gold items with paths made absolute"""
+    base = os.path.dirname(os.path.abspath(path))
+    absolute = lambda p: p if os.path.isabs(p) else os.path.join(base, p)
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item["concept_sheet"] = absolute(item["concept_sheet"])
+            for role in ("questions", "solutions", "submissions"):
+                item[role] = [absolute(p) for p in item.get(role, [])]
+            items.append(item)
+    return items
+
+def concept_status(correct, tested):
+    if tested == 0:
+        return "not_tested"
+    if correct == tested:
+        return "mastered"
+    return "partial" if correct else "not_mastered"
+
+def grade_gold(gold_path, out_path):
+    """Worker: grade every gold item under the current environment and write one record per student"""
+    sys.path.insert(0, ROOT)
+    from app.services.orchestrator import run_pipeline
+    from app.services.runs import load_manifest
+
+    with open(out_path, "w", encoding="utf-8") as out:
+        for item in load_gold(gold_path):
+            started = time.time()
+            try:
+                result = run_pipeline(item["concept_sheet"], item["questions"], item["solutions"], item["submissions"],
+                                      student_id=item["student_id"])
+                manifest = load_manifest(result["run_id"]) or {}
+                error = None if result.get("analysis_table") else "no results"
+            except Exception as e:
+                manifest, error = {}, str(e)
+            problems = [p["result"] for page in manifest.get("pages", []) for p in page["problems"]]
+            out.write(json.dumps({
+                "student_id": item["student_id"],
+                "seconds": time.time() - started,
+                "error": error,
+                "problems": [{"concept_id": p.get("concept_id"), "is_correct": bool(p.get("is_correct"))} for p in problems],
+                "concepts": list(manifest.get("parsed_concepts", {}).get("concepts", {})),
+                "usage": manifest.get("usage", []),
+            }) + "\n")
+            out.flush()
+
+def score(expected, graded):
+    """(concept hits, verdict hits, problems expected, status hits, statuses expected) of one student"""
+    wanted = expected.get("problems", [])
+    got = graded["problems"]
+    concept_hits = verdict_hits = 0
+    for i, problem in enumerate(wanted):
+        if i < len(got):
+            concept_hits += str(got[i]["concept_id"]) == str(problem["concept_id"])
+            verdict_hits += got[i]["is_correct"] == bool(problem["is_correct"])
+
+    statuses = expected.get("statuses", {})
+    status_hits = 0
+    for concept_id, status in statuses.items():
+        mine = [p for p in got if str(p["concept_id"]) == str(concept_id)]
+        status_hits += concept_status(sum(p["is_correct"] for p in mine), len(mine)) == status
+    return concept_hits, verdict_hits, len(wanted), status_hits, len(statuses)
+
+def cost(usage, prices):
+    total = 0.0
+    for entry in usage:
+        input_price, output_price = prices.get(entry["model"], (0.0, 0.0))
+        total += (entry["input_tokens"] * input_price + entry["output_tokens"] * output_price) / 1e6
+    return total
+
+def summarize(name, gold, records, prices):
+    """Accuracy and per-student cost figures of one configuration"""
+    by_student = {record["student_id"]: record for record in records}
+    sums = [0, 0, 0, 0, 0]
+    for item in gold:
+        record = by_student.get(item["student_id"], {"problems": []})
+        sums = [a + b for a, b in zip(sums, score(item.get("expected", {}), record))]
+    concept_hits, verdict_hits, problems, status_hits, statuses = sums
+    n = max(len(records), 1)
+    usage = [entry for record in records for entry in record["usage"]]
+    seconds = sorted(record["seconds"] for record in records) or [0.0]
+    return {
+        "config": name,
+        "students": len(records),
+        "failed": sum(1 for record in records if record["error"]),
+        "concept_accuracy": concept_hits / problems if problems else None,
+        "verdict_accuracy": verdict_hits / problems if problems else None,
+        "status_accuracy": status_hits / statuses if statuses else None,
+        "latency_mean": statistics.mean(seconds),
+        "latency_p95": seconds[min(len(seconds) - 1, int(round(0.95 * (len(seconds) - 1))))],
+        "model_seconds": sum(entry["seconds"] for entry in usage) / n,
+        "calls": sum(entry["calls"] for entry in usage) / n,
+        "input_tokens": sum(entry["input_tokens"] for entry in usage) / n,
+        "output_tokens": sum(entry["output_tokens"] for entry in usage) / n,
+        "bytes_sent": sum(entry["bytes_sent"] for entry in usage) / n,
+        "cost": cost(usage, prices) / n,
+        "replay_misses": sum(entry["replay_misses"] for entry in usage),
+    }
+
+def run_config(name, overrides, args):
+    """Grade the gold set in a fresh interpreter with the configuration's settings"""
+    env = dict(os.environ, **{key: str(value) for key, value in overrides.items()})
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    if args.mode != "live":
+        env["RESPONSES_MODE"] = args.mode
+        env["RESPONSES_DIR"] = os.path.abspath(args.responses)
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "records.jsonl")
+        log_path = os.path.join(tmp, "worker.log")
+        with open(log_path, "w", encoding="utf-8") as log:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", "--gold", args.gold, "--out", out_path],
+                                  cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if proc.returncode != 0:
+            with open(log_path, "r", encoding="utf-8") as log:
+                raise RuntimeError(f"configuration {name} failed:\n{log.read()[-2000:]}")
+        with open(out_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+def pick(rows, tolerance):
+    """Fastest (then cheapest) configuration whose accuracies are within tolerance of the baseline"""
+    baseline = rows[0]
+    metrics = ("concept_accuracy", "verdict_accuracy", "status_accuracy")
+    def holds(row):
+        return all(baseline[m] is None or (row[m] is not None and row[m] >= baseline[m] - tolerance) for m in metrics)
+    eligible = [row for row in rows if holds(row) and not row["replay_misses"]]
+    return min(eligible, key=lambda row: (row["latency_mean"], row["cost"]))["config"] if eligible else None
+
+def percent(value):
+    return "-" if value is None else f"{value:.1%}"
+
+def print_table(rows):
+    print("| config | concept | verdict | status | latency s (mean/p95) | model s | calls | tokens in/out | KB sent | $/student | misses |")
+    print("|---|---|---|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        print(f"| {row['config']} | {percent(row['concept_accuracy'])} | {percent(row['verdict_accuracy'])} | "
+              f"{percent(row['status_accuracy'])} | {row['latency_mean']:.2f}/{row['latency_p95']:.2f} | "
+              f"{row['model_seconds']:.2f} | {row['calls']:.1f} | {row['input_tokens']:.0f}/{row['output_tokens']:.0f} | "
+              f"{row['bytes_sent'] / 1024:.0f} | {row['cost']:.5f} | {row['replay_misses']} |")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gold", required=True, help="labeled gold set (JSONL)")
+    parser.add_argument("--configs", help="JSON map of configuration name -> settings (default: current settings only)")
+    parser.add_argument("--mode", choices=["live", "record", "replay"], default="live")
+    parser.add_argument("--responses", default="eval_responses", help="recorded responses directory (record/replay)")
+    parser.add_argument("--prices", help="JSON map of model -> [input, output] USD per million tokens")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="accuracy drop still accepted against the baseline")
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        grade_gold(args.gold, args.out)
+        return 0
+
+    configs = {"current": {}}
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+    prices = dict(DEFAULT_PRICES)
+    if args.prices:
+        with open(args.prices, "r", encoding="utf-8") as f:
+            prices.update({model: tuple(price) for model, price in json.load(f).items()})
+
+    gold = load_gold(args.gold)
+    rows = []
+    for name, overrides in configs.items():
+        print(f"[Eval] {name}: grading {len(gold)} students ({args.mode})", file=sys.stderr)
+        rows.append(summarize(name, gold, run_config(name, overrides, args), prices))
+
+    print_table(rows)
+    choice = pick(rows, args.tolerance)
+    print(f"\nFastest configuration without an accuracy regression: {choice or 'none'}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"mode": args.mode, "configs": configs, "results": rows, "choice": choice}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Import-time profile of the API process.
+
+Runs `python -X importtime` in a fresh interpreter for each module and reports the total
+and the slowest imports, so regressions in cold start show up before deployment.
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --top 15 --budget-ms 800 app.main
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ["app.main", "app.services.orchestrator"]
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def profile(module, runs=3):
+    """Best-of-`runs` import profile of one module: (total microseconds, {name: (self, cumulative)})"""
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+        entries = {}
+        for line in proc.stderr.splitlines():
+            match = _LINE.match(line)
+            if match:
+                entries[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+        total = entries.get(module, (0, 0))[1]
+        if best is None or total < best[0]:
+            best = (total, entries)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list by cumulative time")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=None, help="exit with status 1 if any module exceeds this")
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        total, entries = profile(module, args.runs)
+        print(f"\n{module}: {total / 1000:.1f} ms (best of {args.runs})")
+        print(f"  {'cumulative ms':>13}  {'self ms':>8}  module")
+        slowest = sorted(entries.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in slowest[:args.top]:
+            print(f"  {cumulative_us / 1000:>13.1f}  {self_us / 1000:>8.1f}  {name}")
+        heavy = [name for name in ("cv2", "numpy", "google.genai") if name in entries]
+        print(f"  heavy modules loaded: {', '.join(heavy) or 'none'}")
+        if args.budget_ms is not None and total / 1000 > args.budget_ms:
+            print(f"  OVER BUDGET ({args.budget_ms} ms)")
+            over_budget = True
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == "__main__":
+    main()
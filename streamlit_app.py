@@ -1,6 +1,9 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import json
 import time
 from pathlib import Path
 import base64
@@ -65,17 +68,103 @@ API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 API_ENDPOINTS = {
     "health": f"{API_BASE_URL}/api/health",
     "analyze": f"{API_BASE_URL}/api/analyze",
+    "jobs": f"{API_BASE_URL}/api/jobs",
     "results": f"{API_BASE_URL}/api/results"
 }
 
+HEALTH_CACHE_TTL = 30       # seconds a health check result is reused across reruns
+RESULT_CACHE_TTL = 15 * 60  # seconds downloaded result files are reused
+POLL_INTERVAL = 1.0         # seconds between job progress requests
+JOB_TIMEOUT = 600           # seconds before the UI stops waiting for a job
+DEADLINE_MARGIN = 15        # seconds of JOB_TIMEOUT kept for fetching the (partial) results
+PREVIEW_MAX_EDGE = 480      # pixels on the long edge of upload previews
+DEFAULT_UPLOAD_EDGE = 1600  # pixels on the long edge of compressed uploads
+UPLOAD_JPEG_QUALITY = 85
+TABLE_EXTENSIONS = {'.csv', '.json', '.md', '.xlsx'}  # concept sheets parsed as tables, not images
+
+@st.cache_resource
+def get_session():
+    """One pooled HTTP session for the whole app (keep-alive, retries on idempotent requests)"""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=HEALTH_CACHE_TTL, show_spinner=False)
 def check_api_health():
     """Check if the API server is running"""
     try:
-        response = requests.get(API_ENDPOINTS["health"], timeout=5)
+        response = get_session().get(API_ENDPOINTS["health"], timeout=5)
         return response.status_code == 200
     except:
         return False
 
+def download_result(url):
+    """Download a result file; returns its text or None"""
+    response = get_session().get(url, timeout=30)
+    if response.status_code != 200:
+        return None
+    return response.content.decode('utf-8')
+
+@st.cache_data(ttl=RESULT_CACHE_TTL, show_spinner=False)
+def fetch_cached_result(url, run_id):
+    """Download a result file of one run once; keyed by run, so a later grading never gets another's file"""
+    return download_result(url)
+
+def fetch_result(url, run_id=None):
+    """Result file text; only results that belong to a run are cached, older APIs reuse file names"""
+    return fetch_cached_result(url, run_id) if run_id else download_result(url)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def fetch_bundle(url):
+    """
+    Download a run's results (table, analysis, per-problem JSON) in one compressed response.
+    Bundle URLs never change content, so they are kept without expiry; returns None on failure.
+    """
+    response = get_session().get(url, timeout=30)
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def make_thumbnail(data, max_edge=PREVIEW_MAX_EDGE):
+    """Downscale an uploaded image for preview so full-size scans are never sent to the browser"""
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((max_edge, max_edge))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+def compress_upload(uploaded, long_edge, grayscale):
+    """
+    Resize an uploaded image to long_edge, optionally convert it to grayscale and re-encode it as JPEG.
+    Returns (filename, bytes, mime type, original (width, height)); documents and tables are sent unchanged.
+    """
+    data = uploaded.getvalue()
+    ext = Path(uploaded.name).suffix.lower()
+    if ext == '.pdf':
+        return uploaded.name, data, "application/pdf", None
+    if ext in TABLE_EXTENSIONS:
+        return uploaded.name, data, uploaded.type or "application/octet-stream", None
+    image = Image.open(io.BytesIO(data))
+    original_size = list(image.size)
+    # Multi-page TIFFs keep all their pages
+    if getattr(image, "n_frames", 1) > 1:
+        return uploaded.name, data, uploaded.type or "image/tiff", original_size
+    image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+    image = image.convert("L" if grayscale else "RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+    compressed = buffer.getvalue()
+    # Never send a re-encode that came out larger than the original
+    if len(compressed) >= len(data):
+        return uploaded.name, data, uploaded.type or "application/octet-stream", original_size
+    return f"{Path(uploaded.name).stem}.jpg", compressed, "image/jpeg", original_size
+
 def display_header():
     """Display the main header"""
     st.markdown('<h1 class="main-header">🧮 Auto Math Grader System</h1>', unsafe_allow_html=True)
@@ -101,10 +190,24 @@ def display_sidebar():
         
         **Supported formats:**
         - JPG, JPEG, PNG, BMP, TIFF
-        - Max 10MB per file
+        - Multi-page PDF / TIFF for questions and solutions
+        - Max 10MB per image, 50MB per document
         - Max 5 question-solution pairs
         """)
         
+        st.header("⚙️ Upload Settings")
+        compress = st.checkbox(
+            "Compress images before upload",
+            value=True,
+            help="Resize and re-encode images in the browser session before sending them. Much faster on slow networks."
+        )
+        long_edge = st.slider(
+            "Maximum image size (long edge, px)", 800, 3200, DEFAULT_UPLOAD_EDGE, step=200,
+            disabled=not compress
+        )
+        grayscale = st.checkbox("Convert to grayscale", value=True, disabled=not compress)
+        upload_settings = {"compress": compress, "long_edge": long_edge, "grayscale": grayscale}
+        
         st.header("🔧 System Status")
         
         # Check API health
@@ -129,6 +232,7 @@ def display_sidebar():
         - [GitHub Repository](#)
         - [Report Issues](#)
         """)
+    return upload_settings
 
 def validate_uploaded_files(concept_sheet, questions, solutions):
     """Validate uploaded files"""
@@ -153,25 +257,37 @@ def validate_uploaded_files(concept_sheet, questions, solutions):
         errors.append("Maximum 5 question-solution pairs allowed")
     
     # Check file types
-    allowed_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
+    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
+    allowed_extensions = image_extensions | {'.pdf'}
     
     if concept_sheet:
         ext = Path(concept_sheet.name).suffix.lower()
-        if ext not in allowed_extensions:
-            errors.append("Concept sheet must be an image file")
+        if ext not in image_extensions | TABLE_EXTENSIONS:
+            errors.append("Concept sheet must be an image or a CSV, JSON, Markdown or XLSX table")
     
     for i, q in enumerate(questions or []):
         ext = Path(q.name).suffix.lower()
         if ext not in allowed_extensions:
-            errors.append(f"Question {i+1} must be an image file")
+            errors.append(f"Question {i+1} must be an image or PDF file")
     
     for i, s in enumerate(solutions or []):
         ext = Path(s.name).suffix.lower()
         if ext not in allowed_extensions:
-            errors.append(f"Solution {i+1} must be an image file")
+            errors.append(f"Solution {i+1} must be an image or PDF file")
     
     return errors
 
+def show_preview(uploaded, caption):
+    """Preview an uploaded image; multi-page documents are listed by name only"""
+    ext = Path(uploaded.name).suffix.lower()
+    if ext == '.pdf':
+        st.info(f"📄 {caption}: {uploaded.name} (multi-page document)")
+        return
+    if ext in TABLE_EXTENSIONS:
+        st.info(f"📊 {caption}: {uploaded.name} (concept table, read without the vision model)")
+        return
+    st.image(make_thumbnail(uploaded.getvalue()), caption=caption, width='stretch')
+
 def display_file_upload():
     """Display file upload interface"""
     st.header("📁 Upload Files")
@@ -184,24 +300,24 @@ def display_file_upload():
         st.markdown('<div class="upload-section">', unsafe_allow_html=True)
         concept_sheet = st.file_uploader(
             "Upload your concept sheet template",
-            type=['jpg', 'jpeg', 'png', 'bmp', 'tiff'],
+            type=['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'csv', 'json', 'md', 'xlsx'],
             key="concept_sheet",
-            help="This is the template that will be filled with results"
+            help="This is the template that will be filled with results; a CSV/JSON/Markdown/XLSX table "
+                 "with id, name, description and example columns skips image parsing"
         )
         st.markdown('</div>', unsafe_allow_html=True)
         
         if concept_sheet:
             st.success(f"✅ Uploaded: {concept_sheet.name}")
             # Show preview
-            image = Image.open(concept_sheet)
-            st.image(image, caption="Concept Sheet Preview", width='stretch')
+            show_preview(concept_sheet, "Concept Sheet Preview")
     
     with col2:
         st.subheader("❓ Questions")
         st.markdown('<div class="upload-section">', unsafe_allow_html=True)
         questions = st.file_uploader(
-            "Upload question images (1-5 files)",
-            type=['jpg', 'jpeg', 'png', 'bmp', 'tiff'],
+            "Upload question images or PDFs (1-5 files)",
+            type=['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'tif', 'pdf'],
             accept_multiple_files=True,
             key="questions",
             help="Upload handwritten math questions"
@@ -212,8 +328,7 @@ def display_file_upload():
             st.success(f"✅ Uploaded {len(questions)} question(s)")
             # Show previews
             for i, q in enumerate(questions[:3]):  # Show first 3
-                image = Image.open(q)
-                st.image(image, caption=f"Question {i+1}", width='stretch')
+                show_preview(q, f"Question {i+1}")
             if len(questions) > 3:
                 st.info(f"... and {len(questions) - 3} more questions")
     
@@ -221,8 +336,8 @@ def display_file_upload():
     st.subheader("✏️ Solutions")
     st.markdown('<div class="upload-section">', unsafe_allow_html=True)
     solutions = st.file_uploader(
-        "Upload solution images (1-5 files)",
-        type=['jpg', 'jpeg', 'png', 'bmp', 'tiff'],
+        "Upload solution images or PDFs (1-5 files)",
+        type=['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'tif', 'pdf'],
         accept_multiple_files=True,
         key="solutions",
         help="Upload handwritten solutions corresponding to the questions"
@@ -233,57 +348,129 @@ def display_file_upload():
         st.success(f"✅ Uploaded {len(solutions)} solution(s)")
         # Show previews
         for i, s in enumerate(solutions[:3]):  # Show first 3
-            image = Image.open(s)
-            st.image(image, caption=f"Solution {i+1}", width='stretch')
+            show_preview(s, f"Solution {i+1}")
         if len(solutions) > 3:
             st.info(f"... and {len(solutions) - 3} more solutions")
     
     return concept_sheet, questions, solutions
 
-def analyze_files(concept_sheet, questions, solutions):
-    """Send files to API for analysis"""
-    if not check_api_health():
-        st.error("❌ API server is not running. Please start the server first.")
-        return None
-    
-    # Prepare files for API
+def render_event(event, progress_bar, status_text, problems_area):
+    """Update the progress widgets for one job event"""
+    if event["type"] == "stage":
+        stage_messages = {
+            "concepts": ("📋 Reading the concept sheet...", 10),
+            "grading": ("✏️ Grading problems...", 20),
+            "synthesis": ("🧠 Writing the final analysis...", 90),
+            "local_summary": ("⏱️ Time budget running out, summarizing the graded problems...", 90),
+        }
+        message, progress = stage_messages.get(event["stage"], (f"🔄 {event['stage']}...", None))
+        status_text.text(message)
+        if progress is not None:
+            progress_bar.progress(progress)
+    elif event["type"] == "problem":
+        result = event.get("result", {})
+        icon = "⏳" if result.get("pending") else "✅" if result.get("is_correct") else "❌"
+        concept = result.get("concept_name") or "Unknown concept"
+        with problems_area.expander(f"{icon} Problem {event['problem']} · {concept}"):
+            st.write(result.get("status_summary", ""))
+            if result.get("analysis"):
+                st.caption(result["analysis"])
+        progress_bar.progress(min(85, 20 + 5 * event["problem"]))
+    elif event["type"] == "error":
+        st.error(f"❌ {event.get('message', 'Analysis failed')}")
+
+def prepare_upload_files(concept_sheet, questions, solutions, upload_settings):
+    """Build the multipart file list, compressing images if enabled; also returns original dimensions"""
     files = []
+    dimensions = {"concept_sheet": None, "questions": [], "solutions": []}
+    raw_bytes = sent_bytes = 0
+    
+    def add(field, uploaded):
+        nonlocal raw_bytes, sent_bytes
+        raw_bytes += uploaded.size
+        if upload_settings and upload_settings.get("compress"):
+            name, data, mime, size = compress_upload(uploaded, upload_settings["long_edge"], upload_settings["grayscale"])
+            files.append((field, (name, data, mime)))
+            sent_bytes += len(data)
+        else:
+            files.append((field, uploaded))
+            sent_bytes += uploaded.size
+            size = None
+        return size
     
     # Add concept sheet
     if concept_sheet:
-        files.append(('concept_sheet', concept_sheet))
+        dimensions["concept_sheet"] = add('concept_sheet', concept_sheet)
     
     # Add questions (multiple files)
-    if questions:
-        for q in questions:
-            files.append(('questions', q))
+    for q in questions or []:
+        dimensions["questions"].append(add('questions', q))
     
-    # Add solutions (multiple files)  
-    if solutions:
-        for s in solutions:
-            files.append(('solutions', s))
+    # Add solutions (multiple files)
+    for s in solutions or []:
+        dimensions["solutions"].append(add('solutions', s))
+    
+    return files, dimensions, raw_bytes, sent_bytes
+
+def analyze_files(concept_sheet, questions, solutions, upload_settings=None):
+    """Submit files as a background job and show per-problem results while it runs"""
+    if not check_api_health():
+        st.error("❌ API server is not running. Please start the server first.")
+        return None
+    
+    # Prepare files for API
+    files, dimensions, raw_bytes, sent_bytes = prepare_upload_files(concept_sheet, questions, solutions, upload_settings)
+    if sent_bytes < raw_bytes:
+        st.caption(f"📦 Upload size: {sent_bytes / 1e6:.1f} MB (compressed from {raw_bytes / 1e6:.1f} MB)")
     
-    # Create progress bar
+    # Create progress widgets
     progress_bar = st.progress(0)
     status_text = st.empty()
+    st.subheader("✏️ Problems graded so far")
+    problems_area = st.container()
+    session = get_session()
     
     try:
         status_text.text("🔄 Sending files to API...")
-        progress_bar.progress(20)
+        progress_bar.progress(5)
         
-        # Send request to API
-        response = requests.post(API_ENDPOINTS["analyze"], files=files, timeout=300)
-        progress_bar.progress(80)
-        
-        if response.status_code == 200:
-            result = response.json()
-            progress_bar.progress(100)
-            status_text.text("✅ Analysis completed!")
-            return result
-        else:
+        # Submit the job; the API answers as soon as the uploads are stored
+        response = session.post(
+            API_ENDPOINTS["jobs"],
+            files=files,
+            data={"original_dimensions": json.dumps(dimensions)},
+            # The API returns partial results rather than running past the time we wait
+            headers={"X-Deadline-Seconds": str(JOB_TIMEOUT - DEADLINE_MARGIN)},
+            timeout=120
+        )
+        if response.status_code != 200:
             error_msg = response.json().get('detail', 'Unknown error')
             st.error(f"❌ Analysis failed: {error_msg}")
             return None
+        job_id = response.json()["job_id"]
+        
+        # Poll for new events only and render them as they arrive
+        since = 0
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            job = session.get(f"{API_ENDPOINTS['jobs']}/{job_id}", params={"since": since}, timeout=10).json()
+            for event in job["events"]:
+                render_event(event, progress_bar, status_text, problems_area)
+            since = job["next"]
+            
+            if job["status"] == "completed":
+                progress_bar.progress(100)
+                status_text.text("✅ Analysis completed!")
+                return job["result"]
+            if job["status"] == "failed":
+                st.error(f"❌ Analysis failed: {job.get('error') or 'Unknown error'}")
+                return None
+            time.sleep(POLL_INTERVAL)
+        
+        # Stop the job so it doesn't keep paying for model calls nobody will see
+        session.delete(f"{API_ENDPOINTS['jobs']}/{job_id}", timeout=10)
+        st.error("❌ Request timed out. The analysis is taking too long.")
+        return None
             
     except requests.exceptions.Timeout:
         st.error("❌ Request timed out. The analysis is taking too long.")
@@ -295,6 +482,12 @@ def analyze_files(concept_sheet, questions, solutions):
         progress_bar.empty()
         status_text.empty()
 
+def result_file_url(url):
+    """Absolute URL of a result file; the API returns per-run paths under /api/results"""
+    if url.startswith("/"):
+        return f"{API_BASE_URL}{url}"
+    return f"{API_ENDPOINTS['results']}/{url.split('/')[-1]}"
+
 def display_results(result):
     """Display analysis results"""
     st.header("📊 Analysis Results")
@@ -304,9 +497,15 @@ def display_results(result):
     
     # Success message
     st.markdown('<div class="success-box">', unsafe_allow_html=True)
-    st.success("🎉 Analysis completed successfully!")
+    if result.get("partial"):
+        st.warning(f"⏱️ {result.get('message', 'Partial results')}: the summary below was computed without the written analysis.")
+    else:
+        st.success("🎉 Analysis completed successfully!")
     st.markdown('</div>', unsafe_allow_html=True)
     
+    # One request for the table, the analysis and the problem results (older APIs serve them separately)
+    bundle = fetch_bundle(result_file_url(result["bundle_url"])) if result.get("bundle_url") else None
+    
     # Create tabs for different result types
     tab1, tab2 = st.tabs(["📊 Analysis Table", "📝 Detailed Analysis"])
     
@@ -318,12 +517,11 @@ def display_results(result):
             try:
                 # Extract filename from URL
                 filename = analysis_table_url.split('/')[-1]
-                table_url = f"{API_ENDPOINTS['results']}/{filename}"
+                table_url = result_file_url(analysis_table_url)
                 
-                # Download and display table
-                response = requests.get(table_url)
-                if response.status_code == 200:
-                    table_content = response.content.decode('utf-8')
+                # Download (cached) and display table
+                table_content = bundle["analysis_table"] if bundle else fetch_result(table_url, result.get("run_id"))
+                if table_content is not None:
                     st.markdown(table_content)
                     
                     # Download button
@@ -347,12 +545,11 @@ def display_results(result):
             try:
                 # Extract filename from URL
                 filename = analysis_url.split('/')[-1]
-                text_url = f"{API_ENDPOINTS['results']}/{filename}"
+                text_url = result_file_url(analysis_url)
                 
-                # Download and display text
-                response = requests.get(text_url)
-                if response.status_code == 200:
-                    analysis_text = response.content.decode('utf-8')
+                # Download (cached) and display text
+                analysis_text = bundle["detailed_analysis"] if bundle else fetch_result(text_url, result.get("run_id"))
+                if analysis_text is not None:
                     st.text_area("Analysis Report", analysis_text, height=400)
                     
                     # Download button
@@ -372,7 +569,7 @@ def display_results(result):
 def main():
     """Main application function"""
     display_header()
-    display_sidebar()
+    upload_settings = display_sidebar()
     
     # Check if API is running
     if not check_api_health():
@@ -413,9 +610,8 @@ def main():
                 for s in solutions:
                     s.seek(0)
             
-            # Analyze files
-            with st.spinner("🔄 Analyzing files... This may take a few minutes."):
-                result = analyze_files(concept_sheet, questions, solutions)
+            # Analyze files; results for each problem appear while the job runs
+            result = analyze_files(concept_sheet, questions, solutions, upload_settings)
             
             if result:
                 display_results(result)
@@ -0,0 +1,96 @@
+"""
+Local stand-in for the parts of the Gemini API the media cache relies on: resumable file upload,
+generateContent that resolves file references, and forgetting files the way the service does after
+their retention period (or for a different API key).
+"""
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInGemini:
+    def __init__(self):
+        self.files = {}
+        self.pending = {}
+        self.calls = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def forget(self):
+        """Drop every uploaded file, as the service does once they expire"""
+        with self.lock:
+            self.files.clear()
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                command = self.headers.get("X-Goog-Upload-Command", "")
+                if command == "start":
+                    return self._start_upload(json.loads(body or b"{}"))
+                if "upload" in command:
+                    return self._finish_upload(body)
+                if self.path.split("?")[0].endswith(":generateContent"):
+                    return self._generate(json.loads(body))
+                self._reply(404, {"error": {"code": 404, "message": "Unknown path", "status": "NOT_FOUND"}})
+
+            def _start_upload(self, request):
+                upload_id = uuid.uuid4().hex
+                with standin.lock:
+                    standin.pending[upload_id] = request.get("file", {})
+                self._reply(200, {}, {"x-goog-upload-url": f"{standin.url}upload/session/{upload_id}"})
+
+            def _finish_upload(self, data):
+                upload_id = self.path.rstrip("/").split("/")[-1]
+                name = f"files/{uuid.uuid4().hex[:12]}"
+                uri = f"{standin.url}v1beta/{name}"
+                with standin.lock:
+                    meta = standin.pending.pop(upload_id, {})
+                    standin.files[uri] = data
+                file = {"name": name, "uri": uri, "mimeType": meta.get("mimeType", "image/png"),
+                        "sizeBytes": str(len(data)), "state": "ACTIVE"}
+                self._reply(200, {"file": file}, {"x-goog-upload-status": "final"})
+
+            def _generate(self, request):
+                parts = [part for content in request.get("contents", []) for part in content.get("parts", [])]
+                # The SDK renames the part keys but passes dict values through unchanged
+                uris = [data.get("fileUri") or data.get("file_uri") for data in (part.get("fileData") for part in parts) if data]
+                with standin.lock:
+                    standin.calls.append({"files": uris, "inline": sum("inlineData" in part for part in parts)})
+                    missing = [uri for uri in uris if uri not in standin.files]
+                if missing:
+                    return self._reply(403, {"error": {
+                        "code": 403, "status": "PERMISSION_DENIED",
+                        "message": f"You do not have permission to access the File {missing[0]} or it may not exist."}})
+                self._reply(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 1, "totalTokenCount": 11},
+                })
+
+        return Handler
@@ -0,0 +1,27 @@
+import os
+from app.services.analytics import AnalyticsStore
+
+def manifest(run_id, correct, parent=None):
+    return {
+        "run_id": run_id,
+        "parent_run_id": parent,
+        "class_id": "c1",
+        "student_id": "alice",
+        "parsed_concepts": {"concepts": {"1": {"name": "Linear equations"}}},
+        "pages": [{"problems": [{"result": {"concept_id": 1, "is_correct": correct, "error_type": "calculation"}}]}],
+    }
+
+def test_database_is_created_on_first_use(tmp_path):
+    path = str(tmp_path / "analytics" / "store.sqlite3")
+    store = AnalyticsStore(path)
+    assert not os.path.exists(path)
+    assert store.record_run(manifest("a" * 32, True))
+    assert os.path.exists(path)
+
+def test_revision_replaces_parent_counts():
+    store = AnalyticsStore(":memory:")
+    store.record_run(manifest("a" * 32, False))
+    assert not store.record_run(manifest("a" * 32, False))
+    store.record_run(manifest("b" * 32, True, parent="a" * 32))
+    [concept] = store.class_concepts("c1")
+    assert (concept["tested"], concept["correct"]) == (1, 1)
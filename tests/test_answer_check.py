@@ -0,0 +1,79 @@
+import pytest
+from app.services.answer_check import check_answer, final_answer, normalize, split_answers, verify_verdict
+
+@pytest.mark.parametrize("raw, expected", [
+    ("x = 4", "4"),
+    ("  X = 4. ", "4"),
+    ("3 × 2", "3*2"),
+    ("x² − 1", "x^2-1"),
+    ("√2", "sqrt(2)"),
+    ("2 or 3", "2,3"),
+])
+def test_normalize(raw, expected):
+    assert normalize(raw) == expected
+
+def test_split_answers_orders_solutions():
+    assert split_answers("x = 3, x = 2") == ["2", "3"]
+    assert split_answers("{2; 3}") == ["2", "3"]
+
+@pytest.mark.parametrize("student, reference, equivalent, method", [
+    ("x = 4", "4", True, "exact"),
+    ("0.333", "1/3", True, "numeric"),
+    ("0.5", "1/3", False, "numeric"),
+    ("3 or 2", "x = 2, x = 3", True, "set"),
+    ("2, 3.0001", "3, 2", True, "numeric set"),
+    ("2, 3, 4", "3, 2", False, "set"),
+    ("", "4", None, "missing"),
+])
+def test_check_answer_numeric_and_text(student, reference, equivalent, method):
+    result = check_answer(student, reference)
+    assert (result["equivalent"], result["method"]) == (equivalent, method)
+
+def test_words_are_left_to_the_model():
+    assert check_answer("no solution", "x = 2")["equivalent"] is None
+
+def test_final_answer_takes_last_right_hand_side():
+    assert final_answer("2x + 5 = 13\n2x = 8\nx = 4") == "x = 4"
+    assert normalize(final_answer("2x = 8\n8/2 = 4")) == "4"
+    assert final_answer("") == ""
+
+def test_verify_verdict_regrades_accepted_wrong_answer():
+    result = {"student_transcription": "2x = 8\nx = 5", "correct_answer": "x = 4", "is_correct": True}
+    verdict = verify_verdict(result)
+    assert verdict["local"] is False and verdict["regrade"]
+
+def test_verify_verdict_only_flags_rejected_right_answer():
+    result = {"student_transcription": "x = 4", "correct_answer": "x = 4", "is_correct": False}
+    verdict = verify_verdict(result)
+    assert not verdict["agrees"] and not verdict["regrade"]
+
+@pytest.fixture(scope="module")
+def symbolic_workers():
+    from app.services.answer_check import WORKERS, sympy_available, warm_up
+    if not sympy_available():
+        pytest.skip("sympy not installed")
+    assert warm_up(wait=True)
+    return WORKERS
+
+@pytest.mark.parametrize("student, reference, equivalent", [
+    ("2(x+1)", "2x+2", True),
+    ("2(x+1)", "2x+1", False),
+    ("x^2 - 1 = 0", "(x-1)(x+1) = 0", True),
+    ("x^3/3 + C", "x^3/3 + 5 + C", True),
+    ("x^3/3", "x^3/3 + C", False),
+    ("x^3/3 + k", "x^3/3 + C", True),
+    # c and k are only an integration constant as a standalone term of both answers
+    ("2k", "3k", False),
+    ("5c", "c", False),
+    ("2c+1", "c+1", False),
+    ("x+k", "x", False),
+])
+def test_symbolic_equivalence(symbolic_workers, student, reference, equivalent):
+    assert check_answer(student, reference, budget=10)["equivalent"] is equivalent
+
+def test_overrun_is_killed_and_not_memoized(symbolic_workers):
+    result = check_answer("sin(x)^2 + cos(x)^2", "1", budget=0.0001)
+    assert result == {"equivalent": None, "method": "timeout"}
+    # The killed worker was replaced and the timeout was not cached as the answer
+    assert symbolic_workers.wait_ready()
+    assert check_answer("sin(x)^2 + cos(x)^2", "1", budget=10)["equivalent"] is True
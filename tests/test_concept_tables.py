@@ -0,0 +1,79 @@
+import pytest
+from app.services.concept_tables import ConceptTableError, is_concept_table, parse_concept_table
+
+def write(tmp_path, name, text, encoding="utf-8"):
+    path = tmp_path / name
+    path.write_bytes(text.encode(encoding))
+    return str(path)
+
+def names(parsed):
+    return {concept_id: concept["name"] for concept_id, concept in parsed["concepts"].items()}
+
+def test_csv_with_aliased_headers(tmp_path):
+    path = write(tmp_path, "sheet.csv", 'Concept ID,Concept Name,Description,Example\n1,Linear equations,Solve ax+b=c,2x+3=7\n2,Fractions,"Add, simplify",1/2+1/3\n')
+    parsed = parse_concept_table(path)
+    assert parsed["total_concepts"] == 2
+    assert parsed["concepts"]["2"] == {"id": 2, "name": "Fractions", "description": "Add, simplify", "example": "1/2+1/3"}
+
+def test_semicolon_csv_in_cp1252(tmp_path):
+    path = write(tmp_path, "sheet.csv", "id;name\n1;Théorème de Pythagore\n2;Aires\n", encoding="cp1252")
+    assert names(parse_concept_table(path)) == {"1": "Théorème de Pythagore", "2": "Aires"}
+
+def test_markdown_reads_first_pipe_table(tmp_path):
+    path = write(tmp_path, "sheet.md", "# Sheet\n\n| No. | Concept | Details |\n|---|:--|---|\n| 1 | Slope | rise/run |\n| 2 | Area | a*b |\n\n| id | name |\n|---|---|\n| 9 | Ignored |\n")
+    parsed = parse_concept_table(path)
+    assert names(parsed) == {"1": "Slope", "2": "Area"}
+    assert parsed["concepts"]["1"]["description"] == "rise/run"
+
+def test_markdown_with_the_repo_concept_sheet_headers(tmp_path):
+    path = write(tmp_path, "sheet.md", "| Concept No. | Concept (With Explanation) | Example | Status |\n|---|---|---|---|\n"
+                 "| 1 | Slope: rise over run | m = 2/4 | |\n| 2 | Area of a rectangle | 3*4 | |\n")
+    parsed = parse_concept_table(path)
+    assert names(parsed) == {"1": "Slope: rise over run", "2": "Area of a rectangle"}
+    assert parsed["concepts"]["2"]["example"] == "3*4"
+
+@pytest.mark.parametrize("text, expected", [
+    ('[{"id": 1, "name": "Slope"}, {"concept_name": "Area"}]', {"1": "Slope", "2": "Area"}),
+    ('{"concepts": {"1": "Slope", "3": {"name": "Area"}}}', {"1": "Slope", "3": "Area"}),
+    ('{"4": {"title": "Volume"}}', {"4": "Volume"}),
+])
+def test_json_shapes(tmp_path, text, expected):
+    assert names(parse_concept_table(write(tmp_path, "sheet.json", text))) == expected
+
+def test_unnamed_column_is_not_the_id(tmp_path):
+    path = write(tmp_path, "sheet.csv", ",name\n7,Slope\n8,Area\n")
+    assert names(parse_concept_table(path)) == {"1": "Slope", "2": "Area"}
+
+def test_rows_without_id_continue_numbering(tmp_path):
+    path = write(tmp_path, "sheet.csv", "id,name\n5,Slope\n,Area\n,Volume\n")
+    assert names(parse_concept_table(path)) == {"5": "Slope", "6": "Area", "7": "Volume"}
+
+@pytest.mark.parametrize("name, text, message", [
+    ("sheet.csv", "foo,bar\n1,2\n", "header row"),
+    ("sheet.csv", "id,title\n1,A\n1,B\n", "used twice"),
+    ("sheet.csv", "id,name\nx1,Slope\n", "whole numbers"),
+    ("sheet.csv", "id,name\n1.5,Slope\n", "whole numbers"),
+    ("sheet.csv", "id,name\n0,Slope\n", "start at 1"),
+    ("sheet.csv", "id,name\n1,\n", "no name"),
+    ("sheet.csv", "id,name\n", "no concepts"),
+    ("sheet.md", "no table here\n", "empty"),
+    ("sheet.json", "text", "not valid JSON"),
+    ("sheet.json", '"Slope"', "list of concepts"),
+])
+def test_unusable_sheets_are_rejected(tmp_path, name, text, message):
+    with pytest.raises(ConceptTableError, match=message):
+        parse_concept_table(write(tmp_path, name, text))
+
+def test_only_table_extensions_are_tables():
+    assert is_concept_table("Sheet.CSV") and is_concept_table("sheet.markdown")
+    assert not is_concept_table("sheet.png")
+
+def test_xlsx_first_sheet(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["Number", "Topic"])
+    workbook.active.append([1, "Slope"])
+    workbook.active.append([2.0, "Area"])
+    path = str(tmp_path / "sheet.xlsx")
+    workbook.save(path)
+    assert names(parse_concept_table(path)) == {"1": "Slope", "2": "Area"}
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+from app.services.crop_filter import CropFilter
+
+PAGE_SHAPE = (1400, 1000)
+
+def text_crop(tmp_path, name, text, y=20, width=900, height=60):
+    image = np.full((height, width), 255, np.uint8)
+    cv2.putText(image, text, (10, height - 18), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2)
+    path = str(tmp_path / f"{name}.png")
+    cv2.imwrite(path, image)
+    return {"path": path, "box": (40, y, width, height), "page_shape": PAGE_SHAPE}
+
+def test_one_line_problem_at_top_of_page_is_kept(tmp_path):
+    crop_filter = CropFilter()
+    crop = text_crop(tmp_path, "p1", "1. Solve 2x + 5 = 13")
+    assert crop_filter.filter([crop]) == [crop]
+    assert crop_filter.dropped == []
+
+def test_header_repeated_on_later_page_is_dropped(tmp_path):
+    crop_filter = CropFilter()
+    header = "Algebra Unit Test - Name: ______________"
+    first = text_crop(tmp_path, "h1", header)
+    second = text_crop(tmp_path, "h2", header)
+    assert crop_filter.filter([first]) == [first]
+    assert crop_filter.filter([second]) == []
+    assert crop_filter.dropped == [{"path": second["path"], "reason": "repeated header strip"}]
+
+def test_header_with_changing_page_number_is_dropped(tmp_path):
+    crop_filter = CropFilter()
+    first = text_crop(tmp_path, "h1", "Algebra Unit Test - Name: _______  Page 1")
+    second = text_crop(tmp_path, "h2", "Algebra Unit Test - Name: _______  Page 2")
+    crop_filter.filter([first])
+    assert crop_filter.filter([second]) == []
+
+def test_different_one_line_problems_on_two_pages_are_both_kept(tmp_path):
+    crop_filter = CropFilter()
+    first = text_crop(tmp_path, "p1", "1. Solve 2x + 5 = 13")
+    second = text_crop(tmp_path, "p2", "4. Factor x^2 - 9")
+    assert crop_filter.filter([first]) == [first]
+    assert crop_filter.filter([second]) == [second]
+
+def test_blank_crop_is_dropped(tmp_path):
+    path = str(tmp_path / "blank.png")
+    cv2.imwrite(path, np.full((200, 400), 255, np.uint8))
+    crop_filter = CropFilter()
+    assert crop_filter.filter([{"path": path, "box": (0, 600, 400, 200), "page_shape": PAGE_SHAPE}]) == []
+    assert crop_filter.dropped[0]["reason"].startswith("blank")
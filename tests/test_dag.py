@@ -0,0 +1,82 @@
+import contextvars
+import threading
+import time
+import pytest
+from app.services.dag import TaskGraph
+
+current = contextvars.ContextVar("current", default=None)
+
+@pytest.fixture
+def graph():
+    graph = TaskGraph(4, name="test")
+    yield graph
+    graph.shutdown()
+
+def test_dependency_results_are_passed_as_arguments(graph):
+    a = graph.add("a", lambda: 2)
+    b = graph.add("b", lambda x, y: x * y, a, graph.value(21))
+    assert b.result(timeout=5) == 42
+    assert graph.critical_path()[1] == ["a", "b"]
+
+def test_failed_dependency_fails_dependents_without_running_them(graph):
+    ran = []
+
+    def boom():
+        raise ValueError("no concepts")
+
+    failed = graph.add("failed", boom)
+    dependent = graph.add("dependent", lambda value: ran.append(value), failed)
+    downstream = graph.add("downstream", lambda value: ran.append(value), dependent)
+    with pytest.raises(ValueError, match="no concepts"):
+        downstream.result(timeout=5)
+    assert ran == []
+
+def test_tasks_can_add_tasks_while_running(graph):
+    children = []
+
+    def parent():
+        for i in range(3):
+            children.append(graph.add(f"child:{i}", lambda i=i: i * 10))
+        return len(children)
+
+    assert graph.add("parent", parent).result(timeout=5) == 3
+    assert [child.result(timeout=5) for child in children] == [0, 10, 20]
+
+def test_tasks_run_in_the_context_they_were_added_from(graph):
+    current.set("run-1")
+    assert graph.add("read", current.get).result(timeout=5) == "run-1"
+
+def test_independent_tasks_run_concurrently(graph):
+    barrier = threading.Barrier(3, timeout=5)
+    tasks = [graph.add(f"wait:{i}", barrier.wait) for i in range(3)]
+    assert sorted(task.result(timeout=5) for task in tasks) == [0, 1, 2]
+
+def test_grade_pages_bounds_pages_decoded_ahead(monkeypatch, tmp_path):
+    from app.services import orchestrator
+
+    pulled, cropped, max_ahead = [0], [0], [0]
+    lock = threading.Lock()
+
+    def page_pairs():
+        for n in range(12):
+            with lock:
+                pulled[0] += 1
+                max_ahead[0] = max(max_ahead[0], pulled[0] - cropped[0])
+            page = {"digest": f"{n}", "source": f"page{n}.png", "number": 1}
+            yield page, dict(page)
+
+    def slow_crop(index, q_page, s_page, crops_dir, crop_pool=None):
+        time.sleep(0.02)
+        with lock:
+            cropped[0] += 1
+        return [], []
+
+    monkeypatch.setattr(orchestrator, "crop_page_pair", slow_crop)
+    monkeypatch.setattr(orchestrator, "pair_page_crops", lambda *args, **kwargs: ([], []))
+    graph = TaskGraph(4, name="test")
+    try:
+        graded = orchestrator.grade_pages(page_pairs(), graph.value(({}, {})), str(tmp_path), graph)
+    finally:
+        graph.shutdown()
+    assert len(graded["pages"]) == 12
+    assert max_ahead[0] <= orchestrator.PIPELINE_LOOKAHEAD + 1
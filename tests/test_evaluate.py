@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from app.services.usage import request_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+
+spec = importlib.util.spec_from_file_location("evaluate", os.path.join(ROOT, "benchmarks", "evaluate.py"))
+evaluate = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(evaluate)
+
+def row(config, accuracy=1.0, latency=1.0, cost=0.01, misses=0):
+    return {"config": config, "concept_accuracy": accuracy, "verdict_accuracy": accuracy, "status_accuracy": accuracy,
+            "latency_mean": latency, "cost": cost, "replay_misses": misses}
+
+def test_request_key_is_the_same_inline_and_by_handle():
+    data = b"\x89PNG fake crop"
+    digest = hashlib.sha256(data).hexdigest()
+    inline = [{"text": "Grade"}, {"inline_data": {"mime_type": "image/png", "data": base64.b64encode(data).decode()}}]
+    handle = [{"text": "Grade"}, {"file_data": {"file_uri": "https://files/abc", "mime_type": "image/png"}}]
+    resolve = {"https://files/abc": digest}.get
+    assert request_key("m", inline, {"t": 0}) == request_key("m", handle, {"t": 0}, resolve)
+    assert request_key("m", inline, {"t": 0}) != request_key("m", handle, {"t": 0})
+    assert request_key("m", inline, {"t": 0}) != request_key("other", inline, {"t": 0})
+
+def test_score_counts_concepts_verdicts_and_statuses():
+    expected = {"problems": [{"concept_id": 1, "is_correct": True}, {"concept_id": 2, "is_correct": False}],
+                "statuses": {"1": "mastered", "2": "not_mastered", "3": "not_tested"}}
+    graded = {"problems": [{"concept_id": 1, "is_correct": True}, {"concept_id": 1, "is_correct": False}]}
+    # The second problem got the wrong concept, so concept 1 looks partial and concept 2 untested
+    assert evaluate.score(expected, graded) == (1, 2, 2, 1, 3)
+
+def test_pick_prefers_fastest_config_within_tolerance():
+    rows = [row("baseline"), row("lite", accuracy=0.9, latency=0.5), row("cascade", accuracy=0.98, latency=0.7)]
+    assert evaluate.pick(rows, 0.0) == "baseline"
+    assert evaluate.pick(rows, 0.05) == "cascade"
+    assert evaluate.pick(rows, 0.2) == "lite"
+
+def test_pick_skips_configs_with_replay_misses():
+    rows = [row("baseline"), row("lite", latency=0.1, misses=3)]
+    assert evaluate.pick(rows, 0.0) == "baseline"
+
+def test_fixture_matrix_replays_offline(tmp_path):
+    env = {key: value for key, value in os.environ.items() if not key.startswith("GEMINI_")}
+    env["ANALYTICS_DB_PATH"] = str(tmp_path / "analytics.sqlite3")
+    out = tmp_path / "report.json"
+    subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", "evaluate.py"),
+                    "--gold", os.path.join(FIXTURES, "gold.jsonl"), "--configs", os.path.join(FIXTURES, "configs.json"),
+                    "--mode", "replay", "--responses", os.path.join(FIXTURES, "responses"), "--out", str(out)],
+                   cwd=ROOT, env=env, check=True, capture_output=True, timeout=300)
+    report = json.loads(out.read_text())
+    # A replay miss here means a prompt or request changed: re-record the fixtures (see benchmarks/evaluate.py)
+    for result in report["results"]:
+        assert (result["students"], result["failed"], result["replay_misses"]) == (2, 0, 0)
+        assert result["verdict_accuracy"] == result["status_accuracy"] == 1.0
+    assert report["choice"] in report["configs"]
@@ -0,0 +1,25 @@
+import pytest
+from app.services import ingestion
+from app.services.ingestion import iter_role_pairs, page_role
+
+@pytest.mark.parametrize("label, role", [
+    ("Question 3", "question"),
+    ("Q2", "question"),
+    ("Solutions\nx = 4", "solution"),
+    ("Answer key", "solution"),
+    ("S1", "solution"),
+    ("Unit Test 3\nAnswer all questions. Show your working.", None),
+    ("Question 1: Solve and show the solution steps", "question"),
+    ("Name: ____  Write your answers below", None),
+    ("Questions\nSolutions", None),
+    ("", None),
+])
+def test_page_role_reads_headings_only(label, role):
+    assert page_role({"label": label}) == role
+
+def test_marker_mode_alternates_pages_with_instructions(monkeypatch):
+    labels = ["Unit Test 3\nAnswer all questions.", "my working", "Question 2", "Solution 2"]
+    pages = [{"number": n, "source": "scan.pdf", "label": label} for n, label in enumerate(labels, start=1)]
+    monkeypatch.setattr(ingestion, "_chain_pages", lambda paths, dpi: iter(pages))
+    pairs = [(q["number"], s["number"]) for q, s in iter_role_pairs(["scan.pdf"], mode="marker")]
+    assert pairs == [(1, 2), (3, 4)]
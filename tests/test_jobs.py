@@ -0,0 +1,32 @@
+import threading
+import time
+from app.services.admission import AdmissionController
+from app.services.jobs import JobStore
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+def test_every_granted_slot_has_a_running_job():
+    admission = AdmissionController(initial_estimate=1)
+    jobs = JobStore()
+    gate, running, lock = threading.Event(), [0], threading.Lock()
+
+    def grade(on_event=None):
+        with lock:
+            running[0] += 1
+        gate.wait(5)
+
+    total = admission.max_in_flight + admission.max_queue
+    ids = [jobs.submit(admission.run, admission.reserve(f"client-{i}"), grade) for i in range(total)]
+    try:
+        wait_until(lambda: running[0] == admission.max_in_flight)
+        metrics = admission.metrics()
+        assert (metrics["in_flight"], metrics["queue_depth"]) == (admission.max_in_flight, admission.max_queue)
+    finally:
+        gate.set()
+    wait_until(lambda: all(jobs.get(job_id)["status"] == "completed" for job_id in ids))
+    assert running[0] == total and admission.metrics()["in_flight"] == 0
+    jobs.executor.shutdown()
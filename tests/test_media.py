@@ -0,0 +1,59 @@
+import pytest
+from app.services import gemini_client
+from app.services.media import MediaCache, media_scope
+from tests.standin_gemini import StandInGemini
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 8
+
+@pytest.fixture
+def standin(monkeypatch, tmp_path):
+    with StandInGemini() as server:
+        media = MediaCache(str(tmp_path / "media.json"), scope=media_scope("test-key", server.url))
+        monkeypatch.setattr(gemini_client, "GEMINI_API_KEY", "test-key")
+        monkeypatch.setattr(gemini_client, "GEMINI_BASE_URL", server.url)
+        monkeypatch.setattr(gemini_client, "MEDIA", media)
+        monkeypatch.setattr(gemini_client, "MEDIA_UPLOAD_ENABLED", True)
+        monkeypatch.setattr(gemini_client, "MEDIA_INLINE_MAX_BYTES", 0)
+        monkeypatch.setattr(gemini_client, "_client", None)
+        monkeypatch.setattr(gemini_client, "_recorder", None)
+        yield server, media
+
+def contents(tmp_path):
+    path = tmp_path / "question.png"
+    path.write_bytes(PNG)
+    return [{"text": "Grade this"}, gemini_client.image_part(str(path))]
+
+def test_image_is_uploaded_once_and_referenced(standin, tmp_path):
+    server, media = standin
+    first, second = contents(tmp_path), contents(tmp_path)
+    assert first[1] == second[1] and "file_data" in first[1]
+    assert gemini_client.generate("phase1", "gemini-test", first).text == "ok"
+    assert len(server.files) == 1
+    assert server.calls == [{"files": [first[1]["file_data"]["file_uri"]], "inline": 0}]
+    assert (media.stats["uploaded"], media.stats["reused"]) == (1, 1)
+
+def test_forgotten_file_is_discarded_and_sent_inline(standin, tmp_path):
+    server, media = standin
+    parts = contents(tmp_path)
+    server.forget()
+    assert gemini_client.generate("phase1", "gemini-test", parts).text == "ok"
+    assert server.calls[-1] == {"files": [], "inline": 1}
+    assert media.stats["stale"] == 1
+    # The stale handle is gone, so the next request uploads the image again
+    assert contents(tmp_path)[1]["file_data"]["file_uri"] != parts[1]["file_data"]["file_uri"]
+    assert len(server.files) == 1
+
+def test_other_errors_are_not_retried(standin, tmp_path):
+    server, _ = standin
+    with pytest.raises(Exception):
+        gemini_client.generate("phase1", "gemini-test", [{"file_data": {"file_uri": "gs://elsewhere", "mime_type": "image/png"}}])
+    assert len(server.calls) == 1
+
+def test_handles_are_scoped_by_key_and_endpoint(tmp_path):
+    path = str(tmp_path / "media.json")
+    handle = {"name": "files/a", "uri": "https://files/a", "mime_type": "image/png", "expires": 9e12}
+    MediaCache(path, scope=media_scope("key-1", "")).put("digest", handle)
+    other = MediaCache(path, scope=media_scope("key-2", ""))
+    assert other.get("digest") is None
+    other.put("other", dict(handle, uri="https://files/b"))
+    assert MediaCache(path, scope=media_scope("key-1", "")).get("digest") == handle
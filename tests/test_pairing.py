@@ -0,0 +1,53 @@
+import itertools
+import random
+from app.services.pairing import hungarian, pair_crops
+
+def brute_force(cost):
+    n, m = len(cost), len(cost[0])
+    return min(sum(cost[i][cols[i]] for i in range(n)) for cols in itertools.permutations(range(m), n))
+
+def total(cost, assignment):
+    return sum(cost[i][j] for i, j in enumerate(assignment))
+
+def test_hungarian_square_identity():
+    cost = [[0, 1, 1], [1, 0, 1], [1, 1, 0]]
+    assert hungarian(cost) == [0, 1, 2]
+
+def test_hungarian_prefers_global_minimum_over_greedy():
+    # Greedy would give row 0 column 0 (cost 1) and then row 1 column 1 (cost 10)
+    cost = [[1, 2], [2, 10]]
+    assert hungarian(cost) == [1, 0]
+
+def test_hungarian_matches_brute_force():
+    rng = random.Random(7)
+    for n, m in [(1, 1), (2, 3), (3, 3), (3, 5), (4, 4), (5, 6)]:
+        for _ in range(20):
+            cost = [[rng.random() for _ in range(m)] for _ in range(n)]
+            assignment = hungarian(cost)
+            assert len(set(assignment)) == n
+            assert all(0 <= j < m for j in assignment)
+            assert abs(total(cost, assignment) - brute_force(cost)) < 1e-9
+
+def crop(index, y, page_h=1000):
+    # Paths that don't exist have no marker, which leaves the marker term neutral
+    return {"path": f"/nonexistent/crop_{index}.png", "box": (100, y, 600, 80), "page_shape": (page_h, 800)}
+
+def test_pair_crops_pairs_by_layout_and_order():
+    q = [crop(i, 100 + 200 * i) for i in range(3)]
+    s = [crop(10 + i, 110 + 200 * i) for i in range(3)]
+    result = pair_crops(q, s)
+    assert [(q.index(p["question"]), s.index(p["solution"])) for p in result["pairs"]] == [(0, 0), (1, 1), (2, 2)]
+    assert all(0 <= p["confidence"] <= 1 for p in result["pairs"])
+    assert result["unmatched_questions"] == [] and result["unmatched_solutions"] == []
+
+def test_pair_crops_reports_extra_solution_block_instead_of_shifting():
+    q = [crop(0, 100), crop(1, 700)]
+    s = [crop(10, 100), crop(11, 400), crop(12, 700)]
+    result = pair_crops(q, s)
+    assert [(q.index(p["question"]), s.index(p["solution"])) for p in result["pairs"]] == [(0, 0), (1, 2)]
+    assert result["unmatched_solutions"] == [s[1]]
+
+def test_pair_crops_with_one_side_empty():
+    q = [crop(0, 100)]
+    result = pair_crops(q, [])
+    assert result["pairs"] == [] and result["unmatched_questions"] == q
@@ -0,0 +1,16 @@
+import pytest
+from app.services.gemini_client import phase1_config
+from app.services.prompts import PHASE1_TIERS, phase1_tier
+
+@pytest.mark.parametrize("tier", list(PHASE1_TIERS))
+def test_every_tier_returns_the_answers_the_local_check_compares(tier):
+    properties = phase1_config(phase1_tier(tier))["response_schema"]["properties"]
+    assert {"student_transcription", "correct_answer", "is_correct"} <= set(properties)
+
+def test_full_tier_is_not_capped():
+    config = phase1_config(phase1_tier("full"))
+    assert "max_output_tokens" not in config and "thinking_config" not in config
+
+def test_capped_tiers_leave_room_for_thinking():
+    config = phase1_config(phase1_tier("standard"))
+    assert config["max_output_tokens"] == PHASE1_TIERS["standard"]["max_output_tokens"] + config["thinking_config"]["thinking_budget"]
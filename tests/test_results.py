@@ -0,0 +1,21 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.config import settings
+from app.main import app
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "STATIC_OUTPUT_DIR", str(tmp_path))
+    for name in ("analysis_table.md", "analytics.sqlite3", "analytics.sqlite3-wal", "media_handles.json"):
+        (tmp_path / name).write_text("private" if "analysis" not in name else "| table |")
+    return tmp_path
+
+@pytest.mark.parametrize("filename", ["analytics.sqlite3", "analytics.sqlite3-wal", "media_handles.json"])
+def test_only_result_files_are_served(output_dir, filename):
+    client = TestClient(app)
+    assert client.get(f"/api/results/{filename}").status_code == 404
+    assert client.get("/api/results/analysis_table.md").text == "| table |"
+
+@pytest.mark.parametrize("path", [settings.ANALYTICS_DB_PATH, settings.MEDIA_CACHE_PATH])
+def test_local_state_is_kept_out_of_the_output_directory(path):
+    assert not path.startswith(settings.STATIC_OUTPUT_DIR + "/")
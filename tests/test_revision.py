@@ -0,0 +1,34 @@
+import os
+import pytest
+from app.services import gemini_client, orchestrator, runs
+from app.services.analytics import AnalyticsStore
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+@pytest.fixture
+def graded_run(monkeypatch, tmp_path):
+    monkeypatch.setattr(runs, "RUNS_DIR", str(tmp_path))
+    monkeypatch.setattr(gemini_client, "GEMINI_API_KEY", "")
+    monkeypatch.setattr(orchestrator, "ANALYTICS", AnalyticsStore(":memory:"))
+    question = os.path.join(FIXTURES, "question.png")
+    result = orchestrator.run_pipeline(os.path.join(FIXTURES, "concepts.csv"), [question, question],
+                                       [os.path.join(FIXTURES, "solution_s1.png"), os.path.join(FIXTURES, "solution_s2.png")])
+    return result["run_id"]
+
+def test_revision_regrades_pages_left_pending(graded_run):
+    manifest = runs.load_manifest(graded_run)
+    assert len(manifest["pages"]) == 2
+    # As if the parent run's deadline ran out before the second page was graded
+    for problem in manifest["pages"][1]["problems"]:
+        problem["result"] = orchestrator.pending_result(0, "deadline")
+    runs.save_manifest(graded_run, manifest)
+
+    revised = runs.load_manifest(orchestrator.revise_run(graded_run, {})["run_id"])
+    assert [page["reused"] for page in revised["pages"]] == [True, False]
+    assert not any(problem["result"].get("pending") for page in revised["pages"] for problem in page["problems"])
+    assert revised["recomputed_concepts"] == ["1"]
+
+def test_revision_without_changes_reuses_finished_pages(graded_run):
+    revised = runs.load_manifest(orchestrator.revise_run(graded_run, {})["run_id"])
+    assert [page["reused"] for page in revised["pages"]] == [True, True]
+    assert revised["recomputed_concepts"] == []
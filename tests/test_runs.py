@@ -0,0 +1,44 @@
+import json
+import os
+import uuid
+from app.services.runs import sweep_runs
+
+DAY = 86400
+
+def make_run(runs_dir, age_days, now, inputs=None, size=10):
+    run_id = uuid.uuid4().hex
+    path = runs_dir / run_id
+    (path / "inputs").mkdir(parents=True)
+    (path / "inputs" / "question_1.png").write_bytes(b"x" * size)
+    manifest = path / "manifest.json"
+    manifest.write_text(json.dumps({"run_id": run_id, "inputs": inputs or {
+        "concept_sheet": str(path / "inputs" / "question_1.png"), "questions": [], "solutions": [], "submissions": []}}))
+    os.utime(manifest, (now - age_days * DAY, now - age_days * DAY))
+    return run_id
+
+def test_sweep_deletes_runs_past_retention(tmp_path):
+    now = 1_000_000_000.0
+    old, recent = make_run(tmp_path, 40, now), make_run(tmp_path, 5, now)
+    assert sweep_runs(str(tmp_path), retention_days=30, max_mb=0, interval=0, now=now) == [old]
+    assert sorted(os.listdir(tmp_path)) == [recent]
+
+def test_sweep_keeps_parent_whose_inputs_a_kept_revision_reads(tmp_path):
+    now = 2_000_000_000.0
+    parent = make_run(tmp_path, 40, now)
+    shared = str(tmp_path / parent / "inputs" / "question_1.png")
+    make_run(tmp_path, 1, now, inputs={"concept_sheet": shared, "questions": [shared], "solutions": [], "submissions": []})
+    assert sweep_runs(str(tmp_path), retention_days=30, max_mb=0, interval=0, now=now) == []
+    assert parent in os.listdir(tmp_path)
+
+def test_sweep_enforces_size_cap_oldest_first(tmp_path):
+    now = 3_000_000_000.0
+    runs = [make_run(tmp_path, age, now, size=400_000) for age in (3, 2, 1)]
+    deleted = sweep_runs(str(tmp_path), retention_days=0, max_mb=1, interval=0, now=now)
+    assert deleted == sorted(runs[:1])
+    assert sorted(os.listdir(tmp_path)) == sorted(runs[1:])
+
+def test_sweep_is_throttled(tmp_path):
+    now = 4_000_000_000.0
+    sweep_runs(str(tmp_path), retention_days=30, max_mb=0, interval=0, now=now)
+    make_run(tmp_path, 40, now)
+    assert sweep_runs(str(tmp_path), retention_days=30, max_mb=0, interval=600, now=now + 1) == []
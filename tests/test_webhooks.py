@@ -0,0 +1,106 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+from app.services import webhooks
+from app.services.jobs import BatchStore
+from app.services.webhooks import WebhookDispatcher, check_target, sign, verify
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "test-secret"
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.02)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def receiver(tmp_path):
+    """The CLI receiver on a free port, failing its first two deliveries with 503"""
+    port, out = free_port(), tmp_path / "notifications.jsonl"
+    proc = subprocess.Popen([sys.executable, "-m", "app.cli", "receive", "--port", str(port), "--out", str(out),
+                             "--secret", SECRET, "--fail-first", "2"],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        def listening():
+            with socket.socket() as s:
+                return s.connect_ex(("127.0.0.1", port)) == 0
+        wait_until(listening)
+        yield f"http://127.0.0.1:{port}/hook", out
+    finally:
+        proc.kill()
+        proc.wait()
+
+def test_signature_round_trip():
+    body = b'{"type":"job.completed"}'
+    header = sign(SECRET, int(time.time()), body)
+    assert verify(SECRET, header, body)
+    assert not verify(SECRET, header, body + b" ")
+    assert not verify("other-secret", header, body)
+    assert not verify(SECRET, sign(SECRET, int(time.time()) - 3600, body), body)
+    assert not verify(SECRET, "garbage", body) and not verify(SECRET, None, body)
+
+@pytest.mark.parametrize("target", [
+    "http://127.0.0.1:8000/hook", "http://localhost/hook", "http://10.0.0.5/hook",
+    "http://169.254.169.254/latest/meta-data", "http://[::1]/hook", "http://[::ffff:192.168.1.1]/hook",
+])
+def test_internal_targets_are_refused(target):
+    with pytest.raises(ValueError, match="non-public"):
+        check_target(target, secret=SECRET, allowed_hosts=[])
+
+def test_allow_list_admits_listed_hosts_only():
+    assert check_target("http://127.0.0.1:8000/hook", secret=SECRET, allowed_hosts=["127.0.0.1"])
+    with pytest.raises(ValueError, match="not allowed"):
+        check_target("http://93.184.216.34/hook", secret=SECRET, allowed_hosts=["127.0.0.1"])
+
+def test_public_targets_need_a_secret():
+    assert check_target("https://93.184.216.34/hook", secret=SECRET, allowed_hosts=[])
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+        check_target("https://93.184.216.34/hook", secret="", allowed_hosts=[])
+
+def test_local_queues_are_opt_in_and_capped():
+    with pytest.raises(ValueError, match="disabled"):
+        check_target("queue://tests", local_queues=False)
+    assert check_target("queue://tests", local_queues=True) == "queue://tests"
+    dispatcher = WebhookDispatcher(max_local_queues=2)
+    dispatcher.local_queue("a"), dispatcher.local_queue("b"), dispatcher.local_queue("a")
+    with pytest.raises(ValueError, match="limit 2"):
+        dispatcher.local_queue("c")
+
+def test_failed_deliveries_are_retried_until_accepted(receiver):
+    target, out = receiver
+    dispatcher = WebhookDispatcher(retry_seconds=0.05, retry_max_seconds=0.2, secret=SECRET, allowed_hosts=["127.0.0.1"])
+    delivery_id = dispatcher.send(target, "job.completed", {"job_id": "j1"})
+    wait_until(lambda: dispatcher.metrics().get("delivered") == 1)
+    assert (dispatcher.metrics()["retried"], dispatcher.metrics()["pending"]) == (2, 0)
+    [notification] = [json.loads(line) for line in out.read_text().splitlines()]
+    assert (notification["id"], notification["type"], notification["data"]) == (delivery_id, "job.completed", {"job_id": "j1"})
+
+def test_host_rebound_to_internal_address_is_refused_at_delivery(monkeypatch):
+    answers = iter(["93.184.216.34", "127.0.0.1"])
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo",
+                        lambda host, port, **kwargs: [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (next(answers), port))])
+    target = check_target("http://hooks.example.org/hook", secret=SECRET, allowed_hosts=[])
+    dispatcher = WebhookDispatcher(retry_seconds=0.05, secret=SECRET, allowed_hosts=[])
+    dispatcher.send(target, "job.completed", {"job_id": "j1"})
+    wait_until(lambda: dispatcher.metrics().get("failed") == 1)
+    failure = dispatcher.metrics()["recent_failures"][0]
+    assert failure["attempts"] == 1 and "non-public" in failure["error"]
+
+def test_batch_place_can_be_given_back():
+    batches = BatchStore()
+    batch_id = batches.create(1)
+    batches.join(batch_id)
+    with pytest.raises(ValueError):
+        batches.join(batch_id)
+    batches.leave(batch_id)
+    assert batches.join(batch_id)["submitted"] == 1